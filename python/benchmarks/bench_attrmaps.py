@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+#
+# benchmark the loading of the compiled attribute map index
+#
+# Usage:  bench_attrmaps.py [-n NUMBER] [MAPDIR]
+#
+# This times compiling the attribute map files (by default, those of the test IDP in
+# idp/attributemaps) into an AttributeIndex, loading the index from its disk cache instead,
+# and translating an incoming attribute name with the index.
+#
+import os, sys, timeit, argparse, tempfile, shutil
+from pathlib import Path
+
+from nistoar.auth.idp import attrmaps
+
+MAPDIR = Path(__file__).resolve().parents[2] / "idp" / "attributemaps"
+GIVEN = "http://schemas.xmlsoap.org/ws/2005/05/identity/claims/givenname"
+
+def main(args):
+    parser = argparse.ArgumentParser(description="benchmark the attribute map index")
+    parser.add_argument("mapdir", nargs='?', default=str(MAPDIR),
+                        help="the directory containing the attribute maps")
+    parser.add_argument("-n", "--number", type=int, default=200,
+                        help="the number of loads to time")
+    opts = parser.parse_args(args)
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_attrmaps.")
+    try:
+        cache = os.path.join(tmpdir, "index.json")
+        cold = timeit.timeit(lambda: attrmaps.load_attribute_maps(opts.mapdir), number=opts.number)
+        index = attrmaps.load_attribute_maps(opts.mapdir, cache)
+        warm = timeit.timeit(lambda: attrmaps.load_attribute_maps(opts.mapdir, cache),
+                             number=opts.number)
+        print("%d names in %d formats" % (len(index), len(index.formats)))
+        print("compile maps:     %8.2f ms/load" % (1e3 * cold / opts.number))
+        print("load from cache:  %8.2f ms/load (%.1fx faster)" %
+              (1e3 * warm / opts.number, cold / warm))
+
+        number = 1000 * opts.number
+        secs = timeit.timeit(lambda: index.friendly_name(GIVEN), number=number)
+        print("translate a name: %8.3f us" % (1e6 * secs / number))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
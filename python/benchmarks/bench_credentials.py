@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# benchmark the allocation and memory use of Credentials objects
+#
+# Usage:  bench_credentials.py [-n NUMBER]
+#
+# This compares the standard Credentials class with CompactCredentials, timing the
+# construction and JSON serialization of credentials for a typical user and measuring
+# the memory held by a population of them (via tracemalloc).  It also times the first
+# (uncached) and repeated (cached) serialization of credentials with many attributes and
+# compares the available JSON backends and output formats.
+#
+import os, sys, gc, timeit, tracemalloc, argparse
+
+from nistoar.auth import creds, serialize
+
+USER_ATTS = {
+    "userName": "Gurn",
+    "userLastName": "Cranston",
+    "userEmail": "gurn.cranston@nist.gov",
+    "userOU": "Ministry of Funny Walks",
+    "winId": "gcranston"
+}
+
+def memory_per_instance(cls, number):
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    held = [cls("user%d" % i, USER_ATTS, 1.7e9) for i in range(number)]
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del held
+    return used / number
+
+def main(args):
+    parser = argparse.ArgumentParser(description="benchmark Credentials implementations")
+    parser.add_argument("-n", "--number", type=int, default=100000,
+                        help="the number of credentials to create per measurement")
+    opts = parser.parse_args(args)
+
+    results = []
+    for cls in (creds.Credentials, creds.CompactCredentials):
+        alloc = timeit.timeit(lambda: cls("gcranston", USER_ATTS, 1.7e9), number=opts.number)
+        crd = cls("gcranston", USER_ATTS, 1.7e9)
+        ser = timeit.timeit(lambda: crd._to_json(2), number=opts.number // 10)
+        mem = memory_per_instance(cls, opts.number)
+        results.append((alloc, mem))
+        print("%-20s %7.2f us/alloc  %7.2f us/to_json  %7.0f bytes/instance" %
+              (cls.__name__, 1e6 * alloc / opts.number, 1e7 * ser / opts.number, mem))
+
+    (balloc, bmem), (calloc, cmem) = results
+    print("%-20s %7.2fx faster allocation, %.1f%% less memory" %
+          ("  compact:", balloc / calloc, 100.0 * (bmem - cmem) / bmem))
+
+    print()
+    for nattrs in (10, 100, 1000):
+        atts = dict(USER_ATTS)
+        atts.update(("http://schemas.example.org/claims/attr%d" % i, "value %d" % i)
+                    for i in range(nattrs))
+        crd = creds.Credentials("gcranston", atts)
+        number = max(10, opts.number // (10 * nattrs))
+        cold = timeit.timeit(lambda: crd._to_json(2), number=number)
+        crd.to_json()
+        warm = timeit.timeit(crd.to_json, number=number)
+        print("%5d attributes: %10.2f us/to_json (uncached)  %6.2f us/to_json (cached)" %
+              (nattrs, 1e6 * cold / number, 1e6 * warm / number))
+
+    print()
+    atts = dict(USER_ATTS)
+    atts.update(("http://schemas.example.org/claims/attr%d" % i, "value %d" % i)
+                for i in range(20))
+    crd = creds.Credentials("gcranston", atts)
+    backends = ["json"] + (["orjson"] if serialize.orjson else [])
+    for name in backends:
+        serialize.set_backend(name)
+        for label, indent in (("pretty", 2), ("compact", None)):
+            secs = timeit.timeit(lambda: crd._to_json(indent), number=opts.number // 10)
+            print("%-8s %-8s %7.2f us/to_json  %5d bytes" % (name, label,
+                  1e7 * secs / opts.number, len(crd._to_json(indent).encode('utf-8'))))
+    serialize.set_backend()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
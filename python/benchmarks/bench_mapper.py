@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+#
+# benchmark the conversion of SAML attributes into Credentials
+#
+# Usage:  bench_mapper.py [-n NUMBER]
+#
+# This compares the compiled AttributeMapper used by the IDP modules with the hand-written
+# conversion they previously implemented (reproduced below, extended with the multi-valued
+# group and role attributes since added to the mapping), for a typical set of SAML
+# attributes and for one padded with many extra (passed-through) attributes.  It also times
+# the creation of a lazy credentials view and the identity check that typically follows.
+#
+import sys, timeit, argparse
+
+from nistoar.auth.creds import Credentials
+from nistoar.auth.idp import nist_ms as idp
+
+ATTR_NAME = idp.ATTR_NAME
+
+def handwritten_make_credentials(samlattrs, expiration=None):
+    want = [ ATTR_NAME.ID, ATTR_NAME.EMAIL, ATTR_NAME.QNAME, ATTR_NAME.DNAME,
+             ATTR_NAME.GIVEN, ATTR_NAME.FAMILY, ATTR_NAME.OU, ATTR_NAME.DIVNO,
+             ATTR_NAME.ROLE, ATTR_NAME.GROUP, ATTR_NAME.WINID ]
+    id = samlattrs.get(ATTR_NAME.WINID, ["unknown"])[0]
+    attrs = {
+        "userName":     samlattrs.get(ATTR_NAME.GIVEN,  ["unknown"])[0],
+        "userLastName": samlattrs.get(ATTR_NAME.FAMILY, ["unknown"])[0],
+        "userEmail":    samlattrs.get(ATTR_NAME.EMAIL,  ["not-set"])[0],
+        "userOU":       samlattrs.get(ATTR_NAME.OU,     ["not-set"])[0],
+        "role":         samlattrs.get(ATTR_NAME.ROLE,   ["not-set"])[0],
+        "displayName":  samlattrs.get(ATTR_NAME.DNAME,  ["unknown"])[0],
+        "qualifiedName": samlattrs.get(ATTR_NAME.QNAME, ["unknown"])[0],
+        "userGroup":    samlattrs.get(ATTR_NAME.GROUP,  ["not-set"])[0],
+        "userGroups":   tuple(samlattrs.get(ATTR_NAME.GROUP, [])[:100]),
+        "roles":        tuple(samlattrs.get(ATTR_NAME.ROLE,  [])[:100]),
+        "winId":        samlattrs.get(ATTR_NAME.WINID,  ["unknown"])[0],
+    }
+
+    for name in samlattrs:
+        if name not in want:
+            attrs[name] = samlattrs.get(name)[0]
+
+    return Credentials(id, attrs, expiration)
+
+def saml_attributes(nextra):
+    out = dict((name, ["value of " + field]) for field, name in ATTR_NAME._asdict().items())
+    out.update(("http://schemas.example.org/claims/attr%d" % i, ["value %d" % i])
+               for i in range(nextra))
+    return out
+
+def main(args):
+    parser = argparse.ArgumentParser(description="benchmark SAML attribute conversion")
+    parser.add_argument("-n", "--number", type=int, default=100000,
+                        help="the number of conversions to time")
+    opts = parser.parse_args(args)
+
+    for nextra in (0, 10, 100):
+        samlattrs = saml_attributes(nextra)
+        assert handwritten_make_credentials(samlattrs, 1.7e9).to_json() == \
+               idp.make_credentials(samlattrs, 1.7e9).to_json()
+        number = max(10, opts.number // (1 + nextra // 10))
+
+        hand = timeit.timeit(lambda: handwritten_make_credentials(samlattrs, 1.7e9),
+                             number=number)
+        comp = timeit.timeit(lambda: idp.make_credentials(samlattrs, 1.7e9), number=number)
+        lazy = timeit.timeit(lambda: idp.make_lazy_credentials(samlattrs, 1.7e9).is_authenticated(),
+                             number=number)
+        print("%3d extra attributes: %7.2f us hand-written  %7.2f us mapper (%.2fx)  "
+              "%5.2f us lazy id check" % (nextra, 1e6 * hand / number, 1e6 * comp / number,
+                                          hand / comp, 1e6 * lazy / number))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
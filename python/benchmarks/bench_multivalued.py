@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# benchmark the memory used by multi-valued attributes held in Credentials
+#
+# Usage:  bench_multivalued.py [-n NUMBER] [-g GROUPS] [-d DISTINCT]
+#
+# This creates credentials for a population of logged-in users (10000 by default) whose
+# group memberships are drawn from a small number of distinct group lists, as is typical
+# within an organization.  It compares the memory held (measured via tracemalloc) by
+#   * the previous design, which keeps only the first group (and so loses the rest),
+#   * keeping each user's full list of groups as a separate list, and
+#   * the mapper's multi-valued attributes, which share interned tuples.
+#
+import sys, gc, tracemalloc, argparse
+
+from nistoar.auth.creds import Credentials
+from nistoar.auth.idp import nist_ms as idp
+from nistoar.auth.idp.mapper import AttributeMapper
+
+ATTR_NAME = idp.ATTR_NAME
+
+first_only = AttributeMapper({
+    "id": ATTR_NAME.WINID,
+    "attributes": { "userGroup": ATTR_NAME.GROUP },
+    "consume": list(ATTR_NAME)
+})
+multi = AttributeMapper({
+    "id": ATTR_NAME.WINID,
+    "attributes": { "userGroups": { "from": ATTR_NAME.GROUP, "multi": True } },
+    "consume": list(ATTR_NAME)
+})
+
+def naive(samlattrs):
+    return Credentials(samlattrs[ATTR_NAME.WINID][0],
+                       {"userGroups": list(samlattrs[ATTR_NAME.GROUP])})
+
+def saml_attributes(number, ngroups, ndistinct):
+    # each session's attributes are decoded separately (e.g. from its session cookie), so
+    # the strings are distinct objects even when their values are equal
+    for i in range(number):
+        kind = i % ndistinct
+        yield {
+            ATTR_NAME.WINID: ["user%d" % i],
+            ATTR_NAME.GROUP: ["".join(["nist-group-", str(kind), "-", str(g)])
+                              for g in range(ngroups)]
+        }
+
+def memory_per_session(make, number, ngroups, ndistinct):
+    # the SAML attributes are discarded once the credentials are made, so count only what
+    # the credentials keep alive
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    held = [make(s) for s in saml_attributes(number, ngroups, ndistinct)]
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del held
+    return used / number
+
+def main(args):
+    parser = argparse.ArgumentParser(description="benchmark multi-valued attribute memory")
+    parser.add_argument("-n", "--number", type=int, default=10000,
+                        help="the number of sessions to hold")
+    parser.add_argument("-g", "--groups", type=int, default=20,
+                        help="the number of groups each user belongs to")
+    parser.add_argument("-d", "--distinct", type=int, default=25,
+                        help="the number of distinct group lists among the users")
+    opts = parser.parse_args(args)
+
+    print("%d sessions, %d groups per user, %d distinct group lists" %
+          (opts.number, opts.groups, opts.distinct))
+    for label, make in (("first group only", first_only.make_credentials),
+                        ("list per session", naive),
+                        ("interned tuples", multi.make_credentials)):
+        per = memory_per_session(make, opts.number, opts.groups, opts.distinct)
+        print("%-18s %8.0f bytes/session  %8.2f MB per %d sessions" %
+              (label, per, per * opts.number / 1e6, opts.number))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
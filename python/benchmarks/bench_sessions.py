@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# benchmark the session cookie size and per-request cost of the session storage options
+#
+# Usage:  bench_sessions.py [-n NUMBER] [-g GROUPS]
+#
+# This fills a session with the data stored by the service's acs() endpoint after a login
+# (a typical set of SAML attributes plus the other saml* properties) and then times requests
+# that read the session, comparing Flask's default signed-cookie session, the service's
+# compact signed-cookie session (with and without compression), and the server-side memory
+# and SQLite stores.  It reports the size of the cookie the browser must send with each
+# request, the time the service spends per request, and the time to restore the session.
+# For the cookie sessions, it also reports the time to encode and decode the cookie
+# (including getting the signing serializer).
+#
+# The "refresh" rows use sessions with an expiration:  Flask's permanent cookie session, which
+# is re-issued with every request, and the service's sliding expiration mode, which rewrites
+# the session only after half of its lifetime has passed (reporting the writes avoided).
+#
+import os, sys, time, timeit, argparse, tempfile, shutil
+
+from flask import Flask, session
+from flask.sessions import SecureCookieSessionInterface
+
+from nistoar.auth.idp import nist_ms
+from nistoar.auth.wsgi import sessions
+
+ATTR_NAME = nist_ms.ATTR_NAME
+
+def login_data(ngroups):
+    attrs = dict((name, ["value of " + field]) for field, name in ATTR_NAME._asdict().items())
+    attrs[ATTR_NAME.GROUP] = ["nist-group-%d" % g for g in range(ngroups)]
+    return {
+        "samlUserAttrs": attrs,
+        "samlUserAttrsDigest": "0" * 64,
+        "samlNameId": "gurn.cranston@nist.gov",
+        "samlNameIdFormat": "urn:oasis:names:tc:SAML:1.1:nameid-format:emailAddress",
+        "samlNameIdNameQualifier": None,
+        "samlNameIdSPNameQualifier": None,
+        "samlSessionIndex": "_" + "a" * 40,
+        "samlSessionExpiration": int(time.time()) + 3600,
+        "samlAuthenticated": True
+    }
+
+def make_app(store=None):
+    app = Flask(__name__)
+    app.secret_key = "a secret key of a typical length!"
+    if isinstance(store, sessions.SessionStore):
+        app.session_interface = sessions.ServerSideSessionInterface(store)
+    elif store is not None:
+        app.session_interface = store
+
+    @app.route("/whoami")
+    def whoami():
+        if not session.get('samlAuthenticated'):
+            return "anonymous", 401
+        return session['samlUserAttrs'][ATTR_NAME.WINID][0]
+
+    return app
+
+def main(args):
+    parser = argparse.ArgumentParser(description="benchmark session storage")
+    parser.add_argument("-n", "--number", type=int, default=2000,
+                        help="the number of requests to time")
+    parser.add_argument("-g", "--groups", type=int, default=20,
+                        help="the number of groups the user belongs to")
+    opts = parser.parse_args(args)
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_sessions.")
+    try:
+        stores = [("flask cookie", None),
+                  ("compact cookie", sessions.CompactCookieSessionInterface()),
+                  ("uncompressed", sessions.CompactCookieSessionInterface(False)),
+                  ("memory store", sessions.MemorySessionStore()),
+                  ("sqlite store", sessions.SQLiteSessionStore(os.path.join(tmpdir, "s.db"))),
+                  ("flask refresh", SecureCookieSessionInterface()),
+                  ("compact slide", sessions.CompactCookieSessionInterface(True, 0.5)),
+                  ("memory slide", sessions.ServerSideSessionInterface(
+                                                  sessions.MemorySessionStore(), 0.5))]
+        data = login_data(opts.groups)
+        for label, store in stores:
+            app = make_app(store)
+            with app.test_client() as cli:
+                with cli.session_transaction() as sess:
+                    sess.update(data)
+                    if label == "flask refresh":
+                        sess.permanent = True
+                cookie = cli.get_cookie("session").value
+                assert cli.get("/whoami").status_code == 200
+                secs = timeit.timeit(lambda: cli.get("/whoami"), number=opts.number)
+
+            # the cost of restoring the session alone
+            iface = app.session_interface
+            with app.test_request_context(headers={"Cookie": "session="+cookie}) as ctx:
+                load = timeit.timeit(lambda: iface.open_session(app, ctx.request),
+                                     number=opts.number)
+            print("%-14s %6d cookie bytes  %8.1f us/request  %6.1f us/session load" %
+                  (label, len(cookie), 1e6 * secs / opts.number, 1e6 * load / opts.number))
+
+            if getattr(iface, 'sliding', False):
+                print("%-14s %8d writes avoided" % ("", iface.stats()['writes_avoided']))
+            if hasattr(iface, 'get_signing_serializer'):
+                enc = timeit.timeit(lambda: iface.get_signing_serializer(app).dumps(data),
+                                    number=opts.number)
+                dec = timeit.timeit(lambda: iface.get_signing_serializer(app).loads(cookie),
+                                    number=opts.number)
+                print("%-14s %8.1f us/encode  %8.1f us/decode" %
+                      ("", 1e6 * enc / opts.number, 1e6 * dec / opts.number))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+#
+# benchmark the growth of a server-side session store under a steady login rate
+#
+# Usage:  bench_sweeper.py [-l LOGINS] [-t TTL] [-r RATE] [-i INTERVAL]
+#
+# This simulates logins arriving at a steady rate into a memory session store whose sessions
+# expire after TTL seconds of (simulated) time, first with no sweeper (so that expired
+# sessions are only removed if their users return) and then with a sweeper purging the store
+# every INTERVAL seconds.  It reports the number of sessions held and the memory they occupy
+# at the end of the run, along with the longest time a single purge batch held the store's
+# lock (the longest a request thread could be stalled by the sweeper).
+#
+import sys, timeit, argparse, tracemalloc
+from unittest import mock
+
+from nistoar.auth.wsgi import sessions
+from nistoar.auth.sweeper import Sweeper
+
+def login_data(i):
+    return {
+        "samlUserAttrs": {"urn:givenname": ["user%d" % i], "urn:ou": ["ODI"]},
+        "samlNameId": "user%d@nist.gov" % i,
+        "samlAuthenticated": True
+    }
+
+def simulate(opts, sweep):
+    store = sessions.MemorySessionStore()
+    sweeper = Sweeper([store], opts.interval, opts.batch)
+    clock = [0.0]
+    worst = 0.0
+    nextsweep = opts.interval
+
+    tracemalloc.start()
+    with mock.patch("time.time", lambda: clock[0]):
+        for i in range(opts.logins):
+            clock[0] = i / opts.rate
+            store.save("s%d" % i, login_data(i), clock[0] + opts.ttl)
+            if sweep and clock[0] >= nextsweep:
+                nextsweep += opts.interval
+                while True:
+                    t0 = timeit.default_timer()
+                    n = store.purge(sweeper.batch)
+                    worst = max(worst, timeit.default_timer() - t0)
+                    if n < sweeper.batch:
+                        break
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(store), size, peak, worst
+
+def main(args):
+    parser = argparse.ArgumentParser(description="benchmark session sweeping")
+    parser.add_argument("-l", "--logins", type=int, default=100000,
+                        help="the number of logins to simulate")
+    parser.add_argument("-t", "--ttl", type=float, default=600.0,
+                        help="the session lifetime in seconds")
+    parser.add_argument("-r", "--rate", type=float, default=50.0,
+                        help="the number of logins per second")
+    parser.add_argument("-i", "--interval", type=float, default=60.0,
+                        help="the number of seconds between sweeps")
+    parser.add_argument("-b", "--batch", type=int, default=500,
+                        help="the number of sessions purged at a time")
+    opts = parser.parse_args(args)
+
+    print("%d logins at %.0f/s, %.0f s sessions (steady state: %d live sessions)" %
+          (opts.logins, opts.rate, opts.ttl, int(opts.rate * opts.ttl)))
+    for label, sweep in (("no sweeper", False), ("sweeper", True)):
+        count, size, peak, worst = simulate(opts, sweep)
+        print("%-12s %8d sessions  %8.1f MB held  %8.1f MB peak  %8.1f us/longest batch" %
+              (label, count, size / 1e6, peak / 1e6, 1e6 * worst))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
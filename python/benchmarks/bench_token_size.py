@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+# report the sizes of the authentication tokens issued for a typical NIST user
+#
+# Usage:  bench_token_size.py
+#
+# This builds credentials from a sample set of SAML attributes from the NIST IDP (via
+# nist_okta.make_credentials(), which passes through attributes it does not recognize
+# under their full URI names) and compares the size of the token created from all of the
+# attributes with those created with claim profiles and the compact claim encoding applied.
+#
+import os, sys, argparse
+
+from nistoar.auth import creds
+from nistoar.auth.idp import nist_okta
+
+ATTR = nist_okta.ATTR_NAME
+SAML_ATTS = {
+    ATTR.ID:     ["gcranston@nist.gov"],
+    ATTR.EMAIL:  ["gurn.cranston@nist.gov"],
+    ATTR.QNAME:  ["gurn.cranston@nist.gov"],
+    ATTR.DNAME:  ["Cranston, Gurn (Fed)"],
+    ATTR.GIVEN:  ["Gurn"],
+    ATTR.FAMILY: ["Cranston"],
+    ATTR.OU:     ["Ministry of Funny Walks"],
+    ATTR.DIVNO:  ["641"],
+    ATTR.ROLE:   ["Employee"],
+    ATTR.GROUP:  ["oar-curators"],
+    ATTR.WINID:  ["gcranston"]
+}
+
+PROFILES = {
+    "default": {
+        "include": ["userName", "userLastName", "userEmail", ATTR.OU],
+        "rename": {ATTR.OU: "userOU"}
+    },
+    "minimal": {
+        "include": ["userEmail"],
+        "audience": "urn:oar:minimal"
+    }
+}
+
+def main(args):
+    parser = argparse.ArgumentParser(description="report token sizes with claim profiles")
+    parser.parse_args(args)
+
+    cfg = {"secret": "a-sufficiently-long-secret-for-hs256-signing",
+           "claim_profiles": PROFILES}
+    gen = creds.create_default_token_generator(cfg)
+    crd = nist_okta.make_credentials(SAML_ATTS)
+
+    full = len(gen.generate(crd.id, crd))
+    print("%-28s %6d bytes" % ("all attributes", full))
+    for name in PROFILES:
+        size = len(crd.create_token(profile=name))
+        print("%-28s %6d bytes  (%5.1f%% smaller)" % ("profile: "+name, size,
+                                                       100.0 * (full - size) / full))
+
+    compact = dict(cfg, compact=True)
+    gen = creds.create_default_token_generator(compact)
+    crd = nist_okta.make_credentials(SAML_ATTS)
+    sizes = [("compact", len(gen.generate(crd.id, crd)))]
+    sizes += [("compact, profile: "+name, len(crd.create_token(profile=name))) for name in PROFILES]
+    for label, size in sizes:
+        print("%-28s %6d bytes  (%5.1f%% smaller)" % (label, size, 100.0 * (full - size) / full))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
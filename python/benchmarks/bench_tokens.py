@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+#
+# benchmark the generation of authentication tokens
+#
+# Usage:  bench_tokens.py [-n NUMBER]
+#
+# This times the creation of tokens with the different JWTGenerator configurations
+# for a typical set of user credentials.
+#
+import os, sys, timeit, argparse
+
+from nistoar.auth import creds
+
+USER_ATTS = {
+    "userName": "Gurn",
+    "userLastName": "Cranston",
+    "userEmail": "gurn.cranston@nist.gov",
+    "userOU": "Ministry of Funny Walks",
+    "winId": "gcranston"
+}
+
+def time_generator(label, gen, number):
+    crd = creds.Credentials("gcranston", USER_ATTS, tokengen=gen)
+    secs = timeit.timeit(crd.create_token, number=number)
+    print("%-28s %8.2f us/token" % (label, 1e6 * secs / number))
+    return secs
+
+def main(args):
+    parser = argparse.ArgumentParser(description="benchmark token generation")
+    parser.add_argument("-n", "--number", type=int, default=20000,
+                        help="the number of tokens to generate per configuration")
+    opts = parser.parse_args(args)
+
+    cfg = {"secret": "a-sufficiently-long-secret-for-hs256-signing"}
+    base = time_generator("JWTGenerator (pyjwt)", creds.JWTGenerator(cfg), opts.number)
+
+    fast = dict(cfg, encoder="fast")
+    secs = time_generator("JWTGenerator (fast)", creds.JWTGenerator(fast), opts.number)
+    print("%-28s %8.2fx" % ("  speed-up:", base / secs))
+
+    # batches are signed with the prepared key whichever encoder is configured
+    gen = creds.JWTGenerator(cfg)
+    items = [("user%d" % i, USER_ATTS) for i in range(opts.number)]
+    secs = timeit.timeit(lambda: gen.generate_many(items), number=1)
+    print("%-28s %8.2f us/token" % ("generate_many", 1e6 * secs / opts.number))
+    print("%-28s %8.2fx" % ("  speed-up:", base / secs))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,164 @@
+"""
+a module providing a simple in-memory cache used by the authentication services to avoid
+repeating work (like signing tokens) for requests that recur frequently.
+
+The :py:class:`TTLCache` is a bounded, least-recently-used (LRU) cache whose entries can
+also be given an expiration time.  It keeps hit and miss counts so that its effectiveness can
+be monitored.  Entries that expire are also indexed by their expiration time so that
+:py:meth:`TTLCache.purge` can remove them without scanning the whole cache.
+"""
+import time, heapq, itertools, threading
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any, Mapping
+
+_NOTSET = object()
+
+class TTLCache:
+    """
+    a bounded, thread-safe LRU cache whose entries may expire.  When the cache is full, adding
+    a new entry will evict the least recently used one.  An entry that has passed its
+    expiration time is treated as missing (and is removed when it is encountered).
+    """
+
+    def __init__(self, maxsize: int=1024, ttl: float=None):
+        """
+        create the cache
+        :param int maxsize:  the maximum number of entries to hold (default: 1024)
+        :param float   ttl:  the default time in seconds that an entry should remain valid
+                             after it is added.  If None, entries will not expire unless an
+                             expiration time is given explicitly via :py:meth:`put`.
+        """
+        if not isinstance(maxsize, int) or maxsize < 1:
+            raise ValueError("TTLCache: maxsize not a positive int: "+str(maxsize))
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._expiries = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default=None):
+        """
+        return the unexpired value cached for the given key or ``default`` if it is not
+        available.  Calling this counts as a cache hit or miss.
+        """
+        with self._lock:
+            item = self._data.get(key, _NOTSET)
+            if item is not _NOTSET:
+                if item[1] is None or item[1] > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return item[0]
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, expires: float=None):
+        """
+        add a value to the cache.
+        :param       key:  the key to save the value under
+        :param     value:  the value to cache
+        :param float expires:  the epoch time (in seconds) when the entry should expire.  If
+                           not provided, the expiration will be set by the default TTL
+                           set at construction time (if any).
+        """
+        if expires is None and self.ttl is not None:
+            expires = time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            if expires is not None:
+                # the sequence number keeps keys (which may not be orderable) out of comparisons
+                heapq.heappush(self._expiries, (expires, next(self._seq), key))
+                if len(self._expiries) > 2 * len(self._data) + 64:
+                    self._reindex()
+
+    def _reindex(self):
+        # rebuild the expiry index from the current entries, dropping the stale ones left
+        # behind by replaced, discarded, and evicted entries
+        seq = self._seq
+        self._expiries = [(item[1], next(seq), key) for key, item in self._data.items()
+                          if item[1] is not None]
+        heapq.heapify(self._expiries)
+
+    def purge(self, limit: int=None) -> int:
+        """
+        remove entries that have expired, in order of expiration.
+        :param int limit:  the maximum number of entries to remove (bounding the time the 
+                           cache is locked); if None, all expired entries are removed.
+        :return:  the number of entries removed
+        """
+        now = time.time()
+        removed = 0
+        with self._lock:
+            expiries = self._expiries
+            while expiries and expiries[0][0] <= now and (limit is None or removed < limit):
+                exp, _, key = heapq.heappop(expiries)
+                item = self._data.get(key)
+                if item is not None and item[1] == exp:
+                    del self._data[key]
+                    removed += 1
+        return removed
+
+    def pop(self, key: Hashable, default=None):
+        """
+        remove the entry with the given key and return its value (if unexpired) or 
+        ``default``.  This is done atomically, so that when multiple threads pop the same 
+        key, only one will get its value.
+        """
+        with self._lock:
+            item = self._data.pop(key, _NOTSET)
+        if item is _NOTSET or (item[1] is not None and item[1] <= time.time()):
+            return default
+        return item[0]
+
+    def discard(self, key: Hashable):
+        """
+        remove the entry with the given key if it exists
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        remove all entries from the cache.  The hit and miss counts are not reset.
+        """
+        with self._lock:
+            self._data.clear()
+            self._expiries = []
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        item = self._data.get(key)
+        return item is not None and (item[1] is None or item[1] > time.time())
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        the fraction of lookups that were satisfied from the cache (or 0.0 if no lookups
+        have been made).
+        """
+        total = self.hits + self.misses
+        return (self.hits / total) if total else 0.0
+
+    def stats(self) -> Mapping:
+        """
+        return a dictionary of statistics describing the use of this cache
+        """
+        return OrderedDict([
+            ("size",      len(self._data)),
+            ("maxsize",   self.maxsize),
+            ("hits",      self.hits),
+            ("misses",    self.misses),
+            ("evictions", self.evictions),
+            ("hit_rate",  self.hit_rate)
+        ])
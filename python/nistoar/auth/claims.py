@@ -0,0 +1,350 @@
+"""
+a module providing support for tailoring the claims included in authentication tokens to the
+services that will receive them.
+
+By default, a token includes all of the attributes in the user's
+:py:class:`~nistoar.auth.creds.Credentials`, and with some IDPs, this can include many
+attributes named by long URIs.  Because a token is sent with every request to a backend
+service, it pays to keep it small.  A :py:class:`ClaimProfile` projects the credentials onto
+just the claims a particular audience needs, optionally renaming them to shorter names.
+Profiles are configured via the ``claim_profiles`` parameter of the token generator
+configuration, a dictionary mapping profile names to profile descriptions, each of which
+supports the following properties:
+
+``include``
+    (list of str) _optional_.  The names of the credential attributes to include in the token;
+    if not set, all attributes are included.
+``rename``
+    (dict) _optional_.  A mapping of credential attribute names to the claim names they should
+    appear as in the token.
+``audience``
+    (str) _optional_.  The audience identifier for this profile.  If set, it will be included
+    in the token as its ``aud`` claim, and clients can request this profile by this name.
+``endpoints``
+    (list of str) _optional_.  Base URLs (typically entries from the authentication service's
+    ``allowed_service_endpoints``) for the applications this profile should be used for.
+
+The profile named by the ``default_claim_profile`` parameter (or, if that is not set, the
+profile named ``default``) is used when no other profile is selected.
+
+This module also provides a compact claim encoding (see :py:class:`ClaimCodec`) that can be
+turned on via the token generator's ``compact`` parameter.  It replaces well-known attribute
+names with short codes and can DEFLATE-compress the user attributes when they are large.
+Services that accept compact tokens can restore the original attribute names with
+:py:func:`expand_claims`.
+"""
+import json, zlib, base64
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Iterable
+
+from nistoar.base.config import ConfigurationException
+from .serialize import encode_default
+
+DEFAULT_PROFILE = "default"
+
+class ClaimProfile:
+    """
+    a description of the claims to include in a token intended for a particular audience
+    """
+
+    def __init__(self, name: str, include: Iterable[str]=None, rename: Mapping=None,
+                 audience: str=None, endpoints: Iterable[str]=None):
+        """
+        create the profile.
+        :param str      name:  the name of the profile
+        :param list  include:  the names of the attributes to include as claims; if None,
+                               all attributes are included.
+        :param dict   rename:  a mapping of attribute names to the claim names to use in
+                               the token
+        :param str  audience:  the audience identifier to include as the ``aud`` claim
+        :param list endpoints:  the base URLs of the applications this profile applies to
+        """
+        self.name = name
+        self.include = tuple(include) if include is not None else None
+        self.rename = dict(rename) if rename else {}
+        self.audience = audience
+        self.endpoints = tuple(endpoints) if endpoints else ()
+
+    @classmethod
+    def from_config(cls, name: str, config: Mapping):
+        """
+        create a profile from its configuration description
+        :raises ConfigurationException:  if the description is malformed
+        """
+        if not isinstance(config, Mapping):
+            raise ConfigurationException("claim_profiles.%s: not an object" % name)
+        for param in "include endpoints".split():
+            val = config.get(param)
+            if val is not None and (not isinstance(val, list) or
+                                    not all(isinstance(v, str) for v in val)):
+                raise ConfigurationException("claim_profiles.%s.%s: not a list of str" %
+                                             (name, param))
+        if not isinstance(config.get('rename', {}), Mapping):
+            raise ConfigurationException("claim_profiles.%s.rename: not an object" % name)
+        aud = config.get('audience')
+        if aud is not None and not isinstance(aud, str):
+            raise ConfigurationException("claim_profiles.%s.audience: not a str" % name)
+        return cls(name, config.get('include'), config.get('rename'), aud,
+                   config.get('endpoints'))
+
+    def apply(self, claims: Mapping) -> Mapping:
+        """
+        return the projection of the given attributes prescribed by this profile.  
+        :param Mapping claims:  the full set of user attributes
+        """
+        keys = self.include if self.include is not None else claims.keys()
+        out = OrderedDict()
+        for key in keys:
+            if key in claims:
+                out[self.rename.get(key, key)] = claims[key]
+        if self.audience:
+            out['aud'] = self.audience
+        return out
+
+class ClaimProfiles(Mapping):
+    """
+    a registry of :py:class:`ClaimProfile` instances, indexed by name
+    """
+
+    def __init__(self, profiles: Iterable[ClaimProfile]=None, default: str=None):
+        """
+        create the registry
+        :param list profiles:  the profiles to register
+        :param str   default:  the name of the profile to use when no other applies
+        """
+        self._profiles = OrderedDict((p.name, p) for p in (profiles or []))
+        self._byaud = dict((p.audience, p) for p in self._profiles.values() if p.audience)
+        # longest base URL first, so that the most specific endpoint wins
+        self._byep = sorted(((ep, p) for p in self._profiles.values() for ep in p.endpoints),
+                            key=lambda e: len(e[0]), reverse=True)
+        if default is None and DEFAULT_PROFILE in self._profiles:
+            default = DEFAULT_PROFILE
+        if default is not None and default not in self._profiles:
+            raise ConfigurationException("default_claim_profile: no such profile: "+default)
+        self.default = self._profiles.get(default) if default else None
+
+    @classmethod
+    def from_config(cls, config: Mapping):
+        """
+        create the registry from a token generator configuration, using its
+        ``claim_profiles`` and ``default_claim_profile`` parameters
+        """
+        profcfg = config.get('claim_profiles') or {}
+        if not isinstance(profcfg, Mapping):
+            raise ConfigurationException("claim_profiles: not an object")
+        return cls([ClaimProfile.from_config(n, c) for n, c in profcfg.items()],
+                   config.get('default_claim_profile'))
+
+    def select(self, audience: str=None, endpoint: str=None) -> ClaimProfile:
+        """
+        return the profile that should be applied to a token for the given audience or
+        application.  A profile whose name or audience identifier matches ``audience`` is
+        preferred; otherwise, the profile with the most specific endpoint matching the
+        ``endpoint`` URL is chosen.  If neither matches, the default profile is returned
+        (which may be None).
+        :param str audience:  the name or audience identifier requested by the client
+        :param str endpoint:  the URL of the application requesting the token
+        """
+        if audience:
+            prof = self._profiles.get(audience) or self._byaud.get(audience)
+            if prof:
+                return prof
+        if endpoint:
+            for ep, prof in self._byep:
+                if endpoint.startswith(ep):
+                    return prof
+        return self.default
+
+    def __getitem__(self, name):
+        return self._profiles[name]
+
+    def __iter__(self):
+        return iter(self._profiles)
+
+    def __len__(self):
+        return len(self._profiles)
+
+
+#: the version of the compact encoding, recorded in a compact token's ``cf`` claim
+COMPACT_VERSION = 2
+
+#: the versions of the compact encoding that :py:func:`expand_claims` can decode
+SUPPORTED_VERSIONS = frozenset([1, COMPACT_VERSION])
+
+#: the short codes used in compact tokens for well-known attribute names
+SHORT_NAMES = OrderedDict([
+    ("userName",      "gn"),
+    ("userLastName",  "fn"),
+    ("userEmail",     "em"),
+    ("userOU",        "ou"),
+    ("userGroup",     "gr"),
+    ("displayName",   "dn"),
+    ("qualifiedName", "qn"),
+    ("role",          "rl"),
+    ("winId",         "wi"),
+    ("expirationTime", "xt")
+])
+
+#: prefixes of URI attribute names that are abbreviated in compact tokens
+SHORT_PREFIXES = OrderedDict([
+    ("http://schemas.xmlsoap.org/ws/2005/05/identity/claims/", "~s:"),
+    ("http://schemas.xmlsoap.org/",                            "~x:"),
+    ("http://schemas.microsoft.com/ws/2008/06/identity/claims/", "~m:"),
+    ("http://schemas.microsoft.com/",                          "~n:")
+])
+
+#: the registered JWT claims, which are never renamed or compressed
+REGISTERED_CLAIMS = frozenset("iss sub aud exp nbf iat jti".split())
+
+#: the prefix added in compact tokens to attribute names that would otherwise be mistaken
+#: for a short code, an abbreviated name, or one of the format's own claims
+ESCAPE_PREFIX = "~:"
+
+_LONG_NAMES = dict((v, k) for k, v in SHORT_NAMES.items())
+
+# names that cannot appear verbatim in a compact token (names starting with "~", which
+# covers the abbreviations and the escape prefix, are also escaped)
+_RESERVED_NAMES = frozenset(list(_LONG_NAMES) + ["z", "cf"])
+
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+class ClaimCodec:
+    """
+    an encoder for the compact claim format.  In this format:
+
+      * well-known attribute names are replaced with the short codes in :py:data:`SHORT_NAMES`,
+      * common URI prefixes in attribute names are replaced with the abbreviations in
+        :py:data:`SHORT_PREFIXES`,
+      * other attribute names that could be mistaken for one of these codes or
+        abbreviations (or for the ``z`` and ``cf`` claims) are prefixed with
+        :py:data:`ESCAPE_PREFIX`, so that every name can be restored exactly,
+      * if the (renamed) non-registered claims encode to more than a threshold number of
+        bytes, they are replaced with a single ``z`` claim containing their JSON encoding,
+        DEFLATE-compressed and base64url-encoded, and
+      * a ``cf`` claim records the version of the format.
+
+    Registered claims (like ``sub`` and ``exp``) are left untouched so that standard JWT
+    libraries can still check them.
+    """
+
+    def __init__(self, deflate_threshold: int=None):
+        """
+        create the codec
+        :param int deflate_threshold:  the encoded size in bytes of the user attributes
+                                       above which they will be compressed; if None,
+                                       compression is not used.
+        """
+        self.deflate_threshold = deflate_threshold
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        create a codec from the value of a token generator's ``compact`` parameter: either
+        True or a dictionary that may contain a ``deflate_threshold`` (default: 512).
+        """
+        if not isinstance(config, Mapping):
+            config = {}
+        threshold = config.get('deflate_threshold', 512)
+        if threshold is not None and not isinstance(threshold, int):
+            raise ConfigurationException("compact.deflate_threshold: not an int")
+        return cls(threshold)
+
+    def encode(self, claims: Mapping) -> Mapping:
+        """
+        return the compact form of the given claims
+        """
+        out = OrderedDict()
+        attrs = OrderedDict()
+        for key, val in claims.items():
+            if key in REGISTERED_CLAIMS:
+                out[key] = val
+            else:
+                attrs[shorten_name(key)] = val
+
+        if attrs and self.deflate_threshold is not None:
+            data = json.dumps(attrs, separators=(',', ':'), default=encode_default)
+            data = data.encode('utf-8')
+            if len(data) > self.deflate_threshold:
+                comp = zlib.compressobj(9, zlib.DEFLATED, -15)
+                attrs = {"z": _b64url(comp.compress(data) + comp.flush())}
+
+        out.update(attrs)
+        out['cf'] = COMPACT_VERSION
+        return out
+
+    def decode(self, claims: Mapping) -> Mapping:
+        """
+        return the given compact claims with their original names restored
+        """
+        return expand_claims(claims)
+
+def shorten_name(name: str) -> str:
+    """
+    return the compact form of an attribute name
+    """
+    short = SHORT_NAMES.get(name)
+    if short:
+        return short
+    for prefix, abbrev in SHORT_PREFIXES.items():
+        if name.startswith(prefix):
+            return abbrev + name[len(prefix):]
+    if name in _RESERVED_NAMES or name.startswith('~'):
+        return ESCAPE_PREFIX + name
+    return name
+
+def expand_name(name: str, version: int=COMPACT_VERSION) -> str:
+    """
+    return the original form of an attribute name taken from a compact token
+    :param int version:  the version of the compact format the name was encoded with
+    """
+    long = _LONG_NAMES.get(name)
+    if long:
+        return long
+    if name.startswith('~'):
+        if name.startswith(ESCAPE_PREFIX) and version > 1:
+            return name[len(ESCAPE_PREFIX):]
+        for prefix, abbrev in SHORT_PREFIXES.items():
+            if name.startswith(abbrev):
+                return prefix + name[len(abbrev):]
+    return name
+
+def expand_claims(claims: Mapping) -> Mapping:
+    """
+    restore the original attribute names (and inflate any compressed attributes) of the
+    claims from a compact token.  Claims that are not in the compact format are returned
+    unchanged.  Services that receive compact tokens can use this to recover the claims in
+    the same form as a regular token; pass the result to
+    :py:meth:`Credentials.from_claims() <nistoar.auth.creds.Credentials.from_claims>` to
+    recover the user's credentials.
+    :param dict claims:  the claims decoded from a token
+    :raises ValueError:  if the claims are in an unsupported version of the compact format
+                         or the compressed attributes cannot be decoded
+    """
+    version = claims.get('cf')
+    if version is None:
+        return claims
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError("expand_claims(): unsupported compact claim format: "+str(version))
+
+    out = OrderedDict()
+    for key, val in claims.items():
+        if key == 'cf':
+            continue
+        if key == 'z':
+            try:
+                data = zlib.decompress(_b64url_decode(val), -15)
+                attrs = json.loads(data)
+            except (zlib.error, ValueError, TypeError) as ex:
+                raise ValueError("expand_claims(): bad compressed claims: "+str(ex)) from ex
+            for akey, aval in attrs.items():
+                out[expand_name(akey, version)] = aval
+        elif key in REGISTERED_CLAIMS:
+            out[key] = val
+        else:
+            out[expand_name(key, version)] = val
+    return out
@@ -2,15 +2,20 @@
 a module that defines a Credentials object used to capture identity attributes
 for an authenticated user.
 """
-import json, time
+import json, time, types, hashlib, hmac, base64, secrets
 from datetime import datetime
 from collections import UserDict, OrderedDict
-from typing import Any, Iterable, Mapping
+from typing import Any, Iterable, Mapping, List, Tuple
+from collections.abc import MutableMapping
 from abc import ABC, abstractmethod, abstractproperty
 
 import jwt
+from cryptography.hazmat.primitives import serialization
 
 from nistoar.base.config import ConfigurationException
+from .cache import TTLCache
+from . import keys, serialize
+from .claims import ClaimProfiles, ClaimCodec, expand_claims, REGISTERED_CLAIMS
 
 class _FallbackDict(UserDict):
     """
@@ -59,6 +64,13 @@ class TokenGenerator(ABC):
     """
     a class that generates authentication tokens 
     """
+
+    #: the list of revoked tokens consulted when verifying tokens (see :py:meth:`is_revoked`)
+    revocations = None
+
+    #: the :py:class:`~nistoar.auth.claims.ClaimProfiles` available for tailoring tokens
+    claim_profiles = None
+
     def __init__(self, config: Mapping):
         """
         configure this token generator.  The supported parameters depend on
@@ -89,22 +101,146 @@ class TokenGenerator(ABC):
         """
         raise NotImplemented()
 
+    def generate_many(self, items: Iterable[Tuple[str, Mapping]], lifetime=None) -> List[str]:
+        """
+        generate tokens for a batch of subjects.  Implementations may override this to 
+        amortize the per-token setup over the whole batch.  
+        :param items:  an iterable of (subject, data) tuples to generate tokens for
+        :param int lifetime:  the time in seconds until the tokens should expire.
+                              If not given, a configured default will be used.
+        :return:  the list of tokens, in the same order as the input items
+        """
+        return [self.generate(subject, data, lifetime) for subject, data in items]
+
+    def decode(self, token: str) -> Mapping:
+        """
+        verify the given token and return the claims it contains.  
+        :raises jwt.InvalidTokenError:  if the token is invalid or has expired
+        :raises NotImplementedError:    if this generator does not support verification
+        """
+        raise NotImplementedError("token verification not supported by "+type(self).__name__)
+
+    def jwks(self) -> Mapping:
+        """
+        return a JSON Web Key Set (as a dictionary) containing the public keys that can be 
+        used to verify the tokens created by this generator, or None if the generator does
+        not sign with public-key algorithms.
+        """
+        return None
+
+    def is_revoked(self, claims: Mapping) -> bool:
+        """
+        return True if the token with the given claims has been revoked.  This consults 
+        the :py:class:`~nistoar.auth.revoke.RevocationList` set as this generator's 
+        ``revocations`` attribute (if any) using the token's ``jti`` claim.  
+        """
+        revs = self.revocations
+        return bool(revs is not None and claims.get('jti') and revs.is_revoked(claims['jti']))
+
+    def revoke(self, claims: Mapping):
+        """
+        revoke the token with the given claims so that it will no longer be accepted by 
+        :py:meth:`decode`.  This has no effect if this generator has no ``revocations`` list 
+        set or the token has no ``jti`` claim.  
+        """
+        if self.revocations is not None and claims.get('jti'):
+            self.revocations.revoke(claims['jti'], claims.get('exp'))
+
 class JWTGenerator(TokenGenerator):
     """
     a JSON Web Token (JWT) generator.  
+
+    The following configuration parameters are supported:
+
+    ``algorithm``
+        (str) the signing algorithm; if set, it must be HS256, the only algorithm this 
+        generator supports (see :py:class:`AsymmetricJWTGenerator` for others)
+    ``secret``
+        (str) _required_ (unless ``keyring`` or ``keyring_file`` is set).  the HS256 secret 
+        used to sign the tokens
+    ``keyring``
+        (list) an ordered list of HS256 keys, newest first, to allow for key rotation; see
+        :py:class:`~nistoar.auth.keys.Keyring` for the key description format.  Tokens are 
+        signed with the newest key and include its ``kid`` in their header.
+    ``keyring_file``
+        (str) the path to a JSON file containing the list of HS256 keys.  The file is 
+        checked for updates periodically so that keys can be rotated without a restart.
+    ``keyring_grace_period``
+        (int) the number of seconds that tokens signed with a retired key will still be
+        accepted (default: the value of ``lifetime``)
+    ``keyring_check_interval``
+        (int) the minimum number of seconds between checks for updates to ``keyring_file``
+        (default: 60)
+    ``lifetime``
+        (int) the default lifetime of generated tokens in seconds (default: 3600)
+    ``encoder``
+        (str) the encoder to use to create the tokens: either "pyjwt" (default), which
+        uses the general-purpose ``jwt.encode()`` function, or "fast", which uses a
+        specialized encoder with the token header and signing key prepared once at
+        construction time.  Both produce identical tokens.  (Batches created via 
+        :py:meth:`generate_many` always use the specialized encoder.)
+    ``compact``
+        (bool or dict) if set, tokens are created with the compact claim encoding (see 
+        :py:class:`~nistoar.auth.claims.ClaimCodec`), which uses short codes for well-known
+        attribute names.  If a dictionary, its ``deflate_threshold`` sets the size in bytes
+        of the user attributes above which they will be compressed (default: 512; null 
+        turns off compression).  Consumers can expand the claims with 
+        :py:func:`~nistoar.auth.claims.expand_claims`.
     """
 
     def __init__(self, config):
         if config is None:
             config = {}
         super(JWTGenerator, self).__init__(config)
-        self._secret = self.cfg.get('secret')
-        if not self._secret:
-            raise ConfigurationException("missing or empty parameter: secret")
         self._life = self.cfg.get('lifetime', 3600)  # default: 1 hour
         if not isinstance(self._life, int):
-            raise ConfigurationException("wrong type for parameter: secret: "
+            raise ConfigurationException("wrong type for parameter: lifetime: "
                                          "not an int")
+        self._codec = None
+        if self.cfg.get('compact'):
+            self._codec = ClaimCodec.from_config(self.cfg['compact'])
+        self._init_signer()
+
+    def _init_signer(self):
+        # set up the key(s) needed to sign tokens
+        alg = self.cfg.get('algorithm', 'HS256')
+        if alg != 'HS256':
+            raise ConfigurationException("unsupported value for parameter: algorithm: "+
+                                         str(alg)+" (JWTGenerator only supports HS256)")
+        self._keyring = keys.Keyring.from_config(self.cfg, self._life)
+
+        encoder = self.cfg.get('encoder', 'pyjwt')
+        if encoder not in ('pyjwt', 'fast'):
+            raise ConfigurationException("unsupported value for parameter: encoder: "+
+                                         str(encoder))
+        self._fast = encoder == 'fast'
+        self._state = (None,)
+
+    @property
+    def keyring(self) -> keys.Keyring:
+        """
+        the ring of secrets used to sign and verify tokens
+        """
+        return self._keyring
+
+    @property
+    def _secret(self):
+        return self._keyring.current[1]
+
+    def _signing_state(self):
+        # return the data needed to sign with the current key, (re)building it only when the
+        # keyring has changed.  
+        ring = self._keyring
+        ring.refresh()
+        state = self._state
+        if state[0] != ring.version:
+            kid, secret = ring.current
+            headers = {"kid": kid} if kid else None
+            # encode the header and prepare the HMAC key once, the same way pyjwt does it
+            mac = hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256)
+            state = (ring.version, secret, headers, _header_segment("HS256", headers), mac)
+            self._state = state
+        return state
 
     @property
     def lifetime(self):
@@ -114,6 +250,37 @@ class JWTGenerator(TokenGenerator):
         """
         return self._life
 
+    def derive_key(self, label: str) -> Tuple[str, str]:
+        """
+        return an HS256 key derived from the current signing key for a separate purpose 
+        (such as signing refresh tokens).  Tokens signed with a derived key cannot be 
+        verified with the signing key itself.
+        :param str label:  a name for the purpose of the key
+        :return:  the (kid, key) tuple, where kid identifies the signing key it was derived 
+                  from
+        """
+        ring = self._keyring
+        ring.refresh()
+        kid, secret = ring.current
+        return (kid, _derive(secret.encode('utf-8'), label))
+
+    def derived_verification_keys(self, label: str, kid: str=None) -> List[str]:
+        """
+        return the keys derived (via :py:meth:`derive_key`) from the signing keys that are
+        currently acceptable for verifying tokens
+        :param str label:  the name for the purpose of the keys
+        :param str   kid:  the identifier of the signing key the token's key was derived 
+                           from; if None, keys derived from all acceptable keys are returned.
+        """
+        ring = self._keyring
+        ring.refresh()
+        if kid:
+            secret = ring.lookup(kid)
+            secrets = [secret] if secret else []
+        else:
+            secrets = ring.acceptable()
+        return [_derive(s.encode('utf-8'), label) for s in secrets]
+
     def generate(self, subject: str, data: Mapping, lifetime=None) -> str:
         """
         generate the token based on the given data
@@ -126,80 +293,410 @@ class JWTGenerator(TokenGenerator):
             lifetime = self.lifetime
         if not isinstance(lifetime, int):
             raise TypeError("JWTGenerator.generate: lifetime not an int")
+
+        return self._encode(self._make_claimset(subject, data, int(time.time() + lifetime)))
+
+    def generate_many(self, items: Iterable[Tuple[str, Mapping]], lifetime=None) -> List[str]:
+        """
+        generate tokens for a batch of subjects.  The expiration time, the signing key, and
+        the encoded token header are determined once for the whole batch, and each token is
+        then signed directly with the prepared key (regardless of the configured 
+        ``encoder``; the tokens are identical either way).  
+        :param items:  an iterable of (subject, data) tuples to generate tokens for
+        :param int lifetime:  the time in seconds until the tokens should expire.
+                              If not given, the configured default will be used.
+        :return:  the list of tokens, in the same order as the input items
+        """
+        if not lifetime:
+            lifetime = self.lifetime
+        if not isinstance(lifetime, int):
+            raise TypeError("JWTGenerator.generate_many: lifetime not an int")
+        exp = int(time.time() + lifetime)
+        state = self._signing_state()
+        encode = self._fast_encode
+        return [encode(self._make_claimset(subject, data, exp), state) for subject, data in items]
+
+    def _make_claimset(self, subject: str, data: Mapping, exp: int) -> Mapping:
         claimset = dict(data)
-        if 'token' in claimset:
-            del claimset['token']
-        if 'userId' in claimset:
-            del claimset['userId']
+        for key in _NON_CLAIMS:
+            if key in claimset:
+                del claimset[key]
         claimset['sub'] = subject
-        claimset['exp'] = int(time.time() + lifetime)
+        claimset['exp'] = exp
+        claimset['jti'] = secrets.token_urlsafe(12)
+        if self._codec:
+            claimset = self._codec.encode(claimset)
+        return claimset
+
+    def _encode(self, claimset: Mapping, state=None) -> str:
+        # sign the complete set of claims
+        if state is None:
+            state = self._signing_state()
+        if self._fast:
+            return self._fast_encode(claimset, state)
+        return jwt.encode(claimset, state[1], algorithm="HS256", headers=state[2],
+                          json_encoder=serialize.JSONEncoder)
+
+    def _fast_encode(self, claimset: Mapping, state=None) -> str:
+        # sign the claims using the pre-encoded header and pre-keyed HMAC
+        if state is None:
+            state = self._signing_state()
+        msg = state[3] + _payload_segment(claimset)
+        mac = state[4].copy()
+        mac.update(msg)
+        return (msg + b'.' + _b64url(mac.digest())).decode('ascii')
+
+    def decode(self, token: str) -> Mapping:
+        """
+        verify the given token and return the claims it contains.  The token is verified 
+        using the key identified by its ``kid`` header; tokens signed with an older key will 
+        be accepted through that key's grace period.  Claims from tokens in the compact 
+        format are returned expanded.  Refresh tokens (see :py:class:`RefreshTokenManager`)
+        are not accepted.
+        :raises jwt.InvalidTokenError:  if the token is invalid, has expired, has been 
+                                        revoked, or is a refresh token
+        """
+        claims = self._decode(token)
+        if claims.get('typ') == REFRESH_TOKEN_TYPE:
+            raise jwt.InvalidTokenError("Refresh tokens are not accepted as access tokens")
+        if self.is_revoked(claims):
+            raise jwt.InvalidTokenError("Token has been revoked")
+        try:
+            return expand_claims(claims)
+        except ValueError as ex:
+            raise jwt.DecodeError(str(ex)) from ex
+
+    def _decode(self, token: str) -> Mapping:
+        # verify the token's signature and expiration
+        ring = self._keyring
+        ring.refresh()
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid:
+            secret = ring.lookup(kid)
+            if not secret:
+                raise jwt.InvalidSignatureError("Token signed with unrecognized or retired key: "+
+                                                str(kid))
+            return jwt.decode(token, secret, algorithms=["HS256"], options=_DECODE_OPTIONS)
+
+        # no kid: try each acceptable key
+        secrets = ring.acceptable()
+        for secret in secrets[:-1]:
+            try:
+                return jwt.decode(token, secret, algorithms=["HS256"], options=_DECODE_OPTIONS)
+            except jwt.InvalidSignatureError:
+                pass
+        return jwt.decode(token, secrets[-1], algorithms=["HS256"], options=_DECODE_OPTIONS)
+
+# credential attributes that are never included as token claims
+_NON_CLAIMS = ('token', 'refreshToken', 'userId')
+
+# the audience (aud) claim is reported by decode() rather than checked
+_DECODE_OPTIONS = {"verify_aud": False}
+
+#: the value of the ``typ`` claim that marks a refresh token
+REFRESH_TOKEN_TYPE = "refresh"
+
+#: the audience (``aud``) of refresh tokens
+REFRESH_AUDIENCE = "nistoar-auth-refresh"
+
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+def _header_segment(alg: str, headers: Mapping=None) -> bytes:
+    # the encoded JWT header (followed by the separating dot), as pyjwt would encode it
+    hdr = {"typ": "JWT", "alg": alg}
+    hdr.update(headers or {})
+    hdr = json.dumps(hdr, separators=(',', ':'), sort_keys=True)
+    return _b64url(hdr.encode('utf-8')) + b'.'
+
+def _payload_segment(claimset: Mapping) -> bytes:
+    # the encoded JWT payload, as pyjwt would encode it
+    payload = json.dumps(claimset, separators=(',', ':'), default=serialize.encode_default)
+    return _b64url(payload.encode('utf-8'))
+
+def _derive(material: bytes, label: str) -> str:
+    # derive an HS256 key for the given purpose from secret key material
+    return hmac.new(material, label.encode('utf-8'), hashlib.sha256).hexdigest()
+
+class AsymmetricJWTGenerator(JWTGenerator):
+    """
+    a JSON Web Token (JWT) generator that signs tokens with a private key using a public-key
+    algorithm (e.g. RS256, ES256, or EdDSA).  Services that accept the tokens can verify them 
+    using the public key, published via :py:meth:`jwks`, without needing a shared secret.
+    The private key is loaded once at construction time.  Each token's header includes a 
+    ``kid`` value identifying the key that signed it.  
+
+    The following configuration parameters are supported:
+
+    ``algorithm``
+        (str) the signing algorithm; one of those listed in 
+        :py:data:`nistoar.auth.keys.ASYMMETRIC_ALGORITHMS` (default: RS256)
+    ``private_key``
+        (str) the PEM-encoded private key to sign with
+    ``private_key_file``
+        (str) the path to a file containing the PEM-encoded private key (used if 
+        ``private_key`` is not set)
+    ``kid``
+        (str) the identifier for the key (default: the key's RFC 7638 thumbprint)
+    ``lifetime``
+        (int) the default lifetime of generated tokens in seconds (default: 3600)
+    ``encoder``
+        (str) the encoder to use to create the tokens: either "pyjwt" (default) or "fast",
+        which signs with the token header prepared once at construction time (see 
+        :py:class:`JWTGenerator`).  
+
+    The HS256 parameters of :py:class:`JWTGenerator` (``secret``, ``keyring``, and 
+    ``keyring_file``) do not apply and are rejected, and this generator has no 
+    :py:attr:`keyring`.
+    """
+
+    def _init_signer(self):
+        for param in "secret keyring keyring_file".split():
+            if self.cfg.get(param):
+                raise ConfigurationException("parameter not supported with an asymmetric "
+                                             "algorithm: "+param)
+        encoder = self.cfg.get('encoder', 'pyjwt')
+        if encoder not in ('pyjwt', 'fast'):
+            raise ConfigurationException("unsupported value for parameter: encoder: "+
+                                         str(encoder))
+        self._fast = encoder == 'fast'
+
+        self._alg = self.cfg.get('algorithm', 'RS256')
+        self._key = keys.load_private_key(self._alg, self.cfg)
+        self._pubkey = self._key.public_key()
+        jwk = keys.public_jwk(self._alg, self._pubkey, self.cfg.get('kid'))
+        self._kid = jwk['kid']
+        self._headers = {"kid": self._kid}
+        self._state = (None, self._key, self._headers, _header_segment(self._alg, self._headers),
+                       keys.get_algorithm(self._alg))
+        self._jwks = keys.make_jwks([jwk])
+        # the material that keys for other purposes (see derive_key()) are derived from
+        self._material = hashlib.sha256(self._key.private_bytes(
+            serialization.Encoding.DER, serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption())).digest()
+
+    @property
+    def algorithm(self) -> str:
+        """
+        the name of the algorithm used to sign tokens
+        """
+        return self._alg
+
+    @property
+    def kid(self) -> str:
+        """
+        the identifier of the key used to sign tokens
+        """
+        return self._kid
+
+    @property
+    def keyring(self):
+        raise AttributeError("AsymmetricJWTGenerator has no keyring: tokens are signed with "
+                             "a private key")
+
+    @property
+    def _secret(self):
+        raise AttributeError("AsymmetricJWTGenerator has no secret: tokens are signed with "
+                             "a private key")
 
-        return jwt.encode(claimset, self._secret, algorithm="HS256")
+    def _signing_state(self):
+        # the key is fixed, so the state is prepared once at construction time
+        return self._state
+
+    def derive_key(self, label: str) -> Tuple[str, str]:
+        return (self._kid, _derive(self._material, label))
+
+    def derived_verification_keys(self, label: str, kid: str=None) -> List[str]:
+        if kid and kid != self._kid:
+            return []
+        return [_derive(self._material, label)]
+
+    def _encode(self, claimset: Mapping, state=None) -> str:
+        if self._fast:
+            return self._fast_encode(claimset, state)
+        return jwt.encode(claimset, self._key, algorithm=self._alg, headers=self._headers,
+                          json_encoder=serialize.JSONEncoder)
+
+    def _fast_encode(self, claimset: Mapping, state=None) -> str:
+        # sign the claims using the pre-encoded header and the algorithm's signer directly
+        if state is None:
+            state = self._state
+        msg = state[3] + _payload_segment(claimset)
+        return (msg + b'.' + _b64url(state[4].sign(msg, state[1]))).decode('ascii')
+
+    def _decode(self, token: str) -> Mapping:
+        return jwt.decode(token, self._pubkey, algorithms=[self._alg],
+                          options=_DECODE_OPTIONS)
+
+    def jwks(self) -> Mapping:
+        """
+        return a JSON Web Key Set (as a dictionary) containing the public key that can be
+        used to verify the tokens created by this generator.
+        """
+        return self._jwks
+
+class CachingTokenGenerator(TokenGenerator):
+    """
+    a TokenGenerator that wraps another generator and reuses the tokens it has previously
+    generated.  A cached token is returned when a token is requested for the same subject
+    with an identical set of claims and lifetime, as long as the cached token's remaining
+    lifetime is above a configured threshold.
+
+    The following configuration parameters are supported:
+
+    ``size``
+        the maximum number of tokens to cache (default: 1024)
+    ``min_remaining``
+        the minimum time in seconds that a cached token must have left before it
+        expires in order to be reused (default: half of the wrapped generator's lifetime).
+    """
+
+    def __init__(self, generator: TokenGenerator, config: Mapping=None):
+        """
+        wrap a token generator with a cache
+        :param TokenGenerator generator:  the generator to create new tokens with
+        :param dict config:  the cache configuration (see class documentation)
+        """
+        if config is None:
+            config = {}
+        super(CachingTokenGenerator, self).__init__(config)
+        self.generator = generator
+        self._minrem = self.cfg.get('min_remaining', generator.lifetime // 2)
+        if not isinstance(self._minrem, int):
+            raise ConfigurationException("wrong type for parameter: min_remaining: "
+                                         "not an int")
+        self._cache = TTLCache(self.cfg.get('size', 1024))
+
+    @property
+    def lifetime(self):
+        return self.generator.lifetime
+
+    @property
+    def revocations(self):
+        return self.generator.revocations
+
+    @revocations.setter
+    def revocations(self, revs):
+        self.generator.revocations = revs
+
+    def decode(self, token: str) -> Mapping:
+        return self.generator.decode(token)
+
+    def jwks(self) -> Mapping:
+        return self.generator.jwks()
+
+    @property
+    def cache(self) -> TTLCache:
+        """
+        the cache holding the previously generated tokens.  Its hit and miss counts
+        reflect the number of signings that were avoided and required, respectively.
+        """
+        return self._cache
+
+    def stats(self) -> Mapping:
+        """
+        return a dictionary of statistics describing the use of the token cache
+        """
+        return self._cache.stats()
+
+    def generate(self, subject: str, data: Mapping, lifetime=None) -> str:
+        """
+        return a token based on the given data, reusing a previously generated one if
+        possible.
+        :param str  subject:  the subject (i.e. user ID) of the credential
+        :param dict    data:  the data to encode into the token
+        :param int lifetime:  the time in seconds until the token should expire.
+                              If not given, the configured default will be used.
+        """
+        if not lifetime:
+            lifetime = self.lifetime
+        key = (subject, lifetime, _claims_digest(data))
+
+        cached = self._cache.get(key)
+        if cached is not None and not self.is_revoked(cached[1]):
+            return cached[0]
+
+        expires = time.time() + lifetime
+        token = self.generator.generate(subject, data, lifetime)
+        claims = jwt.decode(token, options={"verify_signature": False})
+        self._cache.put(key, (token, {'jti': claims.get('jti')}), expires - self._minrem)
+        return token
+
+def _claims_digest(data: Mapping) -> str:
+    # a digest of the claims that would be included in a token created from the given data
+    claims = dict((k, v) for k, v in data.items() if k not in _NON_CLAIMS)
+    ser = json.dumps(claims, sort_keys=True, separators=(',', ':'), default=_digest_default)
+    return hashlib.sha256(ser.encode('utf-8')).hexdigest()
 
 default_token_generator = None
 default_token_generator_cls = JWTGenerator
 
+def create_token_generator(config: Mapping) -> TokenGenerator:
+    """
+    create a TokenGenerator from the given configuration.  The class is set by 
+    ``default_token_generator_cls`` (JWTGenerator); however, if the configuration's 
+    ``algorithm`` parameter names an asymmetric algorithm (like RS256), an 
+    :py:class:`AsymmetricJWTGenerator` will be created instead.  Any other ``algorithm``
+    value besides HS256 is rejected.  If the configuration 
+    includes a ``cache`` parameter, the generator will be wrapped in a 
+    :py:class:`CachingTokenGenerator` configured with its value.  The claim profiles 
+    configured via ``claim_profiles`` (see :py:mod:`nistoar.auth.claims`) are attached 
+    to the returned generator.
+    @param dict config:  the configuration data to pass to the generator 
+                         constructor.
+    :raises ConfigurationException:  if the configuration is invalid, including if it
+                         requests an unsupported signing ``algorithm``
+    """
+    cls = default_token_generator_cls
+    alg = config.get('algorithm', 'HS256') if config else 'HS256'
+    if alg in keys.ASYMMETRIC_ALGORITHMS:
+        cls = AsymmetricJWTGenerator
+    elif alg != 'HS256':
+        raise ConfigurationException("unsupported value for parameter: algorithm: "+str(alg))
+    gen = cls(config)
+    if config and config.get('cache'):
+        cachecfg = config['cache']
+        if not isinstance(cachecfg, Mapping):
+            cachecfg = {}
+        gen = CachingTokenGenerator(gen, cachecfg)
+    if config and config.get('claim_profiles'):
+        gen.claim_profiles = ClaimProfiles.from_config(config)
+    return gen
+
 def create_default_token_generator(config: Mapping):
     """
     create the TokenGenerator that should be used when a specific 
-    instance is not otherwise specified.  The default class is set to 
-    JWTGenerator.  The created instance will be saved to this module 
-    as the default (``default_token_generator``).
+    instance is not otherwise specified (via :py:func:`create_token_generator`).  
+    The created instance will be saved to this module as the default 
+    (``default_token_generator``).
     @param dict config:  the configuration data to pass to the generator 
                          constructor.
     """
     global default_token_generator
-    default_token_generator = default_token_generator_cls(config)
+    default_token_generator = create_token_generator(config)
     return default_token_generator
 
 UNAUTHENTICATED = "anonymous"
 
-class Credentials(_FallbackDict):
+class _CredentialsBase:
     """
-    a container for identity information about an authenticated user that 
-    can also generated a token containing the same information.
-
-    As a subclass of dict, one can access and update the user attributes 
-    by name using dictionary [name] syntax.  Certain required attributes can 
-    also be accessed via a property syntax (i.e. .name).  
+    the functionality shared by the Credentials implementations, which differ only in 
+    how they store the user attributes.  
     """
+    __slots__ = ()
     _startorder = "userId userEmail userName userLastName".split()
-    _endorder = "token expirationTime".split()
-    __defattrs = {
+    _endorder = "token refreshToken expirationTime".split()
+    _ordered = frozenset(_startorder + _endorder)
+    _toplevel = frozenset("token refreshToken expires since".split())
+    _defattrs = {
         "userEmail": "not@set",
         "userName": "user",
         "userLastName": "unknown"
     }
 
-    def __init__(self, userid: str = UNAUTHENTICATED,
-                 useratts: Mapping[str, Any]=None,
-                 expiration: float=None,
-                 tokengen: TokenGenerator = None):
-        """
-        Create a credentials object for a specified user with a given set of 
-        attributes.
-        :param str        id:  the identifier for the user being set; 
-                               default: "anonymous"
-        :param dict useratts:  a dictionary of user attributes to initialize
-                               this container with.
-        :param float expiration:  the time that the authenticated session is set to 
-                               expire, given as the epoch time in seconds.
-        :param TokenGenerator tokengen:  the token generator to use to create
-                               authentication tokens (via 
-                               :py:meth:`create_token`).  If not set, a 
-                               default will be used.  
-        """
-        global default_token_generator
-
-        defattrs = {"userId": userid}
-        defattrs.update(self.__defattrs)
-        super(Credentials, self).__init__(defattrs)
-
-        if useratts is not None:
-            for key,val in useratts.items():
-                if key not in ['userId']:
-                    self[key] = val
-
+    def _init_session(self, expiration, tokengen):
+        # set the session expiration and token generator
+        self._json = None
         self._expires = None
         if expiration:
             if not isinstance(expiration, (float, int)):
@@ -292,40 +789,69 @@ class Credentials(_FallbackDict):
         ensures a prefered order which determines the order that the attributes
         appear in the JSON output.
         """
-        setkeys = list(super(Credentials, self).keys())
         for key in self._startorder:
-            if key in setkeys:
+            if key in self:
                 yield key
-                setkeys.remove(key)
 
-        for key in setkeys:
-            if key not in self._endorder:
+        ordered = self._ordered
+        for key in super().keys():
+            if key not in ordered:
                 yield key
 
         for key in self._endorder:
-            if key in setkeys:
+            if key in self:
                 yield key
 
     def to_json(self, indent=2):
         """
-        export this credential as a JSON-encoded string
+        export this credential as a JSON-encoded string.  The output is cached until this 
+        credential is next modified.  (Note that modifying an attribute value in place, 
+        such as appending to a list value, is not detected; reassign the attribute instead.)
+        :param int indent:  the indentation to format the output with; if None, the output 
+                            will be compact (with no extra whitespace).
         """
+        cache = self._json
+        if cache is None:
+            cache = self._json = {}
+        out = cache.get(indent)
+        if out is None:
+            out = cache[indent] = self._to_json(indent)
+        return out
+
+    def to_json_with(self, tokens: Mapping, indent=2):
+        """
+        export this credential as a JSON-encoded string as if the given tokens were set as
+        its attributes, without modifying it.  This allows tokens to be returned with 
+        credentials that are shared or immutable (like a :py:class:`CredentialsSnapshot`).
+        The output is not cached.
+        :param dict tokens:  the tokens to include, keyed by attribute name (``token`` 
+                             and/or ``refreshToken``)
+        :param int indent:  the indentation to format the output with; if None, the output 
+                            will be compact (with no extra whitespace).
+        """
+        return self._to_json(indent, tokens)
+
+    def _to_json(self, indent, tokens=None):
         # this serialization provide interoperability with previous Java service
-        userdetails = OrderedDict(self)
-        for key in "token expires since".split():
-            if key in userdetails:
-                del userdetails[key]
-                
+        exclude = self._toplevel
+        userdetails = OrderedDict((k, self[k]) for k in self.keys() if k not in exclude)
         out = OrderedDict([ ("userDetails", userdetails) ])
         
-        if self.get('token'):
-            out['token'] = self['token']
+        get = self.get
+        if tokens:
+            get = lambda k: tokens.get(k) or self.get(k)
+        if get('token'):
+            out['token'] = get('token')
+        if get('refreshToken'):
+            out['refreshToken'] = get('refreshToken')
         if self.expiration_time:
-            out['token'] = self.expiration_time
+            out['expires'] = self.expiration_time
+        elif self.get('expires'):
+            out['expires'] = self['expires']
         if self.get('since'):
             out['since'] = self.get('since')
             
-        return json.dumps(out, indent=indent)
+        return serialize.dumps(out, indent)
 
     def write_json(self, ostrm, indent=2):
         """
@@ -339,31 +865,501 @@ class Credentials(_FallbackDict):
         id = ud.get("userId", "anonymous")
         if "userId" in ud:
             del ud['userId']
-        for key in "token expires since".split():
+        for key in "token refreshToken expires since".split():
             if key in obj:
                 ud[key] = obj[key]
         return cls(id, ud)
 
-    def create_token(self, lifetime=None) -> str:
+    @classmethod
+    def from_claims(cls, claims: Mapping, tokengen: TokenGenerator=None):
+        """
+        create a Credentials object from the claims decoded from a token issued by this 
+        package (in either the regular or compact format)
+        :param dict   claims:  the decoded claims
+        :param TokenGenerator tokengen:  the token generator to attach to the credentials
+        """
+        claims = expand_claims(claims)
+        attrs = OrderedDict((k, v) for k, v in claims.items() if k not in REGISTERED_CLAIMS)
+        return cls(claims.get('sub', UNAUTHENTICATED), attrs, tokengen=tokengen)
+
+    def create_token(self, lifetime=None, profile=None) -> str:
         """
         create a JST token with the information contained in this credential
         :param int lifetime:  the time in seconds until the token should expire.
                               If not given, the configured default will be used.
+        :param profile:       the :py:class:`~nistoar.auth.claims.ClaimProfile` (or the 
+                              name of one configured with the token generator) that selects
+                              the attributes to include as claims.  If not given, the 
+                              generator's default profile, if any, is applied.
         @return  the encoded JWT token
         """
         if not self._gen:
             raise ConfigurationException("No token generator is configured")
-        return self._gen.generate(self.id, self, lifetime)
+        profiles = self._gen.claim_profiles
+        if isinstance(profile, str):
+            if not profiles or profile not in profiles:
+                raise ValueError("create_token(): unknown claim profile: "+profile)
+            profile = profiles[profile]
+        elif profile is None and profiles:
+            profile = profiles.default
 
-    def set_token(self, lifetime=None):
+        data = profile.apply(self) if profile else self
+        return self._gen.generate(self.id, data, lifetime)
+
+    def set_token(self, lifetime=None, profile=None):
         """
         create a JWT token (using :py:meth:`create_token`) and set it as an
         attribute of this credentials object
         :param int lifetime:  the time in seconds until the token should expire.
                               If not given, the configured default will be used.
+        :param profile:       the claim profile (or its name) to apply to the token's claims
         """
         if not self.is_authenticated():
             raise RuntimeError("Credentials token cannot be set for unauthenticated, %s user" %
                                self.id)
-        self['token'] = self.create_token(lifetime)
+        self['token'] = self.create_token(lifetime, profile)
+
+    def snapshot(self):
+        """
+        return an immutable copy of this credential that can be safely shared between 
+        threads and requests
+        :rtype: CredentialsSnapshot
+        """
+        return CredentialsSnapshot(self)
+
+class Credentials(_CredentialsBase, _FallbackDict):
+    """
+    a container for identity information about an authenticated user that 
+    can also generated a token containing the same information.
+
+    As a subclass of dict, one can access and update the user attributes 
+    by name using dictionary [name] syntax.  Certain required attributes can 
+    also be accessed via a property syntax (i.e. .name).  
+    """
+
+    def __init__(self, userid: str = UNAUTHENTICATED,
+                 useratts: Mapping[str, Any]=None,
+                 expiration: float=None,
+                 tokengen: TokenGenerator = None):
+        """
+        Create a credentials object for a specified user with a given set of 
+        attributes.
+        :param str        id:  the identifier for the user being set; 
+                               default: "anonymous"
+        :param dict useratts:  a dictionary of user attributes to initialize
+                               this container with.
+        :param float expiration:  the time that the authenticated session is set to 
+                               expire, given as the epoch time in seconds.
+        :param TokenGenerator tokengen:  the token generator to use to create
+                               authentication tokens (via 
+                               :py:meth:`create_token`).  If not set, a 
+                               default will be used.  
+        """
+        defattrs = {"userId": userid}
+        defattrs.update(self._defattrs)
+        super(Credentials, self).__init__(defattrs)
+
+        if useratts is not None:
+            for key,val in useratts.items():
+                if key not in ['userId']:
+                    self[key] = val
+
+        self._init_session(expiration, tokengen)
+
+    def __setitem__(self, key, val):
+        self._json = None
+        super(Credentials, self).__setitem__(key, val)
+
+    def __delitem__(self, key):
+        self._json = None
+        super(Credentials, self).__delitem__(key)
+
+_UNSET = object()
+
+class CompactCredentials(_CredentialsBase, MutableMapping):
+    """
+    a memory-compact implementation of :py:class:`Credentials`.  The core attributes 
+    (``userId``, ``userEmail``, ``userName``, and ``userLastName``), the expiration time, 
+    and the token generator are stored in slots, and any other attributes are kept in a 
+    small overflow dictionary that is only created when needed.  
+
+    Its attributes, defaults, and JSON output are the same as those of the equivalent 
+    :py:class:`Credentials`, and, as with :py:class:`Credentials`, its length, iteration, 
+    ``items()``, and equality take into account only the attributes that have been set 
+    explicitly (including a core attribute set to its default value), while ``keys()`` 
+    includes the core attributes that fall back to their defaults.  Iteration, however, 
+    visits the set core attributes first rather than in the order they were set.  The 
+    service itself uses :py:class:`Credentials` (or 
+    :py:class:`~nistoar.auth.idp.lazy.LazyCredentials`); this class is for applications that
+    hold many credentials in memory (see ``benchmarks/bench_credentials.py``).
+    """
+    __slots__ = ('_defid', '_id', '_email', '_name', '_lastname', '_expires', '_gen', '_extra',
+                 '_json')
+    _core = { "userId": "_id", "userEmail": "_email", "userName": "_name",
+              "userLastName": "_lastname" }
+
+    def __init__(self, userid: str = UNAUTHENTICATED,
+                 useratts: Mapping[str, Any]=None,
+                 expiration: float=None,
+                 tokengen: TokenGenerator = None):
+        """
+        Create a credentials object for a specified user with a given set of 
+        attributes.  The parameters are the same as for :py:class:`Credentials`.
+        """
+        self._defid = userid
+        self._id = self._email = self._name = self._lastname = _UNSET
+        self._extra = None
+
+        if useratts is not None:
+            for key,val in useratts.items():
+                if key not in ['userId']:
+                    self[key] = val
+
+        self._init_session(expiration, tokengen)
+
+    def get(self, key, val=None):
+        """
+        this is just like the standard dict.get() except that if ``val`` is 
+        provided, it will override the default for a core attribute that has not 
+        been set explicitly.
+        """
+        slot = self._core.get(key)
+        if slot:
+            out = getattr(self, slot)
+            if out is _UNSET:
+                out = self._default(key) if val is None else val
+            return out
+        if self._extra is None:
+            return val
+        return self._extra.get(key, val)
+
+    def __getitem__(self, key):
+        slot = self._core.get(key)
+        if slot:
+            out = getattr(self, slot)
+            return self._default(key) if out is _UNSET else out
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def _default(self, key):
+        return self._defid if key == "userId" else self._defattrs[key]
+
+    def __setitem__(self, key, val):
+        self._json = None
+        slot = self._core.get(key)
+        if slot:
+            setattr(self, slot, val)
+        elif self._extra is None:
+            self._extra = {key: val}
+        else:
+            self._extra[key] = val
+
+    def __delitem__(self, key):
+        self._json = None
+        slot = self._core.get(key)
+        if slot:
+            if getattr(self, slot) is _UNSET:
+                raise KeyError(key)
+            setattr(self, slot, _UNSET)
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        return key in self._core or (self._extra is not None and key in self._extra)
+
+    def __iter__(self):
+        for key, slot in self._core.items():
+            if getattr(self, slot) is not _UNSET:
+                yield key
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for slot in self._core.values() if getattr(self, slot) is not _UNSET) + \
+               (len(self._extra) if self._extra else 0)
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, dict(self.items()))
+
+def _digest_default(obj):
+    # encode values for a content digest:  read-only mappings as objects, anything else
+    # not supported by JSON as its string form
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    return str(obj)
+
+def _freeze(val):
+    # return a copy of an attribute value that cannot be modified, either via the original
+    # or via the copy itself
+    if isinstance(val, (list, tuple, set, frozenset)):
+        return tuple(_freeze(v) for v in val)
+    if isinstance(val, Mapping):
+        return types.MappingProxyType(dict((k, _freeze(v)) for k, v in val.items()))
+    return val
+
+def _thaw(val):
+    # return a mutable copy of a value frozen by _freeze()
+    if isinstance(val, tuple):
+        return [_thaw(v) for v in val]
+    if isinstance(val, Mapping):
+        return dict((k, _thaw(v)) for k, v in val.items())
+    return val
+
+class CredentialsSnapshot(_CredentialsBase, Mapping):
+    """
+    an immutable copy of a :py:class:`Credentials` object, created via its 
+    :py:meth:`~Credentials.snapshot` method.  Its content hash, JSON serializations (in the
+    pretty and compact forms), and the claims for its tokens are computed once when it is 
+    created, so a single instance can be shared by caches and threads without copying or 
+    locking.  List values are stored as tuples and dictionaries as read-only mappings, 
+    recursively.  Snapshots with the same content are equal and have the same hash.  
+    """
+    __slots__ = ('_data', '_expires', '_gen', '_json', '_claims', '_digest', '_hash')
+
+    def __init__(self, creds: Mapping):
+        """
+        create a snapshot of the given credentials
+        """
+        data = OrderedDict((k, _freeze(creds[k])) for k in creds.keys())
+        claims = types.MappingProxyType(dict((k, v) for k, v in data.items()
+                                             if k not in _NON_CLAIMS))
+        expires = getattr(creds, 'expiration_time', None)
+        ser = json.dumps([data, expires], sort_keys=True, separators=(',', ':'),
+                         default=_digest_default)
+        digest = hashlib.sha256(ser.encode('utf-8')).hexdigest()
+
+        setattr_ = object.__setattr__
+        setattr_(self, '_data', data)
+        setattr_(self, '_expires', expires)
+        setattr_(self, '_gen', getattr(creds, '_gen', None) or default_token_generator)
+        setattr_(self, '_claims', claims)
+        setattr_(self, '_digest', digest)
+        setattr_(self, '_hash', int(digest[:16], 16))
+        setattr_(self, '_json', {})
+        self._json[2] = self._to_json(2)
+        self._json[None] = self._to_json(None)
+
+    def __setattr__(self, name, val):
+        raise AttributeError("CredentialsSnapshot is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("CredentialsSnapshot is immutable")
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, CredentialsSnapshot):
+            return self._digest == other._digest
+        return NotImplemented
+
+    def __repr__(self):
+        return "CredentialsSnapshot(%r)" % dict(self._data)
+
+    @property
+    def digest(self) -> str:
+        """
+        a hex-encoded SHA-256 digest of this credential's content, suitable as a cache key
+        """
+        return self._digest
+
+    @property
+    def claims(self) -> Mapping:
+        """
+        the (read-only) attributes that are included as claims in tokens created from this 
+        credential
+        """
+        return self._claims
+
+    def create_token(self, lifetime=None, profile=None) -> str:
+        """
+        create a JWT token with the information contained in this credential (see 
+        :py:meth:`Credentials.create_token`)
+        """
+        if profile is None and self._gen and not self._gen.claim_profiles:
+            # no profile to apply: the precomputed claims can be used as is
+            return self._gen.generate(self.id, self._claims, lifetime)
+        return super(CredentialsSnapshot, self).create_token(lifetime, profile)
+
+    def set_token(self, lifetime=None, profile=None):
+        raise TypeError("CredentialsSnapshot is immutable; use create_token() instead")
+
+    def snapshot(self):
+        return self
+
+    def thaw(self) -> Credentials:
+        """
+        return a mutable :py:class:`Credentials` copy of this snapshot
+        """
+        atts = OrderedDict((k, _thaw(v)) for k, v in self._data.items())
+        return Credentials(self.id, atts, self._expires, self._gen)
+
+class _RecordCache:
+    # the default store for refresh token records:  a TTLCache with the load()/save()/
+    # delete()/take()/purge() interface of a nistoar.auth.wsgi.sessions.SessionStore
+
+    def __init__(self, size: int):
+        self._cache = TTLCache(size)
+
+    def load(self, rid: str) -> Mapping:
+        return self._cache.get(rid)
+
+    def save(self, rid: str, data: Mapping, expires: float):
+        self._cache.put(rid, dict(data), expires)
+
+    def delete(self, rid: str):
+        self._cache.discard(rid)
+
+    def take(self, rid: str) -> Mapping:
+        return self._cache.pop(rid)
+
+    def purge(self, limit: int=None) -> int:
+        return self._cache.purge(limit)
+
+    def __len__(self):
+        return len(self._cache)
+
+class RefreshTokenManager:
+    """
+    a manager for refresh tokens, which allow a client to obtain new (short-lived) access 
+    tokens without re-authenticating.  A refresh token is a longer-lived JWT that identifies
+    a record, kept by the manager, of the user's attributes; the token itself carries only 
+    the user's identifier, its expiration time, its identifier (``jti``), a ``typ`` claim 
+    set to "refresh", and an ``aud`` claim set to :py:data:`REFRESH_AUDIENCE`.  It is signed
+    with a key derived from (but different from) the generator's signing key, so it cannot be
+    verified--and used--as an access token; the generator's :py:meth:`~JWTGenerator.decode`
+    also rejects it.  Exchanging a refresh token (via :py:meth:`exchange`) consumes its 
+    record and yields a new access token and a new refresh token, so that each refresh token 
+    can be used only once.  The record is consumed atomically, so if the same refresh token 
+    is presented more than once at the same time, only one exchange succeeds.  
+
+    The records are kept in memory unless a shared store (like a 
+    :py:class:`~nistoar.auth.wsgi.sessions.SQLiteSessionStore`) is provided; in that case,
+    refresh tokens can be exchanged with any process sharing the store.
+
+    The following configuration parameters are supported:
+
+    ``lifetime``
+        (int) the lifetime of refresh tokens in seconds (default: 86400, one day)
+    ``access_lifetime``
+        (int) the lifetime of the access tokens issued in exchange for refresh tokens 
+        (default: the generator's lifetime)
+    ``store_size``
+        (int) the maximum number of refresh token records to keep in memory when no store
+        is provided (default: 100000)
+    """
+    TOKEN_TYPE = REFRESH_TOKEN_TYPE
+    KEY_LABEL = "nistoar-auth-refresh-token"
+    RECORD_PREFIX = "refresh:"
+
+    def __init__(self, generator: TokenGenerator, config: Mapping=None, store=None):
+        """
+        create the manager
+        :param TokenGenerator generator:  the generator used to create and verify tokens
+        :param dict config:   the refresh configuration parameters
+        :param store:  the store to keep refresh token records in, which must provide the 
+                       ``load()``, ``save()``, ``delete()``, and ``take()`` methods of a 
+                       :py:class:`~nistoar.auth.wsgi.sessions.SessionStore`; if not given, 
+                       the records are kept in memory.
+        """
+        if config is None:
+            config = {}
+        self.generator = generator
+        # refresh tokens are unique per issuance, so bypass any token cache
+        self._signer = generator.generator if isinstance(generator, CachingTokenGenerator) \
+                                           else generator
+        if not hasattr(self._signer, 'derive_key'):
+            raise ConfigurationException("refresh: not supported by token generator: "+
+                                         type(self._signer).__name__)
+        self._life = config.get('lifetime', 86400)
+        self._access_life = config.get('access_lifetime')
+        for name, val in (("lifetime", self._life), ("access_lifetime", self._access_life),
+                          ("store_size", config.get('store_size'))):
+            if val is not None and not isinstance(val, int):
+                raise ConfigurationException("wrong type for parameter: refresh.%s: "
+                                             "not an int" % name)
+        if store is None:
+            store = _RecordCache(config.get('store_size', 100000))
+        self.store = store
+
+    @property
+    def lifetime(self) -> int:
+        """
+        the time in seconds before a refresh token expires
+        """
+        return self._life
+
+    def issue(self, creds: Credentials) -> str:
+        """
+        create a refresh token for the given credentials
+        """
+        if not creds.is_authenticated():
+            raise RuntimeError("Refresh token cannot be issued for unauthenticated, %s user" %
+                               creds.id)
+        jti = secrets.token_urlsafe(16)
+        exp = int(time.time() + self._life)
+        attrs = dict((k, list(v) if isinstance(v, tuple) else v) for k, v in creds.items()
+                     if k not in _NON_CLAIMS)
+        self.store.save(self.RECORD_PREFIX+jti, {"id": creds.id, "attrs": attrs}, exp)
+
+        kid, key = self._signer.derive_key(self.KEY_LABEL)
+        claims = {"sub": creds.id, "exp": exp, "jti": jti, "typ": self.TOKEN_TYPE,
+                  "aud": REFRESH_AUDIENCE}
+        return jwt.encode(claims, key, algorithm="HS256", headers={"kid": kid} if kid else None)
+
+    def _decode(self, token):
+        # verify the refresh token's signature, audience, and expiration
+        kid = jwt.get_unverified_header(token).get('kid')
+        keys = self._signer.derived_verification_keys(self.KEY_LABEL, kid)
+        if not keys:
+            raise jwt.InvalidSignatureError("Token signed with unrecognized or retired key: "+
+                                            str(kid))
+        for key in keys[:-1]:
+            try:
+                return jwt.decode(token, key, algorithms=["HS256"], audience=REFRESH_AUDIENCE)
+            except jwt.InvalidSignatureError:
+                pass
+        return jwt.decode(token, keys[-1], algorithms=["HS256"], audience=REFRESH_AUDIENCE)
+
+    def exchange(self, token: str, profile=None) -> Credentials:
+        """
+        verify a refresh token and exchange it for new tokens.  
+        :param str token:  the refresh token
+        :param profile:    the claim profile (or its name) to apply to the new access token
+        :return:  the user's credentials with their ``token`` set to a new access token and
+                  their ``refreshToken`` set to a new refresh token
+        :raises jwt.InvalidTokenError:  if the refresh token is invalid, expired, revoked,
+                                        already used, or not a refresh token
+        """
+        claims = self._decode(token)
+        if claims.get('typ') != self.TOKEN_TYPE or not claims.get('jti'):
+            raise jwt.InvalidTokenError("Not a refresh token")
+        if self.generator.is_revoked(claims):
+            raise jwt.InvalidTokenError("Token has been revoked")
+
+        # rotate: the presented refresh token may not be used again.  Its record is removed
+        # as it is read, so that concurrent exchanges of the same token cannot both succeed
+        rec = self.store.take(self.RECORD_PREFIX + claims['jti'])
+        if rec is None or rec.get('id') != claims.get('sub'):
+            raise jwt.InvalidTokenError("Refresh token is unknown or has already been used")
+        self.generator.revoke(claims)
 
+        creds = Credentials(rec['id'], rec.get('attrs'), tokengen=self.generator)
+        creds['token'] = creds.create_token(self._access_life, profile)
+        creds['refreshToken'] = self.issue(creds)
+        return creds
@@ -1,7 +1,63 @@
 """
-a module providing support for interacting with an identity provider (IDP).  
-Support for different IDPs appear in different submodules.  The primary 
-function of the different implementations is to populate a Credentials 
+a module providing support for interacting with an identity provider (IDP).
+Support for different IDPs appear in different submodules.  The primary
+function of the different implementations is to populate a Credentials
 instance from the data returned by the IDP.
+
+The supported IDPs are registered as named profiles (see :py:data:`PROFILES`); a profile's
+module is only imported when the profile is first requested via :py:func:`get_mapper`.
 """
-from .nist_okta import make_credentials
+import importlib
+
+#: the registered IDP profiles, mapping profile names to the modules that implement them.
+#: Each module must provide a ``mapper`` attribute holding its
+#: :py:class:`~nistoar.auth.idp.mapper.AttributeMapper`.
+PROFILES = {
+    "nist_okta": __name__ + ".nist_okta",
+    "nist_ms":   __name__ + ".nist_ms"
+}
+
+#: the name of the profile used when none is specified
+DEFAULT_PROFILE = "nist_okta"
+
+def register_profile(name: str, modname: str):
+    """
+    register an IDP profile.
+    :param str    name:  the name to register the profile under
+    :param str modname:  the fully-qualified name of the module implementing the profile;
+                         it will not be imported until the profile is requested.
+    """
+    PROFILES[name] = modname
+
+def get_mapper(name: str=None):
+    """
+    return the :py:class:`~nistoar.auth.idp.mapper.AttributeMapper` for the named IDP
+    profile, importing the profile's module if necessary.
+    :param str name:  the name of a registered profile or the fully-qualified name of a
+                      module providing a ``mapper``; if None, the default profile is used.
+    :raises ValueError:  if the profile is not registered or does not provide a mapper
+    """
+    if not name:
+        name = DEFAULT_PROFILE
+    modname = PROFILES.get(name)
+    if not modname:
+        if '.' not in name:
+            raise ValueError("get_mapper(): unrecognized IDP profile: "+name)
+        modname = name
+    try:
+        mod = importlib.import_module(modname)
+    except ImportError as ex:
+        raise ValueError("get_mapper(): unable to load IDP profile, %s: %s" % (name, str(ex))) \
+            from ex
+    mapper = getattr(mod, 'mapper', None)
+    if mapper is None:
+        raise ValueError("get_mapper(): IDP profile module has no mapper: "+modname)
+    return mapper
+
+def __getattr__(name):
+    # make_credentials() and make_lazy_credentials() from the default profile are
+    # provided here for backward compatibility; they are imported on first use
+    if name in ("make_credentials", "make_lazy_credentials"):
+        mod = importlib.import_module(PROFILES[DEFAULT_PROFILE])
+        return getattr(mod, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,202 @@
+"""
+a module for translating SAML attribute names using pysaml2-style attribute maps.
+
+An attribute map is a Python file that defines a ``MAP`` dictionary with the properties
+``identifier`` (the SAML name format the map applies to, e.g.
+``urn:oasis:names:tc:SAML:2.0:attrname-format:uri``), ``fro`` (a mapping of attribute names
+(typically URIs) to friendly names), and ``to`` (the reverse mapping).  (The test IDP
+included with this package has a set of these in ``idp/attributemaps``.)  The
+:py:func:`load_attribute_maps` function compiles a directory of these into a single
+:py:class:`AttributeIndex` that translates names in either direction with a single dictionary
+lookup.  Because the maps are large, the compiled index can be cached to a JSON file, which
+is reused as long as the map files are unchanged.
+
+An index can be given to an :py:class:`~nistoar.auth.idp.mapper.AttributeMapper` so that
+its mapping specification can refer to SAML attributes by their friendly names.
+"""
+import os, json, logging, tempfile, importlib.util
+from pathlib import Path
+from collections.abc import Mapping
+from typing import Iterable, Union
+
+#: the version of the compiled index format written to cache files
+CACHE_VERSION = 1
+
+log = logging.getLogger(__name__)
+
+class AttributeIndex:
+    """
+    a compiled, bidirectional index of attribute names drawn from a set of attribute maps
+    """
+
+    def __init__(self, maps: Iterable[Mapping]=None):
+        """
+        compile the index from a set of attribute maps.  Where the maps disagree, the map
+        appearing earlier wins.
+        :param list maps:  the ``MAP`` dictionaries from a set of attribute map files
+        """
+        #: the name formats covered by this index, in order of preference
+        self.formats = []
+        self._fro = {}
+        self._to = {}
+        self._uris = {}
+        self._format_of = {}
+        for amap in (maps or []):
+            self._add(amap)
+
+    def _add(self, amap):
+        fmt = amap.get('identifier')
+        if fmt not in self._to:
+            self.formats.append(fmt)
+            self._to[fmt] = {}
+        to = self._to[fmt]
+        for uri, name in amap.get('fro', {}).items():
+            self._fro.setdefault(uri, name)
+            self._format_of.setdefault(uri, fmt)
+            to.setdefault(name, uri)
+        for name, uri in amap.get('to', {}).items():
+            to.setdefault(name, uri)
+            self._fro.setdefault(uri, name)
+            self._format_of.setdefault(uri, fmt)
+        for name, uri in to.items():
+            self._uris.setdefault(name, uri)
+
+    def friendly_name(self, name: str) -> str:
+        """
+        return the friendly name for the given attribute name.  The name is returned
+        unchanged if it is not in the index (including if it already is a friendly name).
+        """
+        return self._fro.get(name, name)
+
+    def uri(self, name: str, name_format: str=None) -> str:
+        """
+        return the full attribute name (typically a URI) for a friendly name, or None if the
+        name is not known.
+        :param str        name:  the friendly name
+        :param str name_format:  the name format to look the name up in; if None, the name
+                                 is looked up in the formats in order of preference.
+        """
+        if name_format is None:
+            return self._uris.get(name)
+        return self._to.get(name_format, {}).get(name)
+
+    def name_format(self, uri: str) -> str:
+        """
+        return the name format identifier for the given full attribute name, or None if it
+        is not in the index
+        """
+        return self._format_of.get(uri)
+
+    def translate(self, samlattrs: Mapping) -> Mapping:
+        """
+        return a copy of the given SAML attributes with their names replaced by their
+        friendly names
+        """
+        fro = self._fro
+        return {fro.get(name, name): vals for name, vals in samlattrs.items()}
+
+    def __contains__(self, name):
+        return name in self._fro or name in self._uris
+
+    def __len__(self):
+        return len(self._fro)
+
+    def to_data(self) -> Mapping:
+        """
+        return the compiled index as JSON-encodable data
+        """
+        return { "version": CACHE_VERSION, "formats": self.formats, "fro": self._fro,
+                 "to": self._to, "uris": self._uris, "format_of": self._format_of }
+
+    @classmethod
+    def from_data(cls, data: Mapping):
+        """
+        restore a compiled index from the data returned by :py:meth:`to_data`
+        :raises ValueError:  if the data is not in a recognized format
+        """
+        if not isinstance(data, Mapping) or data.get('version') != CACHE_VERSION:
+            raise ValueError("AttributeIndex: unrecognized compiled index format")
+        out = cls()
+        out.formats = data['formats']
+        out._fro = data['fro']
+        out._to = data['to']
+        out._uris = data['uris']
+        out._format_of = data['format_of']
+        return out
+
+def _map_files(mapdir: Path):
+    return sorted(p for p in mapdir.glob("*.py") if not p.name.startswith('_'))
+
+def _signature(files):
+    # identifies the versions of the map files that a compiled index was built from
+    out = []
+    for f in files:
+        st = f.stat()
+        out.append([f.name, st.st_mtime_ns, st.st_size])
+    return out
+
+def read_attribute_map(mapfile: Union[str, Path]) -> Mapping:
+    """
+    import the given attribute map file and return its ``MAP`` dictionary
+    :raises ValueError:  if the file does not define a ``MAP`` dictionary
+    """
+    mapfile = Path(mapfile)
+    spec = importlib.util.spec_from_file_location("_attrmap_"+mapfile.stem, mapfile)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    amap = getattr(mod, 'MAP', None)
+    if not isinstance(amap, Mapping):
+        raise ValueError("%s: does not define an attribute MAP" % str(mapfile))
+    return amap
+
+def load_attribute_maps(mapdir: Union[str, Path], cache_file: Union[str, Path]=None,
+                        prefer: Iterable[str]=None) -> AttributeIndex:
+    """
+    compile the attribute map files found in the given directory into an index.
+    :param str    mapdir:  the directory containing the attribute map (``.py``) files
+    :param str cache_file:  the file to cache the compiled index in.  If it exists and was
+                           compiled from the current versions of the map files, the index is
+                           loaded from it; otherwise, it is (re)written.  If None, no cache
+                           is used.
+    :param list   prefer:  the names (without the ``.py`` extension) of the map files whose
+                           entries should take precedence, in order; the remaining files are
+                           applied in alphabetical order.
+    """
+    mapdir = Path(mapdir)
+    files = _map_files(mapdir)
+    if prefer:
+        order = dict((name, i) for i, name in enumerate(prefer))
+        files.sort(key=lambda f: order.get(f.stem, len(order)))
+    sig = _signature(files)
+
+    if cache_file:
+        cache_file = Path(cache_file)
+        try:
+            with open(cache_file) as fd:
+                data = json.load(fd)
+            if data.get('signature') == sig:
+                return AttributeIndex.from_data(data)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, AttributeError) as ex:
+            log.warning("Ignoring unreadable attribute index cache, %s: %s", str(cache_file),
+                        str(ex))
+
+    index = AttributeIndex(read_attribute_map(f) for f in files)
+
+    if cache_file:
+        data = index.to_data()
+        data['signature'] = sig
+        tmp = None
+        try:
+            # write atomically so that concurrently starting processes never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=cache_file.parent, prefix=cache_file.name+".")
+            with os.fdopen(fd, 'w') as out:
+                json.dump(data, out)
+            os.replace(tmp, cache_file)
+        except OSError as ex:
+            log.warning("Unable to cache attribute index to %s: %s", str(cache_file), str(ex))
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+
+    return index
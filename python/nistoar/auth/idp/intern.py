@@ -0,0 +1,142 @@
+"""
+a module for de-duplicating the SAML attribute names and values held in sessions and user
+credentials.
+
+Every login and every decoding of a session recreates the same long attribute URIs (like
+``http://schemas.xmlsoap.org/ws/2005/05/identity/claims/givenname``) and the same common
+values (like organizational units, roles, and groups).  An :py:class:`InternTable` returns a
+canonical copy of each such string so that equal strings held across sessions and cached
+credentials share storage.  Multi-valued attributes, which tend to be long and are often
+identical across many users, are likewise canonicalized as tuples of interned strings.
+
+A process-wide table, :py:data:`table`, is used by the module-level functions.  Values
+should be interned once, as they are stored for later use (e.g. in a session at login or in
+a credentials cache), rather than each time they are read:  the table's statistics count the
+copies it replaces as memory saved, which is only true of copies that would otherwise have
+been kept.  Callers that canonicalize short-lived values can pass ``count=False``.
+"""
+import sys, threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Iterable
+
+class InternTable:
+    """
+    a table of canonical strings and tuples of strings.  When the table grows beyond its
+    configured size, it is reset (so that rarely seen values do not accumulate).  The table
+    keeps statistics about how often it finds an existing copy and the memory saved as a
+    result (see :py:meth:`stats`).
+    """
+
+    def __init__(self, max_strings: int=50000, max_tuples: int=10000):
+        """
+        create an empty table
+        :param int max_strings:  the maximum number of distinct strings to hold
+        :param int  max_tuples:  the maximum number of distinct tuples to hold
+        """
+        self.max_strings = max_strings
+        self.max_tuples = max_tuples
+        self._strings = {}
+        self._tuples = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def intern_value(self, value, count: bool=True):
+        """
+        return the canonical copy of a single attribute value.  Strings are interned; other
+        values are returned unchanged.
+        :param bool count:  if False, do not count the replacement of an existing copy 
+                            in the table's statistics
+        """
+        if not isinstance(value, str):
+            return value
+        out = self._strings.get(value)
+        if out is None:
+            with self._lock:
+                if len(self._strings) >= self.max_strings:
+                    self._strings.clear()
+                out = self._strings.setdefault(value, value)
+            self.misses += 1
+        elif count and out is not value:
+            self.hits += 1
+            self.bytes_saved += sys.getsizeof(value)
+        return out
+
+    def intern_tuple(self, values: Iterable, count: bool=True) -> tuple:
+        """
+        return the canonical tuple containing the given values (each interned via
+        :py:meth:`intern_value`).  Equal sequences of values yield the same tuple object
+        (as long as it remains in the table).
+        :param bool count:  if False, do not count the replacement of an existing copy 
+                            in the table's statistics
+        """
+        key = values if isinstance(values, tuple) else tuple(values)
+        out = self._tuples.get(key)
+        if out is None:
+            out = tuple(self.intern_value(v, count) for v in key)
+            with self._lock:
+                if len(self._tuples) >= self.max_tuples:
+                    self._tuples.clear()
+                out = self._tuples.setdefault(out, out)
+        elif count and out is not values:
+            self.hits += 1
+            self.bytes_saved += sys.getsizeof(key) + \
+                                sum(sys.getsizeof(v) for v in key if isinstance(v, str))
+        return out
+
+    def intern_attributes(self, samlattrs: Mapping) -> Mapping:
+        """
+        return a copy of the given SAML attributes in which the attribute names and values
+        have been replaced by their canonical copies.  Each attribute's values are returned
+        as a list (as provided by the SAML library).
+        """
+        iv = self.intern_value
+        return {iv(name): [iv(v) for v in vals] if isinstance(vals, (list, tuple)) else iv(vals)
+                for name, vals in samlattrs.items()}
+
+    def clear(self):
+        """
+        empty the table (without resetting the statistics)
+        """
+        with self._lock:
+            self._strings.clear()
+            self._tuples.clear()
+
+    def stats(self) -> Mapping:
+        """
+        return a dictionary of statistics describing the use of this table
+        """
+        return OrderedDict([
+            ("strings",     len(self._strings)),
+            ("tuples",      len(self._tuples)),
+            ("hits",        self.hits),
+            ("misses",      self.misses),
+            ("bytes_saved", self.bytes_saved)
+        ])
+
+#: the process-wide table used by the module-level functions
+table = InternTable()
+
+def intern_value(value, count: bool=True):
+    """
+    return the canonical copy of a single attribute value from the process-wide table
+    (see :py:meth:`InternTable.intern_value`)
+    """
+    return table.intern_value(value, count)
+
+def intern_tuple(values: Iterable, count: bool=True) -> tuple:
+    """
+    return the canonical tuple containing the given values from the process-wide table
+    (see :py:meth:`InternTable.intern_tuple`)
+    """
+    return table.intern_tuple(values, count)
+
+def intern_attributes(samlattrs: Mapping) -> Mapping:
+    """
+    return a copy of the given SAML attributes whose names and values have been replaced
+    with their canonical copies from the process-wide table
+    (see :py:meth:`InternTable.intern_attributes`)
+    """
+    return table.intern_attributes(samlattrs)
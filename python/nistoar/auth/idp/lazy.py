@@ -0,0 +1,214 @@
+"""
+a module providing a lazily-evaluated view of a user's credentials over the raw SAML
+attributes returned by an IDP.
+
+The IDP-specific ``make_credentials()`` functions copy every SAML attribute into a new
+:py:class:`~nistoar.auth.creds.Credentials` object.  Often, however, a caller only needs to
+know who the user is and whether their session has expired.  A :py:class:`LazyCredentials`
+instead wraps the SAML attribute mapping and derives each credential attribute from it only
+when that attribute is first accessed; the full set of attributes is only resolved when it
+is needed as a whole (e.g. for JSON or token output).  The IDP modules provide
+``make_lazy_credentials()`` functions that create these views.
+"""
+import logging
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
+from datetime import datetime
+from typing import Any, Iterable, Tuple, Union
+
+from ..creds import _CredentialsBase, TokenGenerator
+from .intern import intern_tuple
+
+log = logging.getLogger(__name__)
+
+def multi_value(key: str, vals: list, default: tuple, max_values: int=None,
+                count: bool=True) -> tuple:
+    """
+    return the value of a multi-valued credential attribute:  the given SAML values as an
+    interned tuple, or the default if there are none.  
+    :param str key:  the name of the credential attribute (for logging)
+    :param int max_values:  the maximum number of values to keep; if more are given, the
+                     rest are dropped (with a warning) to keep tokens from growing unbounded.
+    :param bool count:  if False, do not count the sharing of the tuple in the intern table's
+                     statistics (see :py:mod:`nistoar.auth.idp.intern`)
+    """
+    if vals is None:
+        return default
+    if max_values is not None and len(vals) > max_values:
+        log.warning("Keeping only the first %d of %d values of %s", max_values, len(vals), key)
+        vals = vals[:max_values]
+    return intern_tuple(vals, count)
+
+def passthrough_value(vals: list, multi: bool=False, count: bool=True):
+    """
+    return the value of a SAML attribute passed through to the credentials:  its first
+    value or, if ``multi`` is True, all of its values as an interned tuple (even if it has
+    only one, so that the attribute's type does not depend on the number of values)
+    :param bool count:  if False, do not count the sharing of the tuple in the intern table's
+                     statistics (see :py:mod:`nistoar.auth.idp.intern`)
+    """
+    if multi:
+        return intern_tuple(vals, count)
+    return vals[0]
+
+def epoch_expiration(expiration: Union[str,int,float,datetime]) -> float:
+    """
+    convert a session expiration time given as an ISO-formatted string or a datetime to
+    an epoch time in seconds.  Numbers and None are returned unchanged.
+    :raises ValueError:  if given a string that is not an ISO date
+    """
+    if isinstance(expiration, str):
+        try:
+            expiration = datetime.fromisoformat(expiration)
+        except ValueError as ex:
+            raise ValueError("make_credentials(): expiration param not an ISO date: "+
+                             expiration) from ex
+    if isinstance(expiration, datetime):
+        expiration = expiration.timestamp()
+    return expiration
+
+class LazyCredentials(_CredentialsBase, MutableMapping):
+    """
+    a Credentials implementation that resolves its attributes from a mapping of SAML
+    attributes on demand.  Each SAML attribute is expected to be a list of values, of which
+    the first is used (except for multi-valued attributes, which get all of them).  Resolved
+    values are remembered.  The view behaves like :py:class:`~nistoar.auth.creds.Credentials`
+    (and produces the same JSON output as the equivalent one); modifying it first resolves
+    all of its attributes, after which it no longer refers to the SAML attributes.  Unlike
+    with :py:class:`~nistoar.auth.creds.Credentials`, ``userId`` cannot be deleted.
+    """
+    __slots__ = ('_attrs', '_idspec', '_spec', '_consumed', '_multi', '_mpass', '_data',
+                 '_expires', '_gen', '_json')
+
+    def __init__(self, samlattrs: Mapping[str, list], idspec: Tuple[str, Any],
+                 spec: Mapping[str, Tuple[str, Any]], consumed: Iterable[str]=None,
+                 expiration: float=None, tokengen: TokenGenerator=None,
+                 multi: Union[Iterable[str], Mapping[str, int]]=None,
+                 multi_passthrough: bool=False):
+        """
+        create the view
+        :param dict samlattrs:  the SAML attributes, mapping names to lists of values
+        :param tuple  idspec:  the name of the SAML attribute containing the user identifier
+                               and the identifier to use if it is missing
+        :param dict     spec:  a mapping of credential attribute names to tuples giving the
+                               SAML attribute name to take its value from and the value to
+                               use if the SAML attribute is missing
+        :param consumed:  the names of the SAML attributes that should not be passed
+                          through as credential attributes under their own names.  SAML
+                          attributes not listed here are passed through.
+        :param float expiration:  the time that the authenticated session is set to
+                               expire, given as the epoch time in seconds.
+        :param TokenGenerator tokengen:  the token generator to use to create tokens
+        :param multi:  the names of the attributes in ``spec`` that should hold all of their
+                       SAML attribute's values (as a tuple) rather than just the first; the
+                       defaults given for these in ``spec`` should be tuples.  If a mapping,
+                       it gives the maximum number of values to keep for each (or None).
+        :param bool multi_passthrough:  if True, passed-through SAML attributes hold all of
+                       their values (as a tuple)
+        """
+        self._attrs = samlattrs
+        self._idspec = idspec
+        self._spec = spec
+        self._consumed = frozenset(consumed or [])
+        self._multi = multi if isinstance(multi, Mapping) else dict.fromkeys(multi or ())
+        self._mpass = multi_passthrough
+        self._data = {}
+        self._init_session(expiration, tokengen)
+
+    def _resolve(self, key):
+        attrs = self._attrs
+        if key == 'userId':
+            name, default = self._idspec
+        elif key in attrs and key not in self._consumed:
+            # passed-through attributes override the others
+            return passthrough_value(attrs[key], self._mpass, False)
+        elif key in self._spec:
+            name, default = self._spec[key]
+            if key in self._multi:
+                # views are typically short-lived, so sharing is not counted as a saving
+                return multi_value(key, attrs.get(name), default, self._multi[key], False)
+        elif key in self._defattrs:
+            return self._defattrs[key]
+        else:
+            raise KeyError(key)
+        return attrs.get(name, [default])[0]
+
+    def _names(self):
+        # the attribute names, in the order Credentials would hold them
+        spec = self._spec
+        yield 'userId'
+        for key in self._defattrs:
+            if key not in spec:
+                yield key
+        yield from spec
+        for key in self._attrs:
+            if key not in self._consumed and key not in spec and key not in self._defattrs and \
+               key != 'userId':
+                yield key
+
+    def _materialize(self):
+        # resolve all attributes and detach from the SAML attributes
+        if self._attrs is not None:
+            data = self._data
+            self._data = OrderedDict((k, data[k] if k in data else self._resolve(k))
+                                     for k in self._names())
+            self._attrs = None
+
+    @property
+    def materialized(self) -> bool:
+        """
+        True if all of the attributes have been resolved
+        """
+        return self._attrs is None
+
+    def __getitem__(self, key):
+        data = self._data
+        if key in data:
+            return data[key]
+        if self._attrs is None:
+            raise KeyError(key)
+        val = self._resolve(key)
+        data[key] = val
+        return val
+
+    def get(self, key, val=None):
+        if key in self:
+            return self[key]
+        return val
+
+    def __contains__(self, key):
+        if key in self._data:
+            return True
+        if self._attrs is None:
+            return False
+        return key == 'userId' or key in self._spec or key in self._defattrs or \
+               (key in self._attrs and key not in self._consumed)
+
+    def __setitem__(self, key, val):
+        self._json = None
+        self._materialize()
+        self._data[key] = val
+
+    def __delitem__(self, key):
+        if key == 'userId':
+            raise KeyError(key)
+        self._json = None
+        self._materialize()
+        if key in self._defattrs:
+            # like Credentials, revert to the default value
+            if key not in self._data:
+                raise KeyError(key)
+            self._data[key] = self._defattrs[key]
+        else:
+            del self._data[key]
+
+    def __iter__(self):
+        if self._attrs is None:
+            return iter(self._data)
+        return self._names()
+
+    def __len__(self):
+        return sum(1 for k in self)
+
+    def __repr__(self):
+        return "LazyCredentials(%r)" % dict(self.items())
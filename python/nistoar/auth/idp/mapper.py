@@ -0,0 +1,206 @@
+"""
+a module providing a data-driven conversion of the SAML attributes returned by an IDP into
+user credentials.
+
+The conversion is described by a mapping specification, a dictionary (loadable from JSON
+configuration) that supports the following properties:
+
+``id``
+    (dict or str) _required_.  The SAML attribute that provides the user identifier.
+``attributes``
+    (dict) _required_.  A mapping of credential attribute names to the SAML attributes they
+    take their value from.
+``consume``
+    (list of str) _optional_.  The names of additional SAML attributes that should be dropped
+    from the credentials.
+``name_format``
+    (str) _optional_.  The SAML name format identifier to use when resolving friendly
+    attribute names (see below); if not set, all known formats are searched.
+
+Each SAML attribute above is described either by its name or by a dictionary with ``from``
+(the SAML attribute name) and ``default`` (the value to use if the attribute is missing)
+properties.  Only the first value of a SAML attribute is normally used; however, if an
+attribute's description sets ``multi`` to true, the credential attribute will hold all of
+its values as a tuple (defaulting to an empty one).  Because these values end up in the 
+user's tokens, a description can also set ``max_values`` to limit how many are kept.  These
+tuples are shared between credentials with the same values (see 
+:py:mod:`nistoar.auth.idp.intern`).  SAML attributes that are neither mapped nor consumed 
+are passed through to the credentials under their own names with their first value.  If
+the specification sets ``multi_passthrough`` to true, they instead hold all of their values
+as a tuple (which appears as a list in JSON and token claims), even when there is only one,
+so that an attribute's type does not depend on how many values the IDP sent.  
+
+The specifications provided by the IDP modules use these features as follows:  both
+:py:mod:`~nistoar.auth.idp.nist_ms` and the default profile, 
+:py:mod:`~nistoar.auth.idp.nist_okta`, map the IDP's group and role attributes to 
+``userGroups`` and ``roles`` (each a list of at most 100 values, empty if the IDP sends
+none).  For the default profile, this is a change:  the group and role attributes were 
+previously passed through under their URIs with only their first values; they are now 
+consumed.  Neither module sets ``multi_passthrough``, so the attributes they pass through 
+keep their single string values.  
+
+If the mapper is given an :py:class:`~nistoar.auth.idp.attrmaps.AttributeIndex`, the SAML
+attributes can be referred to by their friendly names (e.g. ``givenName``), which are 
+resolved to full attribute names when the specification is compiled.  An 
+:py:class:`AttributeMapper` compiles a specification into a form that can be applied 
+quickly to each login.
+"""
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Union
+
+from nistoar.base.config import ConfigurationException
+from ..creds import Credentials, TokenGenerator
+from .lazy import LazyCredentials, epoch_expiration, multi_value, passthrough_value
+from .intern import intern_tuple
+from .attrmaps import AttributeIndex
+
+def _compile_source(spec, what: str, resolve=lambda n: n):
+    # return the (SAML name, default) tuple for a SAML attribute description
+    if isinstance(spec, str):
+        return (resolve(spec), None)
+    if not isinstance(spec, Mapping) or not isinstance(spec.get('from'), str):
+        raise ConfigurationException("%s: not a str or an object with a 'from' str" % what)
+    if spec.get('multi'):
+        default = spec.get('default', [])
+        if not isinstance(default, (list, tuple)):
+            default = [default]
+        return (resolve(spec['from']), intern_tuple(default))
+    return (resolve(spec['from']), spec.get('default'))
+
+def _is_multi(spec):
+    return isinstance(spec, Mapping) and bool(spec.get('multi'))
+
+def _max_values(spec, what: str):
+    # return the limit on the number of values of a multi-valued attribute
+    limit = spec.get('max_values')
+    if limit is not None and (not isinstance(limit, int) or limit < 1):
+        raise ConfigurationException("%s: max_values: not a positive int" % what)
+    return limit
+
+class AttributeMapper:
+    """
+    a converter of SAML attributes into credentials, compiled from a mapping specification
+    (see the :py:mod:`module documentation <nistoar.auth.idp.mapper>`).
+    """
+
+    def __init__(self, spec: Mapping, index: AttributeIndex=None):
+        """
+        compile the mapping specification
+        :param dict spec:  the mapping specification
+        :param AttributeIndex index:  the index to use to resolve friendly attribute names
+        :raises ConfigurationException:  if the specification is malformed
+        """
+        if not isinstance(spec, Mapping):
+            raise ConfigurationException("attribute map: not an object")
+        if 'id' not in spec:
+            raise ConfigurationException("attribute map: missing required property: id")
+        attrs = spec.get('attributes')
+        if not isinstance(attrs, Mapping):
+            raise ConfigurationException("attribute map: attributes: not an object")
+        consume = spec.get('consume', [])
+        if not isinstance(consume, list) or not all(isinstance(n, str) for n in consume):
+            raise ConfigurationException("attribute map: consume: not a list of str")
+        resolve = lambda n: n
+        if index is not None:
+            fmt = spec.get('name_format')
+            resolve = lambda n: index.uri(n, fmt) or n
+            consume = [resolve(n) for n in consume]
+
+        #: the SAML attribute name and default providing the user identifier
+        self.id_spec = _compile_source(spec['id'], "attribute map: id", resolve)
+
+        #: the credential attribute names mapped to SAML attribute names and defaults
+        self.attr_spec = OrderedDict((key, _compile_source(src, "attribute map: attributes."+key,
+                                                           resolve))
+                                     for key, src in attrs.items())
+
+        #: the names of the credential attributes that hold all of their SAML values
+        self.multi = frozenset(key for key, src in attrs.items() if _is_multi(src))
+
+        #: the maximum number of values kept for each multi-valued attribute (or None)
+        self.max_values = dict((key, _max_values(attrs[key], "attribute map: attributes."+key))
+                               for key in self.multi)
+
+        #: whether passed-through SAML attributes keep all of their values
+        self.multi_passthrough = spec.get('multi_passthrough', False)
+        if not isinstance(self.multi_passthrough, bool):
+            raise ConfigurationException("attribute map: multi_passthrough: not a bool")
+
+        #: the names of the SAML attributes that are not passed through (the user identifier
+        #: can only be set via ``id``)
+        self.consumed = frozenset([self.id_spec[0], 'userId'] +
+                                  [s[0] for s in self.attr_spec.values()] + consume)
+
+        # the dispatch tables applied to each login: (credential name, SAML name, [default])
+        # for all attributes (in order) and (credential name, SAML name, default, limit) for
+        # the multi-valued ones, whose values are then replaced
+        self._fields = tuple((key, name, (default,))
+                             for key, (name, default) in self.attr_spec.items())
+        self._mfields = tuple((key, name, default, self.max_values[key])
+                              for key, (name, default) in self.attr_spec.items()
+                              if key in self.multi)
+
+    @classmethod
+    def from_config(cls, config: Mapping, index: AttributeIndex=None):
+        """
+        create a mapper from a mapping specification given in configuration data
+        :param AttributeIndex index:  the index to use to resolve friendly attribute names
+        :raises ConfigurationException:  if the specification is malformed
+        """
+        return cls(config, index)
+
+    def map(self, samlattrs: Mapping) -> Mapping:
+        """
+        return the credential attributes (excluding the user identifier) derived from the
+        given SAML attributes
+        """
+        get = samlattrs.get
+        attrs = {key: get(name, default)[0] for key, name, default in self._fields}
+        for key, name, default, limit in self._mfields:
+            attrs[key] = multi_value(key, get(name), default, limit)
+        consumed = self.consumed
+        if self.multi_passthrough:
+            for name, vals in samlattrs.items():
+                if name not in consumed:
+                    attrs[name] = passthrough_value(vals, True)
+        else:
+            for name, vals in samlattrs.items():
+                if name not in consumed:
+                    attrs[name] = vals[0]
+        return attrs
+
+    def user_id(self, samlattrs: Mapping) -> str:
+        """
+        return the user identifier from the given SAML attributes
+        """
+        vals = samlattrs.get(self.id_spec[0])
+        return vals[0] if vals else self.id_spec[1]
+
+    def make_credentials(self, samlattrs: Mapping, expiration: Union[str,int,float]=None,
+                         tokengen: TokenGenerator=None) -> Credentials:
+        """
+        create a Credentials object based on the results of SAML authentication
+        :param dict samlattrs:  the SAML attributes, mapping names to lists of values
+        :param expiration:  the time the authenticated session expires, either as an epoch
+                            time in seconds or an ISO-formatted date string
+        :param TokenGenerator tokengen:  the token generator the credentials should use
+        """
+        if expiration is not None and not isinstance(expiration, (int, float)):
+            expiration = epoch_expiration(expiration)
+        out = Credentials(self.user_id(samlattrs), None, expiration, tokengen)
+        # the mapped attributes never include userId, so they can be loaded directly
+        out.data.update(self.map(samlattrs))
+        return out
+
+    def make_lazy_credentials(self, samlattrs: Mapping, expiration: Union[str,int,float]=None,
+                              tokengen: TokenGenerator=None) -> LazyCredentials:
+        """
+        create a view of the user's credentials over the results of SAML authentication that
+        derives each attribute only as it is needed (see
+        :py:class:`~nistoar.auth.idp.lazy.LazyCredentials`).  The parameters are the same as
+        for :py:meth:`make_credentials`.
+        """
+        return LazyCredentials(samlattrs, self.id_spec, self.attr_spec, self.consumed,
+                               epoch_expiration(expiration), tokengen, self.max_values,
+                               self.multi_passthrough)
@@ -8,7 +8,7 @@ from collections import namedtuple
 from collections.abc import Mapping
 from typing import Union
 
-from ..creds import Credentials
+from .mapper import AttributeMapper
 
 _MS_BASE_URI = "http://schemas.microsoft.com/"
 _SOAP_BASE_URI = "http://schemas.xmlsoap.org/"
@@ -29,38 +29,39 @@ ATTR_NAME = AttributeNames(
     WINID  = _SOAP_BASE_URI + "ws/2005/05/identity/claims/windowsaccountname"
 )
 
+#: the specification for converting the SAML attributes to credentials (see
+#: :py:mod:`nistoar.auth.idp.mapper`)
+ATTRIBUTE_MAP = {
+    "id": { "from": ATTR_NAME.WINID, "default": "unknown" },
+    "attributes": {
+        "userName":      { "from": ATTR_NAME.GIVEN,  "default": "unknown" },
+        "userLastName":  { "from": ATTR_NAME.FAMILY, "default": "unknown" },
+        "userEmail":     { "from": ATTR_NAME.EMAIL,  "default": "not-set" },
+        "userOU":        { "from": ATTR_NAME.OU,     "default": "not-set" },
+        "role":          { "from": ATTR_NAME.ROLE,   "default": "not-set" },
+        "displayName":   { "from": ATTR_NAME.DNAME,  "default": "unknown" },
+        "qualifiedName": { "from": ATTR_NAME.QNAME,  "default": "unknown" },
+        "userGroup":     { "from": ATTR_NAME.GROUP,  "default": "not-set" },
+        "userGroups":    { "from": ATTR_NAME.GROUP,  "multi": True, "max_values": 100 },
+        "roles":         { "from": ATTR_NAME.ROLE,   "multi": True, "max_values": 100 },
+        "winId":         { "from": ATTR_NAME.WINID,  "default": "unknown" }
+    },
+    "consume": [ ATTR_NAME.ID, ATTR_NAME.DIVNO ]
+}
+
+mapper = AttributeMapper(ATTRIBUTE_MAP)
+
 def make_credentials(samlattrs: Mapping, expiration: Union[str,int,float]=None):
     """
     create a Credentials object based on the results of SAML authentication 
     that can be returned to our service clients.
     """
-    want = [ ATTR_NAME.ID, ATTR_NAME.EMAIL, ATTR_NAME.QNAME, ATTR_NAME.DNAME,
-             ATTR_NAME.GIVEN, ATTR_NAME.FAMILY, ATTR_NAME.OU, ATTR_NAME.DIVNO,
-             ATTR_NAME.ROLE, ATTR_NAME.GROUP, ATTR_NAME.WINID ]
-    id = samlattrs.get(ATTR_NAME.WINID, ["unknown"])[0]
-    attrs = {
-        "userName":     samlattrs.get(ATTR_NAME.GIVEN,  ["unknown"])[0],
-        "userLastName": samlattrs.get(ATTR_NAME.FAMILY, ["unknown"])[0],
-        "userEmail":    samlattrs.get(ATTR_NAME.EMAIL,  ["not-set"])[0],
-        "userOU":       samlattrs.get(ATTR_NAME.OU,     ["not-set"])[0],
-        "userOU":       samlattrs.get(ATTR_NAME.OU,     ["not-set"])[0], # 
-        "role":         samlattrs.get(ATTR_NAME.ROLE,   ["not-set"])[0],
-        "displayName":  samlattrs.get(ATTR_NAME.DNAME,  ["unknown"])[0],
-        "qualifiedName": samlattrs.get(ATTR_NAME.QNAME, ["unknown"])[0],
-        "userGroup":    samlattrs.get(ATTR_NAME.GROUP,  ["not-set"])[0],
-        "winId":        samlattrs.get(ATTR_NAME.WINID,  ["unknown"])[0],
-    }
-
-    for name in samlattrs:
-        if name not in want:
-            attrs[name] = samlattrs.get(name)[0]
-
-    if expiration is not None and isinstance(expiration, str):
-        # assume in ISO format
-        try:
-            expiration = datetime.fromisoformat(expiration).timestamp()
-        except ValueError as ex:
-            raise ValueError("make_credentials(): expiration param not an ISO date: "+expiration)
-
-    return Credentials(id, attrs, expiration)
+    return mapper.make_credentials(samlattrs, expiration)
 
+def make_lazy_credentials(samlattrs: Mapping, expiration: Union[str,int,float]=None):
+    """
+    create a view of the user's credentials over the results of SAML authentication that 
+    derives each attribute only as it is needed.  The view is equivalent to the 
+    Credentials object returned by :py:func:`make_credentials`.  
+    """
+    return mapper.make_lazy_credentials(samlattrs, expiration)
@@ -0,0 +1,278 @@
+"""
+a module providing support for the cryptographic keys used to sign and verify authentication
+tokens.  In particular, it supports loading the private keys used to sign tokens with
+asymmetric algorithms (like RS256) and exporting the corresponding public keys as a JSON Web
+Key Set (JWKS) so that token-consuming services can verify tokens without sharing a secret.
+It also provides a :py:class:`Keyring` that allows the secrets used with HS256 to be rotated.
+
+Support for asymmetric algorithms requires the ``cryptography`` package.
+"""
+import os, json, time, hashlib, base64, threading, logging
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, List, Tuple
+
+import jwt
+from jwt.algorithms import get_default_algorithms, has_crypto
+
+from nistoar.base.config import ConfigurationException
+
+log = logging.getLogger("nistoar.auth.keys")
+
+ASYMMETRIC_ALGORITHMS = ("RS256", "RS384", "RS512", "PS256", "PS384", "PS512",
+                         "ES256", "ES384", "ES512", "EdDSA")
+
+def get_algorithm(alg: str):
+    """
+    return the pyjwt implementation of the named asymmetric signing algorithm
+    :raises ConfigurationException:  if the algorithm is not a supported asymmetric algorithm
+                                     or if the ``cryptography`` package is not installed.
+    """
+    if alg not in ASYMMETRIC_ALGORITHMS:
+        raise ConfigurationException("unsupported asymmetric signing algorithm: "+str(alg))
+    if not has_crypto:
+        raise ConfigurationException("cryptography package is required for algorithm "+alg)
+    return get_default_algorithms()[alg]
+
+def load_private_key(alg: str, config: Mapping):
+    """
+    load the private key to sign tokens with, as described in the given configuration.  The
+    key can be given either directly in PEM format via the ``private_key`` parameter or via a
+    PEM file named by the ``private_key_file`` parameter.
+    :param str       alg:  the name of the signing algorithm the key will be used with
+    :param dict   config:  the configuration describing the key
+    :return:  the key object ready to be passed to ``jwt.encode()``
+    :raises ConfigurationException:  if the key is not configured or cannot be loaded
+    """
+    algo = get_algorithm(alg)
+    pem = config.get('private_key')
+    if not pem:
+        keyfile = config.get('private_key_file')
+        if not keyfile:
+            raise ConfigurationException("missing parameter: private_key or private_key_file")
+        try:
+            with open(keyfile) as fd:
+                pem = fd.read()
+        except OSError as ex:
+            raise ConfigurationException("unable to read private_key_file: "+str(ex)) from ex
+
+    try:
+        key = algo.prepare_key(pem)
+    except (ValueError, TypeError, jwt.InvalidKeyError) as ex:
+        raise ConfigurationException("unable to load private key for "+alg+": "+str(ex)) from ex
+    if not hasattr(key, 'public_key'):
+        raise ConfigurationException("configured key for "+alg+" is not a private key")
+    return key
+
+def public_jwk(alg: str, key: Any, kid: str=None) -> Mapping:
+    """
+    return the public portion of a key as a JSON Web Key (JWK) dictionary
+    :param str alg:  the name of the signing algorithm the key is used with
+    :param     key:  the private or public key object
+    :param str kid:  the key identifier to include in the JWK; if not provided, the key's
+                     RFC 7638 thumbprint will be used.
+    """
+    algo = get_algorithm(alg)
+    if hasattr(key, 'public_key'):
+        key = key.public_key()
+    jwk = json.loads(algo.to_jwk(key))
+    if not kid:
+        kid = jwk_thumbprint(jwk)
+    jwk.update({"kid": kid, "alg": alg, "use": "sig"})
+    return jwk
+
+_THUMBPRINT_MEMBERS = { "RSA": ("e", "kty", "n"), "EC": ("crv", "kty", "x", "y"),
+                        "OKP": ("crv", "kty", "x") }
+
+def jwk_thumbprint(jwk: Mapping) -> str:
+    """
+    return the RFC 7638 (SHA-256) thumbprint of a public JWK.  This can serve as a default
+    key identifier.
+    """
+    members = _THUMBPRINT_MEMBERS.get(jwk.get('kty'))
+    if not members:
+        raise ValueError("jwk_thumbprint(): unsupported key type: "+str(jwk.get('kty')))
+    data = json.dumps(OrderedDict((m, jwk[m]) for m in members), separators=(',', ':'))
+    digest = hashlib.sha256(data.encode('utf-8')).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+def make_jwks(jwks: List[Mapping]) -> Mapping:
+    """
+    wrap a list of public JWKs into a JWK Set document
+    """
+    return OrderedDict([("keys", list(jwks))])
+
+class Keyring:
+    """
+    an ordered set of HS256 secrets, each identified by a key ID (``kid``), that allows 
+    the secret used to sign tokens to be rotated without invalidating tokens already issued.
+    The first key in the ring is the current one, used to sign new tokens; the older ones are
+    still accepted for verifying tokens during a grace window.  
+
+    Each key is described by a dictionary with the following properties:
+
+    ``kid``
+        (str) the key's identifier; this is required if the ring has more than one key.
+    ``secret``
+        (str) the HS256 secret
+    ``retired``
+        (int) the epoch time (in seconds) when this key was replaced as the current signing
+        key.  Tokens signed with this key will continue to be accepted until the grace 
+        period after this time has passed.  If not set for an older key, the key is 
+        considered retired when the keyring first saw it demoted from the current key (or,
+        for a key that was never current, when it was first loaded), so that it is 
+        still only accepted for the grace period.
+
+    The keys can also be read from a JSON file (containing either a list of keys or an 
+    object with a ``keys`` property set to that list).  The file is checked periodically for
+    updates; when it changes, it is reloaded, allowing the keys to be rotated without 
+    restarting the service.
+    """
+
+    def __init__(self, keylist: List[Mapping]=None, keyfile: str=None, 
+                 grace_period: int=3600, check_interval: int=60):
+        """
+        create the keyring.  
+        :param list  keylist:  the list of key descriptions, newest first
+        :param str   keyfile:  the path to a JSON file containing the key descriptions.  If 
+                               given, ``keylist`` is ignored.
+        :param int grace_period:  the number of seconds after a key's retirement that tokens
+                               signed with it will still be accepted
+        :param int check_interval:  the minimum number of seconds between checks for 
+                               changes to the ``keyfile``.
+        :raises ConfigurationException:  if the key descriptions are missing or invalid
+        """
+        self.keyfile = keyfile
+        self.grace_period = grace_period
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0
+        self._demoted = {}
+        self.version = 0
+
+        if keyfile:
+            self._load_file()
+        else:
+            self._set_keys(keylist)
+
+    @classmethod
+    def from_config(cls, config: Mapping, lifetime: int=3600):
+        """
+        create a Keyring from a token generator configuration.  The keys are taken from the
+        ``keyring_file`` parameter if set, then the ``keyring`` parameter (a list of key 
+        descriptions), and finally the ``secret`` parameter (as a single key without a 
+        ``kid``).  The ``keyring_grace_period`` (default: the given token lifetime) and 
+        ``keyring_check_interval`` (default: 60) parameters are also recognized.
+        :param dict config:  the token generator configuration
+        :param int lifetime: the lifetime of the tokens signed with the keys
+        """
+        grace = config.get('keyring_grace_period', lifetime)
+        interval = config.get('keyring_check_interval', 60)
+        if config.get('keyring_file'):
+            return cls(keyfile=config['keyring_file'], grace_period=grace, 
+                       check_interval=interval)
+        if config.get('keyring'):
+            return cls(config['keyring'], grace_period=grace)
+        if not config.get('secret'):
+            raise ConfigurationException("missing or empty parameter: secret")
+        return cls([{"secret": config['secret']}], grace_period=grace)
+
+    def _set_keys(self, keylist):
+        if isinstance(keylist, Mapping):
+            keylist = keylist.get('keys')
+        if not keylist or not isinstance(keylist, list):
+            raise ConfigurationException("keyring: no keys provided")
+        keys = []
+        for key in keylist:
+            if not isinstance(key, Mapping) or not key.get('secret'):
+                raise ConfigurationException("keyring: key description is missing its secret")
+            kid = key.get('kid')
+            if not kid and len(keylist) > 1:
+                raise ConfigurationException("keyring: key description is missing its kid")
+            retired = key.get('retired')
+            if retired is not None and not isinstance(retired, (int, float)):
+                raise ConfigurationException("keyring: retired value is not a number: "+
+                                             str(retired))
+            keys.append((kid, key['secret'], retired))
+        if len(set(k[0] for k in keys)) < len(keys):
+            raise ConfigurationException("keyring: duplicate kid values found")
+
+        # older keys without a retirement time are retired as of when they were first seen
+        # demoted, so that rotating the keys always ends their acceptance
+        now = time.time()
+        demoted = {}
+        for i, (kid, secret, retired) in enumerate(keys[1:], 1):
+            if retired is None:
+                demoted[kid] = self._demoted.get(kid, now)
+                keys[i] = (kid, secret, demoted[kid])
+        self._demoted = demoted
+
+        # swap in the new keys all at once
+        self._keys = tuple(keys)
+        self._bykid = dict((k[0], k) for k in keys)
+        self.version += 1
+
+    def _load_file(self):
+        try:
+            mtime = os.stat(self.keyfile).st_mtime
+            with open(self.keyfile) as fd:
+                keylist = json.load(fd)
+        except (OSError, ValueError) as ex:
+            raise ConfigurationException("keyring: unable to load keyring_file: "+str(ex)) from ex
+        self._set_keys(keylist)
+        self._mtime = mtime
+        self._next_check = time.time() + self.check_interval
+
+    def refresh(self) -> bool:
+        """
+        reload the keys from the key file if it has changed since it was last loaded.  This 
+        checks the file no more often than the configured check interval and is otherwise 
+        a no-op.  If the updated file cannot be loaded, the current keys are retained.  
+        :return:  True if the keys were reloaded
+        """
+        if not self.keyfile or time.time() < self._next_check:
+            return False
+        with self._lock:
+            if time.time() < self._next_check:
+                return False
+            self._next_check = time.time() + self.check_interval
+            try:
+                if os.stat(self.keyfile).st_mtime == self._mtime:
+                    return False
+                self._load_file()
+            except (OSError, ConfigurationException) as ex:
+                log.error("Failed to reload keyring (keeping current keys): %s", str(ex))
+                return False
+        log.info("Reloaded keyring from %s", self.keyfile)
+        return True
+
+    @property
+    def current(self) -> Tuple[str, str]:
+        """
+        the current signing key as a (kid, secret) tuple
+        """
+        return self._keys[0][:2]
+
+    def lookup(self, kid: str) -> str:
+        """
+        return the secret for the key with the given identifier, or None if the key is 
+        not in the ring or its grace period has passed.
+        """
+        key = self._bykid.get(kid)
+        if not key or not self._acceptable(key):
+            return None
+        return key[1]
+
+    def acceptable(self) -> List[str]:
+        """
+        return the list of secrets that are currently acceptable for verifying tokens, 
+        newest first
+        """
+        return [k[1] for k in self._keys if self._acceptable(k)]
+
+    def _acceptable(self, key):
+        return key is self._keys[0] or key[2] + self.grace_period > time.time()
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,208 @@
+"""
+a module providing a command-line tool for creating authentication tokens in bulk, e.g. for
+service accounts or synthetic test users.
+
+The input is a stream of JSON-encoded credential records, one per line, each in the form
+accepted by :py:meth:`Credentials.from_json_dict() <nistoar.auth.creds.Credentials.from_json_dict>`
+(i.e. the form output by the authentication service's ``_logininfo`` endpoint).  For each
+record, a token is created, and the credential record, now including the token, is written
+out as a line of JSON.  The token generator is configured with the same ``jwt`` configuration
+used by the authentication service (including its default claim profile, if one is
+configured), and the tokens expire according to its ``lifetime`` (or the ``--lifetime`` 
+option).  A record's ``expires`` time, if set, can only shorten a token's lifetime:  it 
+is not itself included in the token, and records that have already expired are rejected.  
+The records are processed in batches that can be spread over multiple
+processes; the output is written in the same order as the input.
+
+The :py:func:`main` function implements the command; it is normally invoked via the
+``mint-tokens.py`` script.
+"""
+import os, sys, json, time, argparse
+from itertools import islice
+from multiprocessing import Pool
+from typing import Iterable, List, Mapping, Tuple
+
+from nistoar.base import config as oarconfig
+from nistoar.base.config import ConfigurationException
+from .creds import Credentials, create_token_generator
+
+prog = "mint-tokens"
+_generator = None
+
+# properties of a credential record that describe the record and are not token claims
+_RECORD_PROPS = ("expires", "since")
+
+def define_options(parser: argparse.ArgumentParser=None) -> argparse.ArgumentParser:
+    """
+    define the command-line options for the token minting command
+    """
+    if not parser:
+        parser = argparse.ArgumentParser(prog=prog, description=
+                                 "create authentication tokens for credential records read "
+                                 "as JSON lines")
+    parser.add_argument("-c", "--config", metavar="FILE", type=str, required=True,
+                        help="the JSON or YAML file containing the token generator "
+                             "configuration: either the jwt configuration itself or a full "
+                             "service configuration with a jwt property")
+    parser.add_argument("-i", "--input", metavar="FILE", type=str, default="-",
+                        help="the file to read credential records from (default: stdin)")
+    parser.add_argument("-o", "--output", metavar="FILE", type=str, default="-",
+                        help="the file to write the credentials with tokens to (default: stdout)")
+    parser.add_argument("-l", "--lifetime", metavar="SECS", type=int, default=None,
+                        help="the lifetime of the tokens in seconds (default: as configured)")
+    parser.add_argument("-p", "--processes", metavar="NUM", type=int, default=os.cpu_count(),
+                        help="the number of processes to create tokens with (default: the "
+                             "number of CPUs)")
+    parser.add_argument("-b", "--batch-size", metavar="NUM", type=int, default=1000,
+                        dest="batchsize",
+                        help="the number of records to send to a process at a time "
+                             "(default: 1000)")
+    return parser
+
+def _init_worker(jwtcfg: Mapping, lifetime: int):
+    global _generator
+    _generator = (create_token_generator(jwtcfg), lifetime)
+
+def mint_batch(batch: List[Tuple[int, str]]) -> Tuple[List[str], List[str]]:
+    """
+    create tokens for a batch of JSON-encoded credential records using the token generator
+    configured for the current process.
+    :param list batch:  a list of (line number, JSON record) tuples
+    :return:  a tuple containing the list of output records and a list of error messages for
+              the records that could not be processed
+    """
+    gen, lifetime = _generator
+    now = time.time()
+    errors = []
+    crds = []
+    for lineno, line in batch:
+        try:
+            crd = Credentials.from_json_dict(json.loads(line))
+        except (ValueError, TypeError, AttributeError) as ex:
+            errors.append("line %d: bad credential record: %s" % (lineno, str(ex)))
+            continue
+        if not crd.is_authenticated():
+            errors.append("line %d: missing userId" % lineno)
+            continue
+        expires = crd.get('expires')
+        if expires is not None:
+            if isinstance(expires, bool) or not isinstance(expires, (int, float)):
+                errors.append("line %d: expires is not an epoch time" % lineno)
+                continue
+            if expires < now + 1:
+                errors.append("line %d: credential record has expired" % lineno)
+                continue
+        crds.append(crd)
+
+    # tokens expire per the generator's lifetime unless the credentials expire sooner
+    profile = gen.claim_profiles.default if gen.claim_profiles else None
+    deadline = now + (lifetime or gen.lifetime)
+    items = []
+    batched = []
+    for crd in crds:
+        claims = _token_claims(crd, profile)
+        expires = crd.get('expires')
+        if expires is not None and expires < deadline:
+            crd['token'] = gen.generate(crd.id, claims, int(expires - now))
+        else:
+            items.append((crd.id, claims))
+            batched.append(crd)
+    for crd, tok in zip(batched, gen.generate_many(items, lifetime)):
+        crd['token'] = tok
+    return [c.to_json(None) for c in crds], errors
+
+def _token_claims(crd: Credentials, profile=None) -> Mapping:
+    # the attributes of a credential record to include in its token
+    claims = profile.apply(crd) if profile else crd
+    if any(p in claims for p in _RECORD_PROPS):
+        claims = dict((k, v) for k, v in claims.items() if k not in _RECORD_PROPS)
+    return claims
+
+def _batches(lines: Iterable[str], size: int) -> Iterable[List[Tuple[int, str]]]:
+    numbered = ((n, line) for n, line in enumerate(lines, 1) if line.strip())
+    while True:
+        batch = list(islice(numbered, size))
+        if not batch:
+            break
+        yield batch
+
+def load_jwt_config(path: str) -> Mapping:
+    """
+    load the token generator configuration from the given file
+    """
+    cfg = oarconfig.load_from_file(path)
+    if not isinstance(cfg, Mapping):
+        raise ConfigurationException("%s: configuration is not an object" % path)
+    return cfg.get('jwt', cfg)
+
+def mint(instrm, ostrm, jwtcfg: Mapping, lifetime: int=None, processes: int=1,
+         batchsize: int=1000, errstrm=None) -> Tuple[int, int]:
+    """
+    read credential records from an input stream and write them, with tokens included, to
+    an output stream.
+    :param instrm:     the stream to read JSON-encoded credential records from, one per line
+    :param ostrm:      the stream to write the records with tokens to
+    :param dict jwtcfg:  the token generator configuration
+    :param int lifetime:  the lifetime of the tokens (default: the configured default)
+    :param int processes:  the number of processes to create tokens with; if less than 2, the
+                       tokens are created in the current process.
+    :param int batchsize:  the number of records to send to a process at a time
+    :param errstrm:    the stream to report bad records to (default: sys.stderr)
+    :return:  a tuple giving the number of tokens created and the number of records that
+              could not be processed
+    """
+    if errstrm is None:
+        errstrm = sys.stderr
+    count = failed = 0
+    batches = _batches(instrm, batchsize)
+
+    pool = None
+    if processes > 1:
+        pool = Pool(processes, _init_worker, (jwtcfg, lifetime))
+        results = pool.imap(mint_batch, batches)
+    else:
+        _init_worker(jwtcfg, lifetime)
+        results = (mint_batch(b) for b in batches)
+
+    try:
+        for out, errors in results:
+            for line in out:
+                ostrm.write(line)
+                ostrm.write("\n")
+            for msg in errors:
+                errstrm.write("%s: %s\n" % (prog, msg))
+            count += len(out)
+            failed += len(errors)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    return count, failed
+
+def main(args: List[str]) -> int:
+    """
+    run the token minting command with the given command-line arguments
+    :return:  the exit code: 0 if all records were processed successfully, 1 if some records
+              could not be processed, or 2 if the command could not be run at all.
+    """
+    opts = define_options().parse_args(args)
+    try:
+        jwtcfg = load_jwt_config(opts.config)
+        create_token_generator(jwtcfg)   # check the config before starting
+    except (ConfigurationException, OSError, ValueError) as ex:
+        sys.stderr.write("%s: %s\n" % (prog, str(ex)))
+        return 2
+
+    instrm = sys.stdin if opts.input == "-" else open(opts.input)
+    ostrm = sys.stdout if opts.output == "-" else open(opts.output, 'w')
+    try:
+        count, failed = mint(instrm, ostrm, jwtcfg, opts.lifetime, opts.processes,
+                             opts.batchsize)
+    finally:
+        if instrm is not sys.stdin:
+            instrm.close()
+        if ostrm is not sys.stdout:
+            ostrm.close()
+
+    return 1 if failed else 0
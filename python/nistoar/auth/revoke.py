@@ -0,0 +1,189 @@
+"""
+a module providing support for revoking authentication tokens before they expire.
+
+Tokens issued by this package carry a unique identifier in their ``jti`` claim.  A token is
+revoked by adding its identifier, along with its expiration time, to a
+:py:class:`RevocationList`; token verification consults this list.  Since most tokens
+checked are not revoked, the list puts a :py:class:`BloomFilter` in front of its exact set of
+revoked identifiers so that the common check can usually be answered with a few bit tests.
+A revoked identifier is dropped from the list once its token expires (as the token would
+then fail verification anyway), keeping the list small.
+
+A RevocationList is held in memory and is local to the process that holds it, unless it is
+given a shared store (like a :py:class:`~nistoar.auth.wsgi.sessions.SQLiteSessionStore`).  
+In that case, each revocation is also saved to the store, and a token not revoked by the 
+local process is looked up in the store, so that a token revoked by one process (e.g. a 
+uwsgi worker) is seen as revoked by all of the processes sharing the store.  The Bloom 
+filter then only speeds up the check for tokens revoked locally.
+"""
+import time, math, hashlib, heapq, threading
+from collections import OrderedDict
+from typing import Mapping
+
+class BloomFilter:
+    """
+    a compact, probabilistic set of strings.  A membership test may return a false positive
+    (with a probability near the configured error rate when the filter holds its capacity)
+    but never a false negative.  Items cannot be removed.
+    """
+
+    def __init__(self, capacity: int=100000, error_rate: float=0.001):
+        """
+        create an empty filter sized for the given capacity.
+        :param int      capacity:  the number of items the filter is expected to hold
+        :param float  error_rate:  the desired false positive rate when the filter holds
+                                   ``capacity`` items
+        """
+        if capacity < 1:
+            raise ValueError("BloomFilter: capacity must be a positive int: "+str(capacity))
+        if not (0 < error_rate < 1):
+            raise ValueError("BloomFilter: error_rate must be between 0 and 1: "+
+                             str(error_rate))
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.nbits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2)**2)))
+        self.nhashes = max(1, int(round(self.nbits / capacity * math.log(2))))
+        self._bits = bytearray((self.nbits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # double hashing: derive all bit positions from two 64-bit hashes
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.nbits for i in range(self.nhashes)]
+
+    def add(self, item: str):
+        """
+        add an item to the filter
+        """
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self._bits
+        for pos in self._positions(item):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    @property
+    def size(self) -> int:
+        """
+        the size of the filter's bit array in bytes
+        """
+        return len(self._bits)
+
+class RevocationList:
+    """
+    a thread-safe list of revoked token identifiers (``jti`` values).  Each identifier is kept
+    only until its token's expiration time.
+    """
+    RECORD_PREFIX = "revoked:"
+
+    def __init__(self, capacity: int=100000, error_rate: float=0.001, store=None):
+        """
+        create an empty list.
+        :param int      capacity:  the number of unexpired revocations the list is expected to
+                                   hold at one time; this sizes its Bloom filter.
+        :param float  error_rate:  the desired false positive rate for the Bloom filter (which
+                                   determines how often the exact set must be consulted).
+        :param store:  a store to share revocations through with other processes, which 
+                       must provide the ``load()`` and ``save()`` methods of a 
+                       :py:class:`~nistoar.auth.wsgi.sessions.SessionStore`; if not given,
+                       revocations are local to this list.
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.store = store
+        self._filter = BloomFilter(capacity, error_rate)
+        self._revoked = {}
+        self._expiries = []
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.filtered = 0
+
+    def revoke(self, jti: str, exp: float):
+        """
+        revoke the token with the given identifier
+        :param str   jti:  the token's identifier (from its ``jti`` claim)
+        :param float exp:  the token's expiration time (from its ``exp`` claim) as an epoch
+                           time in seconds.
+        """
+        if exp is None or exp <= time.time():
+            return
+        if self.store is not None and self._revoked.get(jti, 0) < exp:
+            self.store.save(self.RECORD_PREFIX+jti, {"exp": exp}, exp)
+        with self._lock:
+            if self._revoked.get(jti, 0) >= exp:
+                return
+            self._revoked[jti] = exp
+            heapq.heappush(self._expiries, (exp, jti))
+            self._filter.add(jti)
+            if not self._prune() and self._filter.count > self._filter.capacity:
+                self._rebuild()
+
+    def is_revoked(self, jti: str) -> bool:
+        """
+        return True if the token with the given identifier has been revoked (by this list or,
+        if it has a store, by any list sharing the store) and has not yet expired
+        """
+        self.checks += 1
+        if jti in self._filter:
+            with self._lock:
+                exp = self._revoked.get(jti)
+            if exp is not None and exp > time.time():
+                return True
+        elif self.store is None:
+            self.filtered += 1
+            return False
+        return self.store is not None and self.store.load(self.RECORD_PREFIX+jti) is not None
+
+    def prune(self) -> int:
+        """
+        drop the identifiers of tokens that have expired.
+        :return:  the number of identifiers dropped
+        """
+        with self._lock:
+            return self._prune()
+
+    def _prune(self):
+        now = time.time()
+        removed = 0
+        while self._expiries and self._expiries[0][0] <= now:
+            exp, jti = heapq.heappop(self._expiries)
+            if self._revoked.get(jti) == exp:
+                del self._revoked[jti]
+                removed += 1
+
+        if removed and self._filter.count - len(self._revoked) > self._filter.capacity // 2:
+            # the filter has accumulated too many stale entries
+            self._rebuild()
+        return removed
+
+    def _rebuild(self):
+        # replace the filter with one containing only the current revocations, growing it
+        # if the list has outgrown the configured capacity
+        filt = BloomFilter(max(self.capacity, 2 * len(self._revoked)), self.error_rate)
+        for jti in self._revoked:
+            filt.add(jti)
+        self._filter = filt
+
+    def __len__(self):
+        # the number of (unpruned) revocations made via this list
+        return len(self._revoked)
+
+    def __contains__(self, jti):
+        return self.is_revoked(jti)
+
+    def stats(self) -> Mapping:
+        """
+        return a dictionary of statistics describing the use of this list
+        """
+        return OrderedDict([
+            ("revoked",      len(self._revoked)),
+            ("checks",       self.checks),
+            ("filtered",     self.filtered),
+            ("filter_bytes", self._filter.size)
+        ])
@@ -0,0 +1,119 @@
+"""
+a module providing the JSON serialization used to export credentials.
+
+The encoding is done by a pluggable backend.  By default, the fastest one installed is used:
+``orjson`` if it is available, otherwise the standard library's ``json`` module.  A backend
+can be chosen explicitly via :py:func:`set_backend`; it is also used for decoding via
+:py:func:`loads`.  Either way, output can be produced in
+a pretty-printed form (with an indent of 2, the default for credentials) or a compact form
+without any optional whitespace; the latter is preferred for sending over the wire.  The 
+output is the same with either backend; in particular, non-ASCII characters are always
+escaped (as ``\\uXXXX``), so data containing them is encoded by the standard library.
+Read-only mappings (like the nested values of a
+:py:class:`~nistoar.auth.creds.CredentialsSnapshot`) are encoded as JSON objects; other
+encoders of credential data can pass :py:func:`encode_default` as their ``default`` hook to
+do the same.
+"""
+import json
+from collections.abc import Mapping
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ("json", "orjson")
+_COMPACT_SEPARATORS = (',', ':')
+
+def encode_default(obj: Any):
+    """
+    return a JSON-encodable form of an object that a JSON encoder does not natively support;
+    this is intended to be passed as the ``default`` hook of ``json.dumps()`` (or 
+    ``orjson.dumps()``).  Mappings (such as ``types.MappingProxyType``) are converted to 
+    dicts.
+    :raises TypeError:  if the object cannot be converted
+    """
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+class JSONEncoder(json.JSONEncoder):
+    """
+    a JSON encoder that uses :py:func:`encode_default` for unsupported objects (e.g. for 
+    passing to ``jwt.encode()``)
+    """
+    def default(self, obj):
+        return encode_default(obj)
+
+def _json_dumps(obj: Any, indent: int=None) -> str:
+    if indent is None:
+        return json.dumps(obj, separators=_COMPACT_SEPARATORS, default=encode_default)
+    return json.dumps(obj, indent=indent, default=encode_default)
+
+def _orjson_dumps(obj: Any, indent: int=None) -> str:
+    if indent is None:
+        opts = 0
+    elif indent == 2:
+        opts = orjson.OPT_INDENT_2
+    else:
+        # orjson only supports an indent of 2
+        return _json_dumps(obj, indent)
+    try:
+        out = orjson.dumps(obj, default=encode_default, option=opts)
+    except TypeError:
+        # e.g. non-str keys or integers too big for orjson: let the stdlib handle it
+        return _json_dumps(obj, indent)
+    if not out.isascii():
+        # orjson writes non-ASCII characters as raw UTF-8, while the stdlib escapes them;
+        # let the stdlib encode these so that the output is the same with either backend
+        return _json_dumps(obj, indent)
+    return out.decode('ascii')
+
+def _json_loads(data):
+    return json.loads(data)
+
+_dumps = None
+_loads = None
+backend = None
+
+def set_backend(name: str=None):
+    """
+    select the JSON encoder to use
+    :param str name:  the name of the backend (one of :py:data:`BACKENDS`); if None, the
+                      fastest installed backend is chosen.
+    :raises ValueError:  if the named backend is not recognized or not installed
+    """
+    global _dumps, _loads, backend
+    if name is None:
+        name = "orjson" if orjson else "json"
+    if name == "orjson":
+        if not orjson:
+            raise ValueError("set_backend(): orjson package is not installed")
+        _dumps = _orjson_dumps
+        _loads = orjson.loads
+    elif name == "json":
+        _dumps = _json_dumps
+        _loads = _json_loads
+    else:
+        raise ValueError("set_backend(): unrecognized JSON backend: "+str(name))
+    backend = name
+
+def dumps(obj: Any, indent: int=2) -> str:
+    """
+    encode the given object into JSON using the current backend.
+    :param obj:         the data to encode
+    :param int indent:  the number of spaces to indent nested data by; if None, the output
+                        will be compact, with no optional whitespace.
+    """
+    return _dumps(obj, indent)
+
+def loads(data):
+    """
+    decode the given JSON data using the current backend.
+    :param data:  the JSON-encoded data, as a str or bytes
+    :raises ValueError:  if the data is not valid JSON
+    """
+    return _loads(data)
+
+set_backend()
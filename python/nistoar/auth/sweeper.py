@@ -0,0 +1,97 @@
+"""
+a module providing a background thread that removes expired entries from the service's
+session store and caches.
+
+Expired sessions and cached credentials are otherwise only removed when they are next looked
+up, so those belonging to users who never return would accumulate.  A :py:class:`Sweeper`
+periodically calls the ``purge()`` method of each of its targets (e.g. a
+:py:class:`~nistoar.auth.wsgi.sessions.SessionStore` or a
+:py:class:`~nistoar.auth.cache.TTLCache`), which removes entries in order of expiration
+using the target's expiry index.  Entries are purged in small batches, and the sweeper pauses
+between batches, so that a target is never locked for long and request threads are not
+stalled by a large backlog.
+"""
+import time, logging, threading
+from collections import OrderedDict
+from typing import Iterable, Mapping
+
+log = logging.getLogger(__name__)
+
+class Sweeper(threading.Thread):
+    """
+    a daemon thread that periodically purges expired entries from a set of targets.  Each
+    target must provide a ``purge(limit)`` method that removes up to ``limit`` expired entries
+    and returns the number removed.
+    """
+
+    def __init__(self, targets: Iterable, interval: float=60.0, batch: int=500,
+                 pause: float=0.001):
+        """
+        create the sweeper; call :py:meth:`start` to begin sweeping.
+        :param list targets:  the objects to purge
+        :param float interval:  the number of seconds between sweeps
+        :param int    batch:  the maximum number of entries to remove from a target at a time
+        :param float  pause:  the number of seconds to wait between batches, giving request
+                              threads a chance to run
+        """
+        super(Sweeper, self).__init__(name="nistoar-auth-sweeper", daemon=True)
+        if not isinstance(batch, int) or batch < 1:
+            raise ValueError("Sweeper: batch not a positive int: "+str(batch))
+        if not isinstance(interval, (int, float)) or interval <= 0:
+            raise ValueError("Sweeper: interval not a positive number: "+str(interval))
+        self.targets = [t for t in targets if t is not None]
+        self.interval = interval
+        self.batch = batch
+        self.pause = pause
+        self._stopped = threading.Event()
+        self.sweeps = 0
+        self.purged = 0
+        self.last_duration = 0.0
+
+    def sweep(self) -> int:
+        """
+        purge all currently expired entries from the targets, one batch at a time
+        :return:  the number of entries purged
+        """
+        start = time.time()
+        total = 0
+        for target in self.targets:
+            while not self._stopped.is_set():
+                try:
+                    n = target.purge(self.batch)
+                except Exception as ex:
+                    log.warning("Failed to purge expired entries from %s: %s",
+                                type(target).__name__, str(ex))
+                    break
+                total += n
+                if n < self.batch:
+                    break
+                self._stopped.wait(self.pause)
+
+        self.sweeps += 1
+        self.purged += total
+        self.last_duration = time.time() - start
+        return total
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sweep()
+
+    def stop(self, timeout: float=None):
+        """
+        stop sweeping and wait for the thread to exit
+        :param float timeout:  the maximum number of seconds to wait
+        """
+        self._stopped.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def stats(self) -> Mapping:
+        """
+        return a dictionary of statistics describing the work of this sweeper
+        """
+        return OrderedDict([
+            ("sweeps",        self.sweeps),
+            ("purged",        self.purged),
+            ("last_duration", self.last_duration)
+        ])
@@ -40,15 +40,172 @@ properties:
     (bool) _optional_.  If true, debugging will be turned on in both the Flask machinery and the 
     SAML library (over-riding the ``debug`` properties supported in the ``flask`` and ``saml``
     dictionaries).
+``introspection_cache_size``
+    (int) _optional_.  The maximum number of recently verified tokens whose claims are cached
+    by the ``/sso/auth/_introspect`` endpoint (default: 4096).  
+``credentials_cache_size``
+    (int) _optional_.  The maximum number of logged-in users whose credentials (derived from
+    their SAML attributes) are cached between requests (default: 0, i.e. no caching).  
+    Caching is turned on by setting this to a positive number (e.g. 1024, for a service with
+    up to about that many concurrently active users).  A user's cached credentials are 
+    dropped when their SAML session expires (or after ``credentials_cache_ttl`` seconds if 
+    the session has no expiration; default: 3600), or when the user's attributes in the 
+    session change.  
+``expose_stats``
+    (bool) _optional_.  If true, statistics about the service's caches (including hit rates)
+    and the memory saved by sharing the storage of equal SAML attribute names and values 
+    will be available from the ``/sso/auth/_stats`` endpoint (default: false).
+``json_format``
+    (str) _optional_.  The formatting of the credentials returned by ``/sso/auth/_logininfo``
+    and ``/sso/auth/_tokeninfo``: ``pretty`` (indented; the default), ``compact`` (no extra 
+    whitespace), or ``negotiate``, which returns compact output unless the client's 
+    ``Accept`` header prefers ``text/html`` (as a browser's does) over ``application/json``.
+``json_backend``
+    (str) _optional_.  The JSON encoder to use, either ``json`` (the standard library) or 
+    ``orjson``.  By default, ``orjson`` is used if it is installed.
+``idp_profile``
+    (str) _optional_.  The name of the IDP profile that determines how the SAML attributes
+    returned by the IDP are converted into the user's credentials: ``nist_okta`` (the 
+    default), ``nist_ms``, or the fully-qualified name of a module providing a ``mapper`` 
+    (see :py:mod:`nistoar.auth.idp`).  
+``attribute_map``
+    (dict) _optional_.  A specification of how the SAML attributes are converted into the 
+    user's credentials (see :py:mod:`nistoar.auth.idp.mapper`); if set, it overrides 
+    ``idp_profile``.  
+``attribute_maps``
+    (dict) _optional_.  If set, the ``attribute_map`` can refer to SAML attributes by their
+    friendly names, as defined by a directory of pysaml2-style attribute map files (see 
+    :py:mod:`nistoar.auth.idp.attrmaps`).  Its ``dir`` sub-property gives the directory 
+    (relative to the ``data_dir``), ``prefer`` optionally lists the maps (by file name 
+    without the extension) that take precedence, and ``cache_file`` names the file to cache
+    the compiled maps in (default: ``.attribute_index.json`` in ``dir``; set to null to turn
+    off caching).
+``session_store``
+    (dict) _optional_.  If set, session data (including the user's SAML attributes) will be 
+    kept on the server rather than in the session cookie, which will carry only a signed 
+    session identifier (see :py:mod:`nistoar.auth.wsgi.sessions`).  Its ``type`` sub-property
+    selects the store: ``memory`` (the default) keeps sessions in the memory of the service 
+    process, and ``sqlite`` keeps them in the SQLite database file given by ``path`` (relative
+    to the ``data_dir``), which can be shared by all the service processes on a node.  
+    Sessions are kept for Flask's ``PERMANENT_SESSION_LIFETIME`` or until the user's SAML 
+    session expires, if sooner; sessions that have not been authenticated (e.g. those 
+    created when a login starts) are kept only for ``anonymous_lifetime`` seconds (default:
+    900).  The ``memory`` store holds at most ``max_sessions`` sessions (default: 100000), 
+    evicting those closest to expiring when full.  A session is given a new identifier when 
+    the user logs in.  Expired sessions are removed by a background thread (see 
+    ``session_sweep``).  
+``session_sweep``
+    (dict) _optional_.  Options for the background thread that removes expired sessions and
+    cached credentials, which is started when ``session_store`` is set:  ``interval`` gives
+    the number of seconds between sweeps (default: 60), and ``batch`` gives the number of 
+    entries removed at a time (default: 500).  Setting this parameter to false turns off the 
+    thread.  (When running under uwsgi, the application should be loaded in each worker, 
+    e.g. with ``lazy-apps``, so that each worker runs its own thread.)
+``session_cookie``
+    (dict) _optional_.  Options for sessions kept in the session cookie (i.e. when 
+    ``session_store`` is not set).  By default, Flask's standard session cookie is used.  
+    Setting the ``compact`` sub-property to true encodes sessions instead as compact JSON 
+    that is compressed when that makes the cookie smaller (see 
+    :py:class:`~nistoar.auth.wsgi.sessions.CompactCookieSessionInterface`); setting 
+    ``compress`` to false turns off the compression.  The compact cookie is also used when
+    ``sliding_session`` is set, unless ``compact`` is explicitly false.  Cookies issued in 
+    the standard format remain valid after the compact cookie is turned on (they are 
+    re-issued in the compact format), but compact cookies are not understood if it is 
+    later turned off, so doing so ends the sessions in progress.
+``sliding_session``
+    (bool or dict) _optional_.  If set to true or a dictionary, sessions expire after Flask's 
+    ``PERMANENT_SESSION_LIFETIME`` of inactivity (or when the user's SAML session expires, if
+    sooner).  To avoid re-issuing the session cookie with every request, a session that is 
+    not otherwise modified is rewritten only after the fraction of its lifetime given by the 
+    ``refresh_fraction`` sub-property (default: 0.5) has passed since it was last written.  
+    The number of writes avoided is reported by the ``/sso/auth/_stats`` endpoint.  This is
+    not supported with Flask's standard session cookie (i.e. with ``session_cookie`` 
+    ``compact`` set to false).
+``revocation``
+    (dict) _optional_.  If set, tokens issued to a user are revoked when the user logs out, 
+    and revoked tokens are reported as inactive by the ``/sso/auth/_introspect`` endpoint.  
+    Its ``capacity`` sub-property gives the number of unexpired revoked tokens the service 
+    expects to track at once (default: 100000), and ``error_rate`` sets the false positive 
+    rate of the filter used to make revocation checks fast (default: 0.001).  If an 
+    ``sqlite`` ``session_store`` is configured, revocations are also saved to it, so that a 
+    token revoked by one service process (e.g. a uwsgi worker) is revoked in all of them; 
+    otherwise, revocations are held in memory and are not shared between processes, and 
+    revocation should be used only when the service runs as a single process.
 
 The following sub-properties of the ``jwt`` configuration dictionary are supported:
 
 ``secret``
-    (str) _required_.  The HS256 secret to use to create the encrypted JWT token.  This must be 
-    shared with the backend services that will accept tokens from this service.
+    (str) _required_ (unless ``algorithm`` is asymmetric or ``keyring_file`` is set).  The HS256
+    secret to use to create the encrypted JWT token.  This must be shared with the backend 
+    services that will accept tokens from this service.  It (like ``keyring_file``) must not
+    be set with an asymmetric ``algorithm``.
+``keyring_file``
+    (str) _optional_.  The path to a JSON file containing an ordered list of HS256 keys (each
+    with ``kid`` and ``secret`` properties, newest first) to use in lieu of ``secret``.  
+    Tokens are signed with the newest key, and older keys are accepted for verification for
+    a grace period (``keyring_grace_period``, default: ``lifetime``) after their ``retired``
+    time (or, if that is not set, after the service first sees them demoted).  The file is
+    re-read when it changes (checked at most every ``keyring_check_interval`` seconds), so
+    keys can be rotated without restarting the service.  A relative path is taken to be 
+    relative to the ``data_dir``.  (The list can alternatively be given directly via the 
+    ``keyring`` parameter.)
+``algorithm``
+    (str) _optional_.  The algorithm used to sign tokens (default: HS256).  If set to a 
+    public-key algorithm (one of RS256, RS384, RS512, PS256, PS384, PS512, ES256, ES384, ES512,
+    or EdDSA), tokens will be signed with a private key (given via ``private_key`` or 
+    ``private_key_file``), and the corresponding public key will be published as a JSON Web 
+    Key Set at ``/sso/auth/.well-known/jwks.json``.  Backend services can then verify tokens 
+    without the shared secret.  Any other value is rejected as a configuration error.
+``private_key_file``
+    (str) _optional_.  The path to the PEM file containing the private signing key used with 
+    an asymmetric ``algorithm``.  A relative path is taken to be relative to the ``data_dir``.
+``kid``
+    (str) _optional_.  The key identifier included in the header of tokens signed with an 
+    asymmetric ``algorithm`` (default: the public key's RFC 7638 thumbprint).
+``jwks_max_age``
+    (int) _optional_.  The number of seconds that clients may cache the published JSON Web 
+    Key Set (default: 3600).  
 ``lifetime``
     The lifespan of tokens generated by this service, given in seconds.  That is, the tokens
-    will expire this many seconds after they are created. 
+    will expire this many seconds after they are created.
+``encoder``
+    (str) _optional_.  The token encoder implementation to use: either ``pyjwt`` (the default)
+    or ``fast``, a specialized HS256 encoder that prepares the token header and signing key
+    once at start-up.  Both produce identical tokens.
+``claim_profiles``
+    (dict) _optional_.  Named profiles that select (and optionally rename) the user 
+    attributes included in tokens for particular audiences, keeping tokens small; see 
+    :py:mod:`nistoar.auth.claims` for details.  A client can request a profile via the 
+    ``audience`` query parameter to ``/sso/auth/_tokeninfo``; otherwise, the profile is 
+    chosen by matching the requesting application's URL (from the ``Origin`` or ``Referer``
+    header) against the profiles' ``endpoints``.
+``default_claim_profile``
+    (str) _optional_.  The name of the claim profile to apply when no other profile is 
+    selected (default: the profile named ``default``, if any).
+``compact``
+    (bool or dict) _optional_.  If set, tokens will use a compact claim encoding with short
+    codes for well-known attribute names and, when the attributes are large, a DEFLATE-
+    compressed payload (see :py:mod:`nistoar.auth.claims`).  Services receiving these tokens
+    must expand them with ``nistoar.auth.claims.expand_claims()``.  
+``refresh``
+    (dict) _optional_.  If set, ``/sso/auth/_tokeninfo`` will also return a ``refreshToken``
+    that can be POSTed (as the ``refresh_token`` parameter) to ``/sso/auth/_refresh`` to 
+    get a new access token (and a new refresh token) without the user logging in again.  
+    This allows access token ``lifetime`` to be kept short.  Its ``lifetime`` sub-property 
+    sets the refresh token lifetime (default: 86400), and ``access_lifetime`` sets the 
+    lifetime of the access tokens it is exchanged for (default: ``lifetime`` above).  
+    Refresh tokens carry only the user's identifier (the user's attributes are kept by the
+    service) and are signed with a key derived from the signing key, so they cannot be used 
+    as access tokens (nor are they accepted by ``/sso/auth/_introspect``).  Each refresh 
+    token can be used only once.  The refresh token records are kept in the 
+    ``session_store``, if configured (so that they can be shared between processes), and 
+    otherwise in memory (up to ``store_size`` of them; default: 100000).  
+``cache``
+    (dict) _optional_.  If set, previously generated tokens will be reused for repeated
+    requests from the same user as long as the user's attributes have not changed.  Its
+    ``size`` sub-property sets the maximum number of tokens cached (default: 1024), and its
+    ``min_remaining`` sub-property sets the minimum number of seconds a cached token must
+    have before expiring for it to be reused (default: half of ``lifetime``).
 
 As alluded to above, this Flask requires access to various files, including the one containing 
 the default configuration values.  By default, this will be _<install_root>_``/etc/authservice``,
@@ -59,9 +216,11 @@ default file can be given to the :py:func:`create_app` function.
 @Deoyani Nandrekar-Heinis
 @Raymond Plante
 """
-import os, logging, pdb
+import os, time, logging, json, hashlib, pdb
+import jwt
 from pathlib import Path
 from typing import List
+from collections import OrderedDict
 from collections.abc import Mapping
 from datetime import datetime
 
@@ -73,8 +232,19 @@ from onelogin.saml2.utils import OneLogin_Saml2_Utils, OneLogin_Saml2_Error
 from lxml.etree import XMLSyntaxError
 
 from .config import expand_config, ConfigurationException, configure_log, find_auth_data_dir
-from ..creds import Credentials, create_default_token_generator
-from ..idp import make_credentials
+from ..creds import (Credentials, RefreshTokenManager,
+                     create_default_token_generator)
+from ..cache import TTLCache
+from ..revoke import RevocationList
+from ..sweeper import Sweeper
+from .. import serialize
+from .sessions import (ServerSideSessionInterface, CompactCookieSessionInterface,
+                       MemorySessionStore, create_session_store)
+from .. import idp
+from ..idp.mapper import AttributeMapper
+from ..idp.attrmaps import load_attribute_maps
+from ..idp.lazy import epoch_expiration
+from ..idp import intern
 
 def create_app(config: Mapping=None, data_dir=None):
     """
@@ -110,7 +280,108 @@ def create_app(config: Mapping=None, data_dir=None):
                                      str(type(config.get('allowed_service_endpoints'))))
 
     configure_log(config=config)
-    create_default_token_generator(config.get('jwt'))
+    jwtcfg = config.get('jwt')
+    for param in "private_key_file keyring_file".split():
+        if jwtcfg and jwtcfg.get(param) and not os.path.isabs(jwtcfg[param]):
+            jwtcfg = dict(jwtcfg)
+            jwtcfg[param] = str(data_dir / jwtcfg[param])
+            config['jwt'] = jwtcfg
+    tokengen = create_default_token_generator(jwtcfg)
+
+    # the published keys do not change, so prepare the response content once
+    jwks = tokengen.jwks()
+    jwks_body = json.dumps(jwks, indent=2) if jwks else None
+    jwks_etag = hashlib.sha256(jwks_body.encode('utf-8')).hexdigest() if jwks else None
+
+    json_format = config.get('json_format', 'pretty')
+    if json_format not in ('pretty', 'compact', 'negotiate'):
+        raise ConfigurationException("unsupported value for parameter: json_format: "+
+                                     str(json_format))
+    if config.get('json_backend'):
+        try:
+            serialize.set_backend(config['json_backend'])
+        except ValueError as ex:
+            raise ConfigurationException("json_backend: "+str(ex)) from ex
+
+    # the conversion of a user's SAML attributes to credentials, resolved once here
+    attrindex = None
+    amcfg = config.get('attribute_maps')
+    if amcfg:
+        if not isinstance(amcfg, Mapping) or not amcfg.get('dir'):
+            raise ConfigurationException("attribute_maps: missing required property: dir")
+        amdir = data_dir / amcfg['dir']
+        cachefile = amcfg.get('cache_file', str(amdir / ".attribute_index.json"))
+        if cachefile:
+            cachefile = data_dir / cachefile
+        try:
+            attrindex = load_attribute_maps(amdir, cachefile, amcfg.get('prefer'))
+        except (OSError, ValueError, SyntaxError) as ex:
+            raise ConfigurationException("attribute_maps: unable to load maps: "+str(ex)) \
+                from ex
+    if config.get('attribute_map'):
+        mapper = AttributeMapper.from_config(config['attribute_map'], attrindex)
+    else:
+        try:
+            mapper = idp.get_mapper(config.get('idp_profile'))
+        except ValueError as ex:
+            raise ConfigurationException("idp_profile: "+str(ex)) from ex
+
+    # the server-side store for session data (if not kept in the session cookie)
+    sessstore = None
+    if config.get('session_store'):
+        sessstore = create_session_store(config['session_store'], data_dir)
+    refresher = None
+    if jwtcfg and jwtcfg.get('refresh'):
+        refcfg = jwtcfg['refresh']
+        refresher = RefreshTokenManager(tokengen, refcfg if isinstance(refcfg, Mapping) else {},
+                                        sessstore)
+
+    # revocations are shared via the session store unless it is local to this process
+    revcfg = config.get('revocation')
+    if revcfg:
+        if not isinstance(revcfg, Mapping):
+            revcfg = {}
+        revstore = None if isinstance(sessstore, MemorySessionStore) else sessstore
+        try:
+            tokengen.revocations = RevocationList(revcfg.get('capacity', 100000),
+                                                  revcfg.get('error_rate', 0.001), revstore)
+        except (ValueError, TypeError) as ex:
+            raise ConfigurationException("revocation: "+str(ex)) from ex
+
+    sesscookie = config.get('session_cookie') or {}
+    if not isinstance(sesscookie, Mapping):
+        raise ConfigurationException("session_cookie: not an object")
+    refresh_fraction = None
+    slidecfg = config.get('sliding_session')
+    compact = sesscookie.get('compact', bool(slidecfg))
+    if slidecfg:
+        if not isinstance(slidecfg, Mapping):
+            slidecfg = {}
+        refresh_fraction = slidecfg.get('refresh_fraction', 0.5)
+        if sessstore is None and not compact:
+            raise ConfigurationException("sliding_session: not supported with the standard "
+                                         "session cookie (session_cookie.compact = false)")
+
+    # the claims of recently introspected tokens, keyed by token digest
+    introspected = TTLCache(config.get('introspection_cache_size', 4096))
+
+    # snapshots of the credentials of logged-in users, keyed by SAML session
+    credcache = None
+    if config.get('credentials_cache_size', 0):
+        credcache = TTLCache(config['credentials_cache_size'],
+                             config.get('credentials_cache_ttl', 3600))
+
+    # the background removal of expired sessions and credentials
+    sweeper = None
+    sweepcfg = config.get('session_sweep', {})
+    if sessstore is not None and sweepcfg is not False:
+        if not isinstance(sweepcfg, Mapping):
+            sweepcfg = {}
+        try:
+            sweeper = Sweeper([sessstore, credcache, introspected],
+                              sweepcfg.get('interval', 60.0), sweepcfg.get('batch', 500))
+        except ValueError as ex:
+            raise ConfigurationException("session_sweep: "+str(ex)) from ex
 
     if config.get('debug'):
         # setting debug at the top level sets for both Flask and onelogin.saml2 
@@ -136,6 +407,25 @@ def create_app(config: Mapping=None, data_dir=None):
         app.logger.warning("SAML-based logins have been disabled!")
 
     app.config.update(config)  # sets SECRET_KEY
+    try:
+        if sessstore is not None:
+            app.session_interface = ServerSideSessionInterface(sessstore, refresh_fraction,
+                                          config['session_store'].get('anonymous_lifetime', 900))
+        elif compact:
+            app.session_interface = CompactCookieSessionInterface(sesscookie.get('compress',True),
+                                                                  refresh_fraction)
+    except ValueError as ex:
+        raise ConfigurationException("session options: "+str(ex)) from ex
+    app.extensions['nistoar.auth'] = {
+        "token_generator": tokengen,
+        "credentials_cache": credcache,
+        "introspection_cache": introspected,
+        "attribute_index": attrindex,
+        "session_store": sessstore,
+        "sweeper": sweeper
+    }
+    if sweeper is not None:
+        sweeper.start()
 
     @app.route('/sso/saml/login', methods=['GET'])
     def login():
@@ -208,13 +498,22 @@ def create_app(config: Mapping=None, data_dir=None):
 
         if 'AuthNRequestID' in session:
             del session['AuthNRequestID']
-        session['samlUserAttrs'] = auth.get_attributes()
+        if hasattr(session, 'regenerate'):
+            # a server-side session gets a new identifier so that one obtained (or planted)
+            # before login cannot be used to access the authenticated session
+            session.regenerate()
+        session['samlUserAttrs'] = intern.intern_attributes(auth.get_attributes())
+        session['samlUserAttrsDigest'] = attributes_digest(session['samlUserAttrs'])
         session['samlNameId'] = auth.get_nameid()
         session['samlNameIdFormat'] = auth.get_nameid_format()
         session['samlNameIdNameQualifier'] = auth.get_nameid_nq()
         session['samlNameIdSPNameQualifier'] = auth.get_nameid_spnq()
         session['samlSessionIndex'] = auth.get_session_index()
-        session['samlSessionExpiration'] = auth.get_session_expiration()
+        expires = auth.get_session_expiration()
+        if expires is not None:
+            # store as an epoch time so that it need not be parsed with each request
+            expires = int(epoch_expiration(expires))
+        session['samlSessionExpiration'] = expires
         session['samlAuthenticated'] = True
         req = convert_flask_request_for_saml(request,
                                              current_app.config.get('lowercase_urlencoding'))
@@ -271,6 +570,7 @@ def create_app(config: Mapping=None, data_dir=None):
                         cfg.get('server', {}).get('context-path', "") + \
                         "sso/_logininfo"
 
+        revoke_issued_tokens(session)
         return redirect(auth.logout(return_to, name_id, session_index, name_id_nq,
                                     name_id_format, name_id_spnq))
 
@@ -288,7 +588,11 @@ def create_app(config: Mapping=None, data_dir=None):
         auth = create_saml_sp(request, cfg['saml'], cfg.get('data_dir'),
                               cfg.get('lowercase_urlencoding'))
 
-        dscb = lambda: session.clear()
+        def dscb():
+            revoke_issued_tokens(session)
+            if credcache is not None:
+                credcache.discard(credentials_cache_key(session))
+            session.clear()
         try:
             return_to = auth.process_slo(request_id=request_id, delete_session_cb=dscb)
         except OneLogin_Saml2_Error as ex:
@@ -328,7 +632,7 @@ def create_app(config: Mapping=None, data_dir=None):
         if not creds.is_authenticated() or creds.expired():
             return _handle_unauthenticated("Client is not authenticated", "Unauthenticated")
 
-        resp = make_response(creds.to_json(), 200)
+        resp = make_response(creds.to_json(json_indent()), 200)
         resp.content_type = "application/json"
         return resp
 
@@ -347,11 +651,40 @@ def create_app(config: Mapping=None, data_dir=None):
                 raise
 
         if session_authenticated(session):
-            return make_credentials(session.get('samlUserAttrs', {}), get_expiration(session))
+            return get_session_credentials(session)
 
         # return an anonymous user
         return Credentials()  
 
+    def get_session_credentials(sess):
+        """
+        return the credentials for the user of the given authenticated session.  If caching
+        is enabled, these are returned as a (shared) :py:class:`CredentialsSnapshot` that 
+        is created once per session; otherwise, they are a lazy view over the session's SAML
+        attributes, so that checking the user's identity does not require converting all of
+        the attributes.
+        """
+        expires = get_expiration(sess)
+        if credcache is None:
+            return mapper.make_lazy_credentials(sess.get('samlUserAttrs', {}), expires)
+
+        key = credentials_cache_key(sess)
+        creds = credcache.get(key)
+        if creds is None:
+            # the cached credentials are kept for the life of the session, so they are made
+            # to share storage with equal strings held by other sessions and credentials
+            samlattrs = intern.intern_attributes(sess.get('samlUserAttrs', {}))
+            creds = mapper.make_lazy_credentials(samlattrs, expires).snapshot()
+            credcache.put(key, creds, expires)
+        return creds
+
+    def credentials_cache_key(sess):
+        # identify a session's credentials by session, user, and the user's attributes
+        digest = sess.get('samlUserAttrsDigest')
+        if not digest:
+            digest = attributes_digest(sess.get('samlUserAttrs', {}))
+        return (sess.get('samlSessionIndex'), sess.get('samlNameId'), digest)
+
     def session_authenticated(sess):
         """
         return True if the given dictionary describes an unexpired, authentication session. 
@@ -368,7 +701,16 @@ def create_app(config: Mapping=None, data_dir=None):
             return False
 
     def get_expiration(sess):
+        """
+        return the expiration time of the authenticated session as an epoch time in seconds,
+        or None if it is not set.  
+        """
         expiration = sess.get('samlSessionExpiration')
+        if expiration is None or isinstance(expiration, float):
+            return expiration
+        if isinstance(expiration, int):
+            # the usual case:  the expiration is stored as an epoch time
+            return float(expiration)
 
         if isinstance(expiration, str):
             try:
@@ -378,6 +720,11 @@ def create_app(config: Mapping=None, data_dir=None):
                     current_app.logger.error("session property, samlSessionExpiration, contains "
                                              "unparseable value: %s", sess['samlSessionExpiration'])
                 raise
+        if isinstance(expiration, datetime):
+            expiration = expiration.timestamp()
+        elif expiration is not None:
+            # python3-saml provides the expiration as an epoch time
+            expiration = float(expiration)
 
         return expiration
 
@@ -389,7 +736,7 @@ def create_app(config: Mapping=None, data_dir=None):
         expires = get_expiration(sess)
         if expires is None:
             return False
-        if expires < datetime.now():
+        if expires < time.time():
             return True
         return False
 
@@ -405,11 +752,185 @@ def create_app(config: Mapping=None, data_dir=None):
         if not creds.is_authenticated() or creds.expired():
             return _handle_unauthenticated("Client is not authenticated", "Unauthenticated")
 
-        creds.set_token()
-        resp = make_response(creds.to_json(), 200)
+        # the credentials (which may be a snapshot shared via the cache) are not modified;
+        # the tokens are added to their JSON output
+        tokens = OrderedDict([("token", creds.create_token(profile=select_claim_profile()))])
+        if refresher:
+            tokens['refreshToken'] = refresher.issue(creds)
+        if tokengen.revocations is not None:
+            record_issued_token(session, tokens['token'])
+            if refresher:
+                record_issued_token(session, tokens['refreshToken'])
+        resp = make_response(creds.to_json_with(tokens, json_indent()), 200)
+        resp.content_type = "application/json"
+        return resp
+
+    @app.route('/sso/auth/_refresh', methods=['POST'])
+    def refresh_token():
+        """
+        exchange a refresh token for a new access token.  
+
+        The refresh token (as returned by ``/sso/auth/_tokeninfo``) is provided as the 
+        ``refresh_token`` parameter of a form-encoded or JSON request body.  The response has
+        the same form as that of ``/sso/auth/_tokeninfo``, including a new refresh token to 
+        use the next time; the refresh token that was provided should be discarded.  This 
+        does not require an authenticated session.
+        """
+        if not refresher:
+            return _handle_error("Token refresh is not enabled", 404)
+
+        token = request.form.get('refresh_token')
+        if not token and request.is_json:
+            body = request.get_json(silent=True)
+            if isinstance(body, Mapping):
+                token = body.get('refresh_token')
+        if not token or not isinstance(token, str):
+            return _handle_badinput("missing refresh_token parameter")
+
+        try:
+            creds = refresher.exchange(token, select_claim_profile())
+        except jwt.InvalidTokenError as ex:
+            current_app.logger.info("Rejected refresh token: %s", str(ex))
+            return _handle_unauthenticated("Invalid refresh token", "Unauthenticated")
+
+        resp = make_response(creds.to_json(json_indent()), 200)
         resp.content_type = "application/json"
         return resp
 
+    def json_indent():
+        """
+        return the indentation to format credentials with for the current request, or None
+        for compact output
+        """
+        if json_format == 'negotiate':
+            accept = request.accept_mimetypes
+            if accept.quality('text/html') > accept.quality('application/json'):
+                return 2
+            return None
+        return 2 if json_format == 'pretty' else None
+
+    def select_claim_profile():
+        """
+        return the claim profile to apply to a token for the current request, or None to 
+        use the default.  The profile is chosen by the ``audience`` query parameter or by 
+        the URL of the requesting application.  
+        """
+        if not tokengen.claim_profiles:
+            return None
+        return tokengen.claim_profiles.select(request.args.get('audience'),
+                                              request.headers.get('Referer') or
+                                              request.headers.get('Origin'))
+
+    def record_issued_token(sess, token: str, maxcount: int=20):
+        """
+        remember the identifier of a token issued during the given session so that it can 
+        be revoked when the user logs out.  Identifiers of expired tokens are dropped, and 
+        only the most recent ``maxcount`` identifiers are kept.
+        """
+        claims = jwt.decode(token, options={"verify_signature": False})
+        jti = claims.get('jti')
+        issued = sess.get('issuedTokens', [])
+        if not jti or any(t[0] == jti for t in issued):
+            # avoid modifying the session if it already knows about this token
+            return
+        now = time.time()
+        issued = [t for t in issued if t[1] and t[1] > now][-(maxcount-1):]
+        issued.append([jti, claims.get('exp')])
+        sess['issuedTokens'] = issued
+
+    def revoke_issued_tokens(sess):
+        """
+        revoke the tokens recorded as issued during the given session
+        """
+        if tokengen.revocations is None:
+            return
+        for jti, exp in sess.pop('issuedTokens', []):
+            tokengen.revoke({"jti": jti, "exp": exp})
+
+    @app.route('/sso/auth/_introspect', methods=['POST'])
+    def introspect():
+        """
+        verify a token issued by this service and return the claims it contains.  This allows
+        services that cannot verify tokens themselves to have the broker do it.  
+
+        The token can be provided as the ``token`` parameter of a form-encoded or JSON request
+        body or as a bearer token in the ``Authorization`` header.  Following RFC 7662, the
+        response is a JSON object whose ``active`` property indicates whether the token is 
+        valid; if it is, the token's claims are included as well.  The claims of recently
+        verified tokens are cached until the tokens expire.  
+        """
+        token = request.form.get('token')
+        if not token and request.is_json:
+            body = request.get_json(silent=True)
+            if isinstance(body, Mapping):
+                token = body.get('token')
+        if not token:
+            authz = request.headers.get('Authorization', '')
+            if authz[:7].lower() == "bearer ":
+                token = authz[7:].strip()
+        if not token or not isinstance(token, str):
+            return _handle_badinput("missing token parameter")
+
+        key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        claims = introspected.get(key)
+        if claims is None:
+            try:
+                claims = tokengen.decode(token)
+            except jwt.InvalidTokenError as ex:
+                current_app.logger.debug("Introspected token is invalid: %s", str(ex))
+                return make_response({"active": False}, 200)
+            except NotImplementedError as ex:
+                return _handle_error(str(ex), 501)
+            introspected.put(key, claims, claims.get('exp'))
+        elif tokengen.is_revoked(claims):
+            introspected.discard(key)
+            return make_response({"active": False}, 200)
+
+        out = {"active": True}
+        out.update(claims)
+        return make_response(out, 200)
+
+    @app.route('/sso/auth/_stats')
+    def get_stats():
+        """
+        return statistics about the use of the service's caches.  This is only available if
+        the ``expose_stats`` configuration parameter is set to true.
+        """
+        if not current_app.config.get('expose_stats'):
+            return _handle_error("Not found", 404)
+
+        out = {"introspection_cache": introspected.stats()}
+        if credcache is not None:
+            out['credentials_cache'] = credcache.stats()
+        if hasattr(tokengen, 'stats'):
+            out['token_cache'] = tokengen.stats()
+        if tokengen.revocations is not None:
+            out['revocations'] = tokengen.revocations.stats()
+        out['interned_attributes'] = intern.table.stats()
+        if sweeper is not None:
+            out['sweeper'] = sweeper.stats()
+        if hasattr(current_app.session_interface, 'stats'):
+            out['sessions'] = current_app.session_interface.stats()
+        return make_response(out, 200)
+
+    @app.route('/sso/auth/.well-known/jwks.json')
+    def get_jwks():
+        """
+        return the JSON Web Key Set containing the public keys that can be used to verify 
+        the tokens issued by this service.  This is only available when tokens are signed 
+        with an asymmetric algorithm.  The response can be cached by clients and supports
+        conditional requests via its ETag.
+        """
+        if not jwks_body:
+            return _handle_error("No public keys are published by this service", 404)
+
+        resp = make_response(jwks_body, 200)
+        resp.content_type = "application/json"
+        resp.set_etag(jwks_etag)
+        resp.cache_control.public = True
+        resp.cache_control.max_age = current_app.config.get('jwt', {}).get('jwks_max_age', 3600)
+        return resp.make_conditional(request)
+
     @app.route('/sso/metadata/')
     def metadata():
         log = current_app.logger
@@ -490,6 +1011,14 @@ def checkAllowedUrls(url: str, allowed: List[str]):
             return True
     return False
 
+def attributes_digest(attrs: Mapping) -> str:
+    """
+    return a digest of a set of SAML user attributes that can be used to recognize when 
+    they have changed
+    """
+    ser = json.dumps(attrs, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(ser.encode('utf-8')).hexdigest()
+
 def make_testuser_credentials(usercfg):
     attrs = {
         "userName":     usercfg.get("given_name", "Test"),
@@ -0,0 +1,635 @@
+"""
+a module providing the Flask session interfaces used by the authentication service, 
+including server-side session storage.
+
+By default, Flask keeps the entire session--which, after login, includes all of the user's
+SAML attributes--in a signed cookie, so that it is sent by the browser, verified, and
+deserialized with every request.  With the :py:class:`ServerSideSessionInterface`, the cookie
+carries only a (signed) session identifier, and the session data is held in a
+:py:class:`SessionStore`.  Two stores are provided:
+
+:py:class:`MemorySessionStore`
+    holds sessions in the memory of the service process.  This is fastest, but sessions are
+    not shared between processes (so it is suited to a single-process deployment).
+:py:class:`SQLiteSessionStore`
+    holds sessions in an SQLite database (in write-ahead-log mode), which can be shared by all
+    of the service processes (e.g. uwsgi workers) on a node.
+
+The store is selected via the ``session_store`` configuration parameter (see
+:py:mod:`nistoar.auth.wsgi.flask`) with :py:func:`create_session_store`.  A session is kept 
+in the store until its cookie expires or, if sooner, until its SAML session 
+(``samlSessionExpiration``) expires.  Both stores index their sessions by expiration time so 
+that expired sessions can be purged in small batches (see :py:meth:`SessionStore.purge`) by
+a background :py:class:`~nistoar.auth.sweeper.Sweeper`.
+
+When sessions are kept in the cookie, the service can be configured to use the
+:py:class:`CompactCookieSessionInterface` instead of Flask's default.  It prepares its
+signing serializer once rather than with every request and encodes the session as plain,
+compact JSON (optionally zlib-compressed) rather than Flask's tagged JSON.  It still accepts
+cookies written by Flask's default interface, so that switching to it does not end the 
+sessions already in progress; such a session is rewritten in the compact format with the
+response.
+
+Both of these interfaces support a sliding expiration mode (enabled by giving them a 
+``refresh_fraction``).  In this mode, a session expires after the application's 
+``PERMANENT_SESSION_LIFETIME`` of inactivity (or when its SAML session expires, if sooner).
+Rather than re-issuing the session cookie with every request to push back its expiration,
+an unmodified session is rewritten only once the given fraction of its lifetime has passed
+since it was last written.  The interfaces count the writes this avoids (see 
+:py:meth:`~ServerSideSessionInterface.stats`).
+"""
+import os, time, heapq, threading, secrets, sqlite3, hashlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from abc import ABC, abstractmethod
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Union
+
+from flask.sessions import SessionInterface, SessionMixin, SecureCookieSessionInterface
+from flask.json.tag import TaggedJSONSerializer
+from werkzeug.datastructures import CallbackDict
+from itsdangerous import Signer, BadSignature, URLSafeTimedSerializer
+from itsdangerous.url_safe import URLSafeSerializerMixin
+from itsdangerous.encoding import base64_encode
+
+from nistoar.base.config import ConfigurationException
+from .. import serialize
+
+class SessionStore(ABC):
+    """
+    a storage backend for session data, indexed by session identifier
+    """
+
+    @abstractmethod
+    def load(self, sid: str) -> Mapping:
+        """
+        return the data for the session with the given identifier, or None if the session
+        does not exist or has expired
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def save(self, sid: str, data: Mapping, expires: float):
+        """
+        save the data for a session
+        :param str     sid:  the session identifier
+        :param dict   data:  the session data
+        :param float expires:  the time (as an epoch time in seconds) after which the session
+                             can be discarded
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def touch(self, sid: str, expires: float):
+        """
+        update the expiration time of a session without changing its data
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def delete(self, sid: str):
+        """
+        discard the session with the given identifier
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def take(self, sid: str) -> Mapping:
+        """
+        discard the session with the given identifier and return its data, or None if the 
+        session does not exist or has expired.  This is atomic:  if it is called for the 
+        same session by several threads or processes at once, only one will get its data.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def purge(self, limit: int=None) -> int:
+        """
+        discard expired sessions, in order of expiration
+        :param int limit:  the maximum number of sessions to discard; if None, all expired 
+                           sessions are discarded.
+        :return:  the number of sessions discarded
+        """
+        raise NotImplementedError()
+
+class MemorySessionStore(SessionStore):
+    """
+    a SessionStore that holds sessions in the memory of the current process.  Note that the
+    values in a session's data are shared (not copied) between the requests that load it.
+    The sessions are indexed by expiration time with a heap.  The number of sessions held is
+    bounded:  when the store is full, the sessions closest to expiring (which will typically
+    be short-lived, unauthenticated ones) are evicted to make room.
+    """
+
+    def __init__(self, max_sessions: int=100000):
+        """
+        create the store
+        :param int max_sessions:  the maximum number of sessions to hold
+        """
+        if not isinstance(max_sessions, int) or max_sessions < 1:
+            raise ValueError("MemorySessionStore: max_sessions not a positive int: "+
+                             str(max_sessions))
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._expiries = []
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def load(self, sid: str) -> Mapping:
+        ent = self._sessions.get(sid)
+        if ent is None:
+            return None
+        if ent[0] <= time.time():
+            self.delete(sid)
+            return None
+        return dict(ent[1])
+
+    def save(self, sid: str, data: Mapping, expires: float):
+        with self._lock:
+            self._sessions[sid] = (expires, dict(data))
+            self._index(sid, expires)
+            if len(self._sessions) > self.max_sessions:
+                self._evict()
+
+    def _evict(self):
+        # drop the sessions closest to expiring until the store is back within its bound
+        expiries = self._expiries
+        while len(self._sessions) > self.max_sessions and expiries:
+            exp, sid = heapq.heappop(expiries)
+            ent = self._sessions.get(sid)
+            if ent is not None and ent[0] == exp:
+                del self._sessions[sid]
+                if exp > time.time():
+                    self.evictions += 1
+
+    def touch(self, sid: str, expires: float):
+        with self._lock:
+            ent = self._sessions.get(sid)
+            if ent is not None and ent[0] != expires:
+                self._sessions[sid] = (expires, ent[1])
+                self._index(sid, expires)
+
+    def _index(self, sid, expires):
+        # an entry is left in the heap when its session is updated or deleted; these stale
+        # entries are skipped when popped, and the heap is rebuilt if they accumulate
+        heapq.heappush(self._expiries, (expires, sid))
+        if len(self._expiries) > 2 * len(self._sessions) + 64:
+            self._expiries = [(ent[0], s) for s, ent in self._sessions.items()]
+            heapq.heapify(self._expiries)
+
+    def delete(self, sid: str):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def take(self, sid: str) -> Mapping:
+        with self._lock:
+            ent = self._sessions.pop(sid, None)
+        if ent is None or ent[0] <= time.time():
+            return None
+        return dict(ent[1])
+
+    def purge(self, limit: int=None) -> int:
+        now = time.time()
+        removed = 0
+        with self._lock:
+            expiries = self._expiries
+            while expiries and expiries[0][0] <= now and (limit is None or removed < limit):
+                exp, sid = heapq.heappop(expiries)
+                ent = self._sessions.get(sid)
+                if ent is not None and ent[0] == exp:
+                    del self._sessions[sid]
+                    removed += 1
+        return removed
+
+    def __len__(self):
+        return len(self._sessions)
+
+# connections inherited from a parent process, kept referenced so that they are never
+# closed (which could disturb the parent's use of the database)
+_inherited = []
+
+class SQLiteSessionStore(SessionStore):
+    """
+    a SessionStore that holds sessions in an SQLite database file.  The database is used in
+    write-ahead-log (WAL) mode so that the processes sharing it can read sessions while
+    another is writing.  Each thread uses its own connection, and a connection is never
+    reused by a process forked from the one that opened it (so the store can be created 
+    before a server forks its workers).
+    """
+
+    def __init__(self, dbfile: Union[str, Path], timeout: float=5.0):
+        """
+        open the store, creating the database if necessary
+        :param str   dbfile:  the path to the database file
+        :param float timeout:  the number of seconds to wait for another process's lock on
+                               the database to be released
+        """
+        self.dbfile = str(dbfile)
+        self.timeout = timeout
+        self._serializer = TaggedJSONSerializer()
+        self._local = threading.local()
+        # the connection used to create the schema is not kept
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS sessions "
+                             "(sid TEXT PRIMARY KEY, expires REAL NOT NULL, data TEXT NOT NULL)")
+                conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.dbfile, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self):
+        # connections are cached per thread and per process:  one inherited across a fork 
+        # must not be used (or closed) by the child
+        local = self._local
+        pid = os.getpid()
+        if getattr(local, 'pid', None) != pid:
+            if getattr(local, 'conn', None) is not None:
+                _inherited.append(local.conn)
+            local.conn = self._connect()
+            local.pid = pid
+        return local.conn
+
+    def load(self, sid: str) -> Mapping:
+        row = self._conn().execute("SELECT data FROM sessions WHERE sid = ? AND expires > ?",
+                                   (sid, time.time())).fetchone()
+        if row is None:
+            return None
+        return self._serializer.loads(row[0])
+
+    def save(self, sid: str, data: Mapping, expires: float):
+        self._conn().execute("INSERT OR REPLACE INTO sessions (sid, expires, data) "
+                             "VALUES (?, ?, ?)",
+                             (sid, expires, self._serializer.dumps(dict(data))))
+
+    def touch(self, sid: str, expires: float):
+        self._conn().execute("UPDATE sessions SET expires = ? WHERE sid = ?", (expires, sid))
+
+    def delete(self, sid: str):
+        self._conn().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def take(self, sid: str) -> Mapping:
+        conn = self._conn()
+        row = conn.execute("SELECT data FROM sessions WHERE sid = ? AND expires > ?",
+                           (sid, time.time())).fetchone()
+        # only the caller whose delete removes the row gets the data
+        if row is None or \
+           conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,)).rowcount != 1:
+            return None
+        return self._serializer.loads(row[0])
+
+    def purge(self, limit: int=None) -> int:
+        if limit is None:
+            return self._conn().execute("DELETE FROM sessions WHERE expires <= ?",
+                                        (time.time(),)).rowcount
+        return self._conn().execute("DELETE FROM sessions WHERE sid IN (SELECT sid FROM "
+                                    "sessions WHERE expires <= ? ORDER BY expires LIMIT ?)",
+                                    (time.time(), limit)).rowcount
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+class _SlidingExpiration:
+    # the sliding expiration mode shared by the service's session interfaces.  The time a
+    # session was last written is recorded in the session under REFRESHED_KEY.
+    REFRESHED_KEY = "_refreshed"
+
+    def _init_sliding(self, refresh_fraction):
+        if refresh_fraction is not None and \
+           (not isinstance(refresh_fraction, (int, float)) or not 0 <= refresh_fraction <= 1):
+            raise ValueError("refresh_fraction: not a number between 0 and 1: " +
+                             str(refresh_fraction))
+        self.refresh_fraction = refresh_fraction
+        self.refreshes = 0
+        self.writes_avoided = 0
+
+    @property
+    def sliding(self) -> bool:
+        """
+        True if sessions are given a sliding expiration
+        """
+        return self.refresh_fraction is not None
+
+    def get_expiration_time(self, app, session):
+        if not self.sliding:
+            return super(_SlidingExpiration, self).get_expiration_time(app, session)
+        now = time.time()
+        expires = now + app.permanent_session_lifetime.total_seconds()
+        samlexp = session.get('samlSessionExpiration')
+        if isinstance(samlexp, (int, float)) and now < samlexp < expires:
+            expires = samlexp
+        return datetime.fromtimestamp(expires, timezone.utc)
+
+    def should_set_cookie(self, app, session) -> bool:
+        if not self.sliding:
+            return super(_SlidingExpiration, self).should_set_cookie(app, session)
+        return session.modified
+
+    def _slide(self, app, session):
+        # in sliding mode, decide whether the session is due to be rewritten to push back its
+        # expiration; if so (or if it is to be written anyway), record the time of writing.
+        if not self.sliding or not session:
+            return
+        now = time.time()
+        if not session.modified:
+            # an unmodified session is rewritten only if it is due; one whose SAML session
+            # has expired (see session_expired()) is never extended
+            refreshed = session.get(self.REFRESHED_KEY)
+            samlexp = session.get('samlSessionExpiration')
+            lifetime = app.permanent_session_lifetime.total_seconds()
+            if (isinstance(refreshed, (int, float)) and
+                now - refreshed < self.refresh_fraction * lifetime) or \
+               (isinstance(samlexp, (int, float)) and samlexp <= now):
+                self.writes_avoided += 1
+                return
+            self.refreshes += 1
+        session[self.REFRESHED_KEY] = int(now)
+
+    def stats(self) -> Mapping:
+        """
+        return a dictionary of statistics describing the session writes made (``refreshes``)
+        and avoided (``writes_avoided``) to slide session expirations
+        """
+        return OrderedDict([
+            ("sliding",        self.sliding),
+            ("refreshes",      self.refreshes),
+            ("writes_avoided", self.writes_avoided)
+        ])
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """
+    a Flask session whose data is held in a :py:class:`SessionStore`
+    """
+
+    def __init__(self, initial: Mapping=None, sid: str=None, new: bool=False):
+        def on_update(self):
+            self.modified = True
+        super(ServerSideSession, self).__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """
+        give this session a new identifier, keeping its data.  The record under the old 
+        identifier is deleted when the session is saved.  This should be called when the 
+        user logs in so that an identifier obtained (or planted) beforehand cannot be used
+        to access the authenticated session.
+        """
+        if not self.new and self.replaced_sid is None:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+class ServerSideSessionInterface(_SlidingExpiration, SessionInterface):
+    """
+    a Flask session interface that keeps session data in a :py:class:`SessionStore`.  The
+    session cookie carries only the session identifier, signed with the application's
+    secret key.
+    """
+    salt = "nistoar-auth-session"
+
+    def __init__(self, store: SessionStore, refresh_fraction: float=None,
+                 anonymous_lifetime: float=900):
+        """
+        create the interface
+        :param SessionStore store:  the store to keep sessions in
+        :param float refresh_fraction:  if set, sessions are given a sliding expiration and 
+                             are rewritten once this fraction of their lifetime has passed
+                             (see the :py:mod:`module documentation 
+                             <nistoar.auth.wsgi.sessions>`)
+        :param float anonymous_lifetime:  the number of seconds to keep sessions that have 
+                             not (yet) been authenticated, such as those created when a login
+                             is started
+        :raises ValueError:  if ``refresh_fraction`` is not between 0 and 1 or 
+                             ``anonymous_lifetime`` is not a positive number
+        """
+        self._init_sliding(refresh_fraction)
+        if not isinstance(anonymous_lifetime, (int, float)) or anonymous_lifetime <= 0:
+            raise ValueError("anonymous_lifetime: not a positive number: "+
+                             str(anonymous_lifetime))
+        self.store = store
+        self.anonymous_lifetime = anonymous_lifetime
+        self._signer = None
+        self._signkey = None
+
+    def get_signer(self, app):
+        """
+        return the signer for session cookies, or None if the application has no secret key
+        """
+        key = app.secret_key
+        if not key:
+            return None
+        if key != self._signkey:
+            self._signer = Signer(key, salt=self.salt, key_derivation="hmac",
+                                  digest_method=hashlib.sha1)
+            self._signkey = key
+        return self._signer
+
+    def open_session(self, app, request):
+        signer = self.get_signer(app)
+        if signer is None:
+            return None
+        val = request.cookies.get(self.get_cookie_name(app))
+        if val:
+            try:
+                sid = signer.unsign(val).decode('utf-8')
+            except BadSignature:
+                sid = None
+            if sid:
+                data = self.store.load(sid)
+                if data is not None:
+                    return ServerSideSession(data, sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def store_expiration(self, app, session) -> float:
+        """
+        return the time (as an epoch time) after which the given session can be discarded
+        from the store.  Sessions that are not permanent are kept for the application's
+        ``PERMANENT_SESSION_LIFETIME``, but no longer than their (unexpired) SAML session.
+        Sessions that have not been authenticated are kept only for the configured
+        ``anonymous_lifetime``.
+        """
+        expires = self.get_expiration_time(app, session)
+        if expires is not None:
+            expires = expires.timestamp()
+        else:
+            expires = time.time() + app.permanent_session_lifetime.total_seconds()
+        if not session.get('samlAuthenticated'):
+            return min(expires, time.time() + self.anonymous_lifetime)
+        samlexp = session.get('samlSessionExpiration')
+        if isinstance(samlexp, (int, float)) and time.time() < samlexp < expires:
+            # an expired SAML session (e.g. one being renewed) does not shorten the session
+            expires = samlexp
+        return expires
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        self._slide(app, session)
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if getattr(session, 'replaced_sid', None):
+            # the session was given a new identifier (see ServerSideSession.regenerate())
+            self.store.delete(session.replaced_sid)
+            session.replaced_sid = None
+
+        if not session:
+            # the session was emptied (or never filled)
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        if session.modified or session.new:
+            self.store.save(session.sid, session, self.store_expiration(app, session))
+        else:
+            self.store.touch(session.sid, self.store_expiration(app, session))
+
+        response.set_cookie(name, self.get_signer(app).sign(session.sid).decode('utf-8'),
+                            expires=self.get_expiration_time(app, session), httponly=httponly,
+                            domain=domain, path=path, secure=secure, samesite=samesite)
+
+class _CompactJSON:
+    # the payload encoding for cookie sessions: compact JSON via the fastest available backend
+    @staticmethod
+    def dumps(obj):
+        return serialize.dumps(obj, None)
+
+    @staticmethod
+    def loads(data):
+        return serialize.loads(data)
+
+class _CookieSerializer(URLSafeTimedSerializer):
+    # a URLSafeTimedSerializer whose zlib compression can be turned off
+
+    def __init__(self, *args, compress: bool=True, **kwargs):
+        super(_CookieSerializer, self).__init__(*args, **kwargs)
+        self.compress = compress
+
+    def dump_payload(self, obj) -> bytes:
+        if self.compress:
+            return super(_CookieSerializer, self).dump_payload(obj)
+        return base64_encode(super(URLSafeSerializerMixin, self).dump_payload(obj))
+
+class CompactCookieSessionInterface(_SlidingExpiration, SecureCookieSessionInterface):
+    """
+    a Flask session interface that keeps the session data in a signed cookie, like Flask's
+    default interface, but with less overhead per request:  the signing serializer is built
+    once per application (and rebuilt only if its secret keys change), and the session is
+    encoded as compact JSON, optionally compressed.  Unlike Flask's encoding, values are 
+    restricted to JSON types (tuples are restored as lists).  A session cookie written by
+    Flask's default interface is still accepted; it is rewritten in the compact format with
+    the response.
+    """
+    salt = "nistoar-auth-cookie-session"
+    serializer = _CompactJSON
+    _standard = SecureCookieSessionInterface()
+
+    def __init__(self, compress: bool=True, refresh_fraction: float=None):
+        """
+        create the interface
+        :param bool compress:  if True, the session data is zlib-compressed whenever that 
+                               makes the cookie smaller
+        :param float refresh_fraction:  if set, sessions are given a sliding expiration and 
+                             are rewritten once this fraction of their lifetime has passed
+                             (see the :py:mod:`module documentation 
+                             <nistoar.auth.wsgi.sessions>`)
+        :raises ValueError:  if ``refresh_fraction`` is not between 0 and 1
+        """
+        self._init_sliding(refresh_fraction)
+        self.compress = compress
+        self._serializer = None
+        self._signkeys = None
+
+    def get_signing_serializer(self, app):
+        if not app.secret_key:
+            return None
+        keys = list(app.config.get("SECRET_KEY_FALLBACKS") or []) + [app.secret_key]
+        if keys != self._signkeys:
+            self._serializer = _CookieSerializer(keys, salt=self.salt, serializer=self.serializer,
+                                                 signer_kwargs={
+                                                     "key_derivation": self.key_derivation,
+                                                     "digest_method": self.digest_method
+                                                 },
+                                                 compress=self.compress)
+            self._signkeys = keys
+        return self._serializer
+
+    def open_session(self, app, request):
+        s = self.get_signing_serializer(app)
+        if s is None:
+            return None
+        val = request.cookies.get(self.get_cookie_name(app))
+        if not val:
+            return self.session_class()
+        max_age = int(app.permanent_session_lifetime.total_seconds())
+        try:
+            return self.session_class(s.loads(val, max_age=max_age))
+        except BadSignature:
+            pass
+
+        # fall back to the format of Flask's default interface (e.g. a cookie issued before
+        # this interface was enabled); the session is then re-issued in the compact format
+        try:
+            data = self._standard.get_signing_serializer(app).loads(val, max_age=max_age)
+        except BadSignature:
+            return self.session_class()
+        out = self.session_class(data)
+        out.modified = True
+        return out
+
+    def save_session(self, app, session, response):
+        self._slide(app, session)
+        super(CompactCookieSessionInterface, self).save_session(app, session, response)
+
+def create_session_store(config: Mapping, data_dir: Union[str, Path]=None) -> SessionStore:
+    """
+    create the session store described by the ``session_store`` configuration parameter
+    :param dict  config:  the store configuration, which must include a ``type`` (one of
+                          ``memory`` or ``sqlite``); the ``memory`` store accepts a 
+                          ``max_sessions`` bound (default: 100000), and the ``sqlite`` store
+                          requires a ``path`` to the database file.
+    :param str data_dir:  the directory relative paths are taken relative to
+    :raises ConfigurationException:  if the configuration is incomplete or invalid
+    """
+    if not isinstance(config, Mapping):
+        raise ConfigurationException("session_store: not an object")
+    stype = config.get('type', 'memory')
+    if stype == 'memory':
+        try:
+            return MemorySessionStore(config.get('max_sessions', 100000))
+        except ValueError as ex:
+            raise ConfigurationException("session_store: "+str(ex)) from ex
+    if stype == 'sqlite':
+        if not config.get('path'):
+            raise ConfigurationException("session_store: missing required property: path")
+        path = Path(config['path'])
+        if data_dir and not path.is_absolute():
+            path = Path(data_dir) / path
+        try:
+            return SQLiteSessionStore(path, config.get('timeout', 5.0))
+        except sqlite3.Error as ex:
+            raise ConfigurationException("session_store: unable to open database, %s: %s" %
+                                         (str(path), str(ex))) from ex
+    raise ConfigurationException("session_store: unsupported type: "+str(stype))
@@ -16,7 +16,7 @@ CLASSIFIERS = [
 ]
 
 SCRIPTS = [
-    'authservice-uwsgi.py'
+    'authservice-uwsgi.py', 'mint-tokens.py'
 ]
 
 TESTSCRIPTS = [
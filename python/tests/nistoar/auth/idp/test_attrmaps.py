@@ -0,0 +1,135 @@
+import unittest as test
+import os, json, tempfile, shutil
+from pathlib import Path
+
+from nistoar.auth.idp import attrmaps, mapper
+
+testdir = Path(__file__).parents[0]
+basedir = testdir.parents[4]
+mapdir  = basedir / "idp" / "attributemaps"
+
+URI_FMT = "urn:oasis:names:tc:SAML:2.0:attrname-format:uri"
+ADFS_FMT = "urn:oasis:names:tc:SAML:2.0:attrname-format:unspecified"
+GIVEN = "http://schemas.xmlsoap.org/ws/2005/05/identity/claims/givenname"
+
+class TestAttributeIndex(test.TestCase):
+
+    def setUp(self):
+        self.index = attrmaps.AttributeIndex([
+            { "identifier": "fmt:a",
+              "fro": { "urn:a:gn": "givenName", "urn:a:sn": "sn" },
+              "to":  { "givenName": "urn:a:gn", "sn": "urn:a:sn", "mail": "urn:a:mail" } },
+            { "identifier": "fmt:b",
+              "fro": { "urn:b:gn": "givenName", "urn:b:ou": "ou" },
+              "to":  { "givenName": "urn:b:gn", "ou": "urn:b:ou" } }
+        ])
+
+    def test_lookups(self):
+        self.assertEqual(self.index.formats, ["fmt:a", "fmt:b"])
+        self.assertEqual(self.index.friendly_name("urn:a:gn"), "givenName")
+        self.assertEqual(self.index.friendly_name("urn:b:gn"), "givenName")
+        self.assertEqual(self.index.friendly_name("urn:a:mail"), "mail")
+        self.assertEqual(self.index.friendly_name("givenName"), "givenName")
+        self.assertEqual(self.index.friendly_name("urn:goob"), "urn:goob")
+
+        self.assertEqual(self.index.uri("givenName"), "urn:a:gn")
+        self.assertEqual(self.index.uri("givenName", "fmt:b"), "urn:b:gn")
+        self.assertEqual(self.index.uri("ou"), "urn:b:ou")
+        self.assertIsNone(self.index.uri("ou", "fmt:a"))
+        self.assertIsNone(self.index.uri("goob"))
+        self.assertEqual(self.index.name_format("urn:b:ou"), "fmt:b")
+
+        self.assertIn("urn:b:ou", self.index)
+        self.assertIn("ou", self.index)
+        self.assertNotIn("goob", self.index)
+        self.assertEqual(self.index.translate({"urn:a:gn": ["Gurn"], "urn:x": ["y"]}),
+                         {"givenName": ["Gurn"], "urn:x": ["y"]})
+
+    def test_data(self):
+        data = json.loads(json.dumps(self.index.to_data()))
+        index = attrmaps.AttributeIndex.from_data(data)
+        self.assertEqual(index.formats, self.index.formats)
+        self.assertEqual(index.uri("givenName", "fmt:b"), "urn:b:gn")
+        self.assertEqual(index.friendly_name("urn:b:ou"), "ou")
+        with self.assertRaises(ValueError):
+            attrmaps.AttributeIndex.from_data({"version": 0})
+
+    def test_mapper(self):
+        spec = { "id": "mail", "attributes": { "userName": "givenName",
+                                               "userOU": { "from": "ou", "default": "x" } },
+                 "consume": [ "sn" ] }
+        mpr = mapper.AttributeMapper(spec, self.index)
+        self.assertEqual(mpr.id_spec, ("urn:a:mail", None))
+        self.assertEqual(mpr.attr_spec['userName'], ("urn:a:gn", None))
+        self.assertEqual(mpr.attr_spec['userOU'], ("urn:b:ou", "x"))
+        self.assertIn("urn:a:sn", mpr.consumed)
+
+        spec['name_format'] = "fmt:b"
+        mpr = mapper.AttributeMapper.from_config(spec, self.index)
+        self.assertEqual(mpr.attr_spec['userName'], ("urn:b:gn", None))
+        self.assertEqual(mpr.id_spec, ("mail", None))
+
+@test.skipIf(not mapdir.is_dir(), "attribute maps not available")
+class TestLoadAttributeMaps(test.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="_test_attrmaps.")
+        self.cache = Path(self.tmpdir) / "index.json"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_load(self):
+        index = attrmaps.load_attribute_maps(mapdir)
+        self.assertIn(URI_FMT, index.formats)
+        self.assertIn(ADFS_FMT, index.formats)
+        self.assertEqual(index.friendly_name(GIVEN), "givenName")
+        self.assertEqual(index.friendly_name("urn:oid:2.5.4.42"), "givenName")
+        self.assertEqual(index.uri("givenName", URI_FMT), "urn:oid:2.5.4.42")
+        self.assertEqual(index.uri("givenName", ADFS_FMT), GIVEN)
+
+        index = attrmaps.load_attribute_maps(mapdir, prefer=["adfs_v20"])
+        self.assertEqual(index.formats[0], ADFS_FMT)
+        self.assertEqual(index.uri("givenName"), GIVEN)
+
+    def test_cache(self):
+        index = attrmaps.load_attribute_maps(mapdir, self.cache)
+        self.assertTrue(self.cache.is_file())
+        with open(self.cache) as fd:
+            data = json.load(fd)
+        self.assertEqual(data['version'], attrmaps.CACHE_VERSION)
+        self.assertEqual(len(data['signature']), 5)
+
+        # the cached index is used when it is current...
+        data['fro'][GIVEN] = "goob"
+        with open(self.cache, 'w') as fd:
+            json.dump(data, fd)
+        cached = attrmaps.load_attribute_maps(mapdir, self.cache)
+        self.assertEqual(cached.friendly_name(GIVEN), "goob")
+        self.assertEqual(cached.uri("givenName", URI_FMT), index.uri("givenName", URI_FMT))
+
+        # ...and rebuilt when the maps change
+        maps = Path(self.tmpdir) / "maps"
+        shutil.copytree(mapdir, maps)
+        with open(maps / "basic.py", 'a') as fd:
+            fd.write("# updated\n")
+        cached = attrmaps.load_attribute_maps(maps, self.cache)
+        self.assertEqual(cached.friendly_name(GIVEN), "givenName")
+
+        # ...or when the cache is corrupted
+        with open(self.cache, 'w') as fd:
+            fd.write("{goob")
+        cached = attrmaps.load_attribute_maps(maps, self.cache)
+        self.assertEqual(cached.friendly_name(GIVEN), "givenName")
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ["index.json", "maps"])
+
+    def test_bad_map(self):
+        maps = Path(self.tmpdir) / "maps"
+        maps.mkdir()
+        with open(maps / "goob.py", 'w') as fd:
+            fd.write("GOOB = {}\n")
+        with self.assertRaises(ValueError):
+            attrmaps.load_attribute_maps(maps)
+                         
+if __name__ == '__main__':
+    test.main()
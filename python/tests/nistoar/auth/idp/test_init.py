@@ -0,0 +1,48 @@
+import unittest as test
+import sys, subprocess
+
+from nistoar.auth import idp
+from nistoar.auth.idp import mapper
+
+class TestProfiles(test.TestCase):
+
+    def tearDown(self):
+        idp.PROFILES.pop("goob", None)
+
+    def test_get_mapper(self):
+        from nistoar.auth.idp import nist_okta, nist_ms
+        self.assertIs(idp.get_mapper(), nist_okta.mapper)
+        self.assertIs(idp.get_mapper("nist_okta"), nist_okta.mapper)
+        self.assertIs(idp.get_mapper("nist_ms"), nist_ms.mapper)
+        self.assertIs(idp.get_mapper("nistoar.auth.idp.nist_ms"), nist_ms.mapper)
+        self.assertIsInstance(idp.get_mapper("nist_ms"), mapper.AttributeMapper)
+
+        with self.assertRaises(ValueError):
+            idp.get_mapper("goob")
+        with self.assertRaises(ValueError):
+            idp.get_mapper("nistoar.auth.idp.goob")
+        with self.assertRaises(ValueError):
+            idp.get_mapper("nistoar.auth.idp.lazy")
+
+    def test_register_profile(self):
+        from nistoar.auth.idp import nist_ms
+        idp.register_profile("goob", "nistoar.auth.idp.nist_ms")
+        self.assertIs(idp.get_mapper("goob"), nist_ms.mapper)
+
+    def test_make_credentials(self):
+        from nistoar.auth.idp import nist_okta
+        self.assertIs(idp.make_credentials, nist_okta.make_credentials)
+        self.assertIs(idp.make_lazy_credentials, nist_okta.make_lazy_credentials)
+        with self.assertRaises(AttributeError):
+            idp.goob
+
+    def test_lazy_import(self):
+        # selecting a profile does not import the others
+        script = "import sys; from nistoar.auth import idp; idp.get_mapper('nist_ms'); " \
+                 "print('nistoar.auth.idp.nist_okta' in sys.modules)"
+        out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                             check=True)
+        self.assertEqual(out.stdout.strip(), "False")
+                         
+if __name__ == '__main__':
+    test.main()
@@ -0,0 +1,77 @@
+import unittest as test
+import sys
+
+from nistoar.auth.idp import intern
+
+class TestIntern(test.TestCase):
+
+    def test_intern_value(self):
+        a = "".join(["group", "-1"])
+        b = "".join(["group", "-1"])
+        self.assertIsNot(a, b)
+        self.assertIs(intern.intern_value(a), intern.intern_value(b))
+        self.assertEqual(intern.intern_value(3), 3)
+
+    def test_intern_tuple(self):
+        a = ["".join(["group", str(i)]) for i in range(5)]
+        b = ["".join(["group", str(i)]) for i in range(5)]
+        ta = intern.intern_tuple(a)
+        self.assertIsInstance(ta, tuple)
+        self.assertEqual(ta, tuple(a))
+        self.assertIs(intern.intern_tuple(b), ta)
+        self.assertIs(intern.intern_tuple(tuple(b)), ta)
+        self.assertIs(ta[2], intern.intern_tuple(b)[2])
+        self.assertIsNot(intern.intern_tuple(b[1:]), ta)
+        self.assertEqual(intern.intern_tuple([]), ())
+
+    def test_max_size(self):
+        tbl = intern.InternTable(3, 2)
+        first = tbl.intern_tuple(["a"])
+        for i in range(5):
+            tbl.intern_tuple([str(i)])
+        self.assertLessEqual(len(tbl._tuples), 2)
+        self.assertLessEqual(len(tbl._strings), 3)
+        self.assertEqual(tbl.intern_tuple(["a"]), first)
+
+    def test_stats(self):
+        tbl = intern.InternTable()
+        a = "".join(["http://schemas.xmlsoap.org/", "claim/Group"])
+        b = "".join(["http://schemas.xmlsoap.org/", "claim/Group"])
+        self.assertIs(tbl.intern_value(a), a)
+        self.assertIs(tbl.intern_value(b), a)
+        self.assertIs(tbl.intern_value(a), a)
+        stats = tbl.stats()
+        self.assertEqual(stats['strings'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['bytes_saved'], sys.getsizeof(b))
+
+        # replacing a short-lived copy need not count as a saving
+        c = "".join(["http://schemas.xmlsoap.org/", "claim/Group"])
+        self.assertIs(tbl.intern_value(c, False), a)
+        self.assertIs(tbl.intern_tuple([c], False)[0], a)
+        self.assertEqual(tbl.stats()['hits'], 1)
+        self.assertEqual(tbl.stats()['bytes_saved'], sys.getsizeof(b))
+
+        tbl.clear()
+        self.assertEqual(tbl.stats()['strings'], 0)
+        self.assertEqual(tbl.stats()['hits'], 1)
+
+    def test_intern_attributes(self):
+        tbl = intern.InternTable()
+        def attrs():
+            return { "".join(["urn:", "ou"]): ["".join(["OD", "I"])],
+                     "".join(["urn:", "group"]): ["".join(["a", "ll"]), "".join(["od", "i"])] }
+        a = tbl.intern_attributes(attrs())
+        b = tbl.intern_attributes(attrs())
+        self.assertEqual(a, attrs())
+        self.assertIsInstance(b['urn:group'], list)
+        for (ka, va), (kb, vb) in zip(a.items(), b.items()):
+            self.assertIs(ka, kb)
+            for x, y in zip(va, vb):
+                self.assertIs(x, y)
+        self.assertEqual(tbl.stats()['hits'], 5)
+        self.assertGreater(tbl.stats()['bytes_saved'], 0)
+
+if __name__ == '__main__':
+    test.main()
@@ -0,0 +1,96 @@
+import unittest as test
+import time, json
+
+from nistoar.auth.idp import lazy
+from nistoar.auth.idp import nist_okta as idp
+from nistoar.auth.creds import JWTGenerator
+
+class TestLazyCredentials(test.TestCase):
+
+    def setUp(self):
+        self.samlatts = {
+            idp.ATTR_NAME.WINID:  ["jerk"],
+            idp.ATTR_NAME.EMAIL:  ["jerk@nist.gov"],
+            idp.ATTR_NAME.GIVEN:  ["Gurn"],
+            idp.ATTR_NAME.FAMILY: ["Cranston"],
+            "urn:oid:2.5.4.11":   ["Office of Data"]
+        }
+        self.creds = lazy.LazyCredentials(self.samlatts, idp.mapper.id_spec,
+                                          idp.mapper.attr_spec, idp.mapper.consumed, time.time() + 60)
+
+    def test_epoch_expiration(self):
+        self.assertIsNone(lazy.epoch_expiration(None))
+        self.assertEqual(lazy.epoch_expiration(12.5), 12.5)
+        self.assertEqual(lazy.epoch_expiration("1970-01-02T00:00:00+00:00"), 86400.0)
+        with self.assertRaises(ValueError):
+            lazy.epoch_expiration("goober")
+
+    def test_lazy_access(self):
+        self.assertTrue(self.creds.is_authenticated())
+        self.assertFalse(self.creds.expired())
+        self.assertEqual(self.creds.id, "jerk")
+        self.assertEqual(list(self.creds._data.keys()), ["userId"])
+        self.assertFalse(self.creds.materialized)
+
+        self.assertIn("userName", self.creds)
+        self.assertIn("urn:oid:2.5.4.11", self.creds)
+        self.assertNotIn(idp.ATTR_NAME.GIVEN, self.creds)
+        self.assertNotIn("userOU", self.creds)
+        self.assertEqual(len(self.creds), 8)
+        self.assertEqual(list(self.creds._data.keys()), ["userId"])
+
+        self.assertEqual(self.creds.given_name, "Gurn")
+        self.assertEqual(self.creds["urn:oid:2.5.4.11"], "Office of Data")
+        self.assertIsNone(self.creds.get("userOU"))
+        with self.assertRaises(KeyError):
+            self.creds["userOU"]
+        self.assertFalse(self.creds.materialized)
+
+    def test_defaults(self):
+        del self.samlatts[idp.ATTR_NAME.WINID]
+        del self.samlatts[idp.ATTR_NAME.GIVEN]
+        self.assertEqual(self.creds.id, "unknown")
+        self.assertEqual(self.creds.given_name, "unknown")
+        self.assertEqual(self.creds['winId'], "unknown")
+
+    def test_update(self):
+        self.assertEqual(self.creds.email, "jerk@nist.gov")
+        self.creds.email = "gurn@nist.gov"
+        self.assertTrue(self.creds.materialized)
+        self.assertEqual(self.creds.email, "gurn@nist.gov")
+        self.assertEqual(self.creds.family_name, "Cranston")
+
+        self.creds['userOU'] = "ODI"
+        self.assertEqual(self.creds['userOU'], "ODI")
+        del self.creds['userOU']
+        self.assertNotIn('userOU', self.creds)
+
+        del self.creds['userEmail']
+        self.assertEqual(self.creds.email, "not@set")
+        with self.assertRaises(KeyError):
+            del self.creds['userId']
+
+    def test_to_json(self):
+        full = idp.make_credentials(self.samlatts, self.creds.expiration_time)
+        self.assertEqual(self.creds.to_json(), full.to_json())
+        self.assertEqual(self.creds.to_json(None), full.to_json(None))
+        self.assertEqual(list(self.creds.keys()), list(full.keys()))
+
+        data = json.loads(self.creds.to_json())
+        self.assertEqual(data['userDetails']['userId'], "jerk")
+        self.assertEqual(data['userDetails']['urn:oid:2.5.4.11'], "Office of Data")
+
+    def test_create_token(self):
+        gen = JWTGenerator({"secret": "hush!"})
+        creds = idp.mapper.make_lazy_credentials(self.samlatts, tokengen=gen)
+        claims = gen.decode(creds.create_token())
+        self.assertEqual(claims['sub'], "jerk")
+        self.assertEqual(claims['userName'], "Gurn")
+        self.assertEqual(claims['urn:oid:2.5.4.11'], "Office of Data")
+        self.assertNotIn(idp.ATTR_NAME.GIVEN, claims)
+
+        snap = creds.snapshot()
+        self.assertEqual(snap.to_json(), creds.to_json())
+                         
+if __name__ == '__main__':
+    test.main()
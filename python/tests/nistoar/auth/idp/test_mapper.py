@@ -0,0 +1,151 @@
+import json
+import unittest as test
+
+from nistoar.base.config import ConfigurationException
+from nistoar.auth.idp import mapper, nist_okta, nist_ms
+
+class TestAttributeMapper(test.TestCase):
+
+    def setUp(self):
+        self.spec = {
+            "id": "urn:uid",
+            "attributes": {
+                "userName":     { "from": "urn:givenName", "default": "unknown" },
+                "userLastName": { "from": "urn:sn" },
+                "userEmail":    "urn:mail"
+            },
+            "consume": [ "urn:secret" ]
+        }
+        self.samlatts = {
+            "urn:uid":       ["gurn"],
+            "urn:givenName": ["Gurn"],
+            "urn:sn":        ["Cranston"],
+            "urn:mail":      ["gurn@nist.gov"],
+            "urn:secret":    ["shh"],
+            "urn:ou":        ["ODI", "MML"]
+        }
+        self.mapper = mapper.AttributeMapper.from_config(self.spec)
+
+    def test_compile(self):
+        self.assertEqual(self.mapper.id_spec, ("urn:uid", None))
+        self.assertEqual(list(self.mapper.attr_spec.keys()),
+                         ["userName", "userLastName", "userEmail"])
+        self.assertEqual(self.mapper.attr_spec['userName'], ("urn:givenName", "unknown"))
+        self.assertEqual(self.mapper.consumed,
+                         {"urn:uid", "urn:givenName", "urn:sn", "urn:mail", "urn:secret",
+                          "userId"})
+
+    def test_bad_spec(self):
+        for spec in ([], {"attributes": {}}, {"id": "urn:uid"},
+                     {"id": {"default": "x"}, "attributes": {}},
+                     {"id": "urn:uid", "attributes": {"userName": 3}},
+                     {"id": "urn:uid", "attributes": {}, "consume": "urn:secret"}):
+            with self.assertRaises(ConfigurationException):
+                mapper.AttributeMapper(spec)
+
+    def test_map(self):
+        attrs = self.mapper.map(self.samlatts)
+        self.assertEqual(attrs, {"userName": "Gurn", "userLastName": "Cranston",
+                                 "userEmail": "gurn@nist.gov", "urn:ou": "ODI"})
+
+        del self.samlatts["urn:givenName"]
+        del self.samlatts["urn:sn"]
+        attrs = self.mapper.map(self.samlatts)
+        self.assertEqual(attrs['userName'], "unknown")
+        self.assertIsNone(attrs['userLastName'])
+
+    def test_multi(self):
+        self.spec['attributes']['userOUs'] = { "from": "urn:ou", "multi": True }
+        self.spec['attributes']['roles'] = { "from": "urn:role", "multi": True,
+                                             "default": "guest" }
+        mpr = mapper.AttributeMapper(self.spec)
+        self.assertEqual(mpr.multi, {"userOUs", "roles"})
+
+        attrs = mpr.map(self.samlatts)
+        self.assertEqual(attrs['userOUs'], ("ODI", "MML"))
+        self.assertEqual(attrs['roles'], ("guest",))
+        self.assertNotIn('urn:ou', attrs)
+        self.assertEqual(list(attrs.keys()),
+                         "userName userLastName userEmail userOUs roles".split())
+
+        # equal lists of values are shared
+        other = dict(self.samlatts)
+        other['urn:ou'] = ["".join(["OD", "I"]), "MML"]
+        self.assertIs(mpr.map(other)['userOUs'], attrs['userOUs'])
+
+        creds = mpr.make_lazy_credentials(other)
+        self.assertIs(creds['userOUs'], attrs['userOUs'])
+        self.assertEqual(creds['roles'], ("guest",))
+        self.assertEqual(creds.to_json(), mpr.make_credentials(other).to_json())
+
+    def test_max_values(self):
+        self.spec['attributes']['userOUs'] = { "from": "urn:ou", "multi": True, "max_values": 1 }
+        mpr = mapper.AttributeMapper(self.spec)
+        self.assertEqual(mpr.max_values, {"userOUs": 1})
+        with self.assertLogs("nistoar.auth.idp.lazy", "WARNING"):
+            self.assertEqual(mpr.map(self.samlatts)['userOUs'], ("ODI",))
+        with self.assertLogs("nistoar.auth.idp.lazy", "WARNING"):
+            self.assertEqual(mpr.make_lazy_credentials(self.samlatts)['userOUs'], ("ODI",))
+
+        self.spec['attributes']['userOUs']['max_values'] = 0
+        with self.assertRaises(ConfigurationException):
+            mapper.AttributeMapper(self.spec)
+
+    def test_multi_passthrough(self):
+        del self.spec['consume']
+        attrs = mapper.AttributeMapper(self.spec).map(self.samlatts)
+        self.assertEqual(attrs['urn:ou'], "ODI")
+
+        self.spec['multi_passthrough'] = True
+        mpr = mapper.AttributeMapper(self.spec)
+        attrs = mpr.map(self.samlatts)
+        self.assertEqual(attrs['urn:ou'], ("ODI", "MML"))
+        # the type does not depend on the number of values
+        self.assertEqual(attrs['urn:secret'], ("shh",))
+        creds = mpr.make_lazy_credentials(self.samlatts)
+        self.assertEqual(creds['urn:secret'], ("shh",))
+        self.assertEqual(json.loads(creds.to_json())['userDetails']['urn:secret'], ["shh"])
+        self.assertEqual(creds.to_json(), mpr.make_credentials(self.samlatts).to_json())
+
+        self.spec['multi_passthrough'] = "yes"
+        with self.assertRaises(ConfigurationException):
+            mapper.AttributeMapper(self.spec)
+
+    def test_make_credentials(self):
+        creds = self.mapper.make_credentials(self.samlatts, 1.7e9)
+        self.assertEqual(creds.id, "gurn")
+        self.assertEqual(creds.given_name, "Gurn")
+        self.assertEqual(creds['urn:ou'], "ODI")
+        self.assertNotIn("urn:secret", creds)
+        self.assertEqual(creds.expiration_time, 1.7e9)
+
+        lazy = self.mapper.make_lazy_credentials(self.samlatts, 1.7e9)
+        self.assertEqual(lazy.to_json(), creds.to_json())
+
+        self.assertEqual(self.mapper.make_credentials({}).id, None)
+
+    def test_idp_specs(self):
+        # the specs reproduce the original hand-written conversions
+        for idp in (nist_okta, nist_ms):
+            samlatts = dict((name, ["value of "+field]) for field, name in
+                            idp.ATTR_NAME._asdict().items())
+            samlatts["urn:oid:2.5.4.11"] = ["ODI"]
+            creds = idp.make_credentials(samlatts)
+            self.assertEqual(creds.id, "value of WINID")
+            self.assertEqual(creds['winId'], "value of WINID")
+            self.assertEqual(creds['userEmail'], "value of EMAIL")
+            self.assertEqual(creds['urn:oid:2.5.4.11'], "ODI")
+            self.assertNotIn(idp.ATTR_NAME.ID, creds)
+            self.assertNotIn(idp.ATTR_NAME.GIVEN, creds)
+
+        creds = nist_okta.make_credentials(samlatts)
+        self.assertIn(nist_okta.ATTR_NAME.OU, creds)
+        self.assertNotIn('userOU', creds)
+        creds = nist_ms.make_credentials(samlatts)
+        self.assertNotIn(nist_ms.ATTR_NAME.OU, creds)
+        self.assertNotIn(nist_ms.ATTR_NAME.DIVNO, creds)
+        self.assertEqual(creds['userOU'], "value of OU")
+        self.assertEqual(creds['userGroup'], "value of GROUP")
+                         
+if __name__ == '__main__':
+    test.main()
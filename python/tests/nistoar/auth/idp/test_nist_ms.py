@@ -24,6 +24,24 @@ class Test_NIST_IDP(test.TestCase):
         self.assertEqual(creds.family_name, "Cranston")
         self.assertEqual(creds['userOU'], "MTV")
 
+    def test_multivalued(self):
+        self.samlatts[idp.ATTR_NAME.GROUP] = ["odi", "odi-staff", "all"]
+        creds = idp.make_credentials(self.samlatts)
+        self.assertEqual(creds['userGroup'], "odi")
+        self.assertEqual(creds['userGroups'], ("odi", "odi-staff", "all"))
+        self.assertEqual(creds['roles'], ())
+        self.assertIs(idp.make_credentials(dict(self.samlatts))['userGroups'],
+                      creds['userGroups'])
+
+    def test_make_lazy_credentials(self):
+        self.samlatts["urn:oid:2.5.4.11"] = ["ODI"]
+        creds = idp.make_lazy_credentials(self.samlatts, "2030-01-01T00:00:00")
+        self.assertEqual(creds.id, "jerk")
+        self.assertEqual(creds['userOU'], "MTV")
+        self.assertEqual(creds['role'], "not-set")
+        self.assertEqual(creds.to_json(),
+                         idp.make_credentials(self.samlatts, "2030-01-01T00:00:00").to_json())
+
 
         
         
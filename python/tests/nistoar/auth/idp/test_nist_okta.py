@@ -23,6 +23,38 @@ class Test_NIST_IDP(test.TestCase):
         self.assertEqual(creds.family_name, "Cranston")
 
         self.assertNotIn('userOU', creds)
+        self.assertEqual(creds['userGroups'], ())
+        self.assertEqual(creds['roles'], ())
+
+    def test_multi_valued(self):
+        self.samlatts[idp.ATTR_NAME.GROUP] = ["g1", "g2"]
+        self.samlatts[idp.ATTR_NAME.ROLE] = ["admin"]
+        self.samlatts["urn:oid:2.5.4.11"] = ["ODI", "MML"]
+        creds = idp.make_credentials(self.samlatts)
+        self.assertEqual(creds['userGroups'], ("g1", "g2"))
+        self.assertEqual(creds['roles'], ("admin",))
+        self.assertNotIn(idp.ATTR_NAME.GROUP, creds)
+        self.assertNotIn(idp.ATTR_NAME.ROLE, creds)
+
+        # passed-through attributes keep their single (first) value
+        self.assertEqual(creds['urn:oid:2.5.4.11'], "ODI")
+
+        lazy = idp.make_lazy_credentials(self.samlatts)
+        self.assertEqual(lazy['userGroups'], ("g1", "g2"))
+        self.assertEqual(lazy.to_json(), creds.to_json())
+
+        self.samlatts[idp.ATTR_NAME.GROUP] = ["g%d" % i for i in range(500)]
+        with self.assertLogs("nistoar.auth.idp.lazy", "WARNING"):
+            creds = idp.make_credentials(self.samlatts)
+        self.assertEqual(len(creds['userGroups']), 100)
+
+    def test_make_lazy_credentials(self):
+        self.samlatts["urn:oid:2.5.4.11"] = ["ODI"]
+        creds = idp.make_lazy_credentials(self.samlatts, "2030-01-01T00:00:00")
+        self.assertEqual(creds.id, "jerk")
+        self.assertFalse(creds.expired())
+        self.assertEqual(creds.to_json(),
+                         idp.make_credentials(self.samlatts, "2030-01-01T00:00:00").to_json())
 
 
 
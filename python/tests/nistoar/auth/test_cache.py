@@ -0,0 +1,111 @@
+import os, pdb, time
+import unittest as test
+
+from nistoar.auth import cache
+
+class TestTTLCache(test.TestCase):
+
+    def setUp(self):
+        self.cache = cache.TTLCache(3)
+
+    def test_ctor(self):
+        self.assertEqual(self.cache.maxsize, 3)
+        self.assertIsNone(self.cache.ttl)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.hits, 0)
+        self.assertEqual(self.cache.misses, 0)
+
+        with self.assertRaises(ValueError):
+            cache.TTLCache(0)
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("a", "hey"), "hey")
+        self.assertEqual(self.cache.misses, 2)
+
+        self.cache.put("a", 1)
+        self.cache.put("b", 2)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIn("a", self.cache)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("b"), 2)
+        self.assertEqual(self.cache.hits, 2)
+        self.assertEqual(self.cache.misses, 2)
+        self.assertEqual(self.cache.hit_rate, 0.5)
+
+        self.cache.discard("a")
+        self.assertNotIn("a", self.cache)
+        self.cache.discard("a")
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru(self):
+        self.cache.put("a", 1)
+        self.cache.put("b", 2)
+        self.cache.put("c", 3)
+        self.cache.get("a")
+        self.cache.put("d", 4)
+        self.assertEqual(len(self.cache), 3)
+        self.assertIn("a", self.cache)
+        self.assertNotIn("b", self.cache)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_expiration(self):
+        self.cache.put("a", 1, time.time() - 1)
+        self.cache.put("b", 2, time.time() + 60)
+        self.assertNotIn("a", self.cache)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.get("b"), 2)
+
+        self.cache = cache.TTLCache(3, -1)
+        self.cache.put("a", 1)
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_pop(self):
+        self.cache.put("a", 1)
+        self.cache.put("b", 2, time.time() - 1)
+        self.assertEqual(self.cache.pop("a"), 1)
+        self.assertIsNone(self.cache.pop("a"))
+        self.assertEqual(self.cache.pop("b", "gone"), "gone")
+        self.assertEqual(len(self.cache), 0)
+
+    def test_purge(self):
+        self.cache = cache.TTLCache(10)
+        now = time.time()
+        self.cache.put("a", 1, now - 3)
+        self.cache.put("b", 2, now - 2)
+        self.cache.put("c", 3, now - 1)
+        self.cache.put("d", 4)
+        self.cache.put("e", 5, now + 60)
+        self.cache.put("b", 2, now + 60)
+        self.assertEqual(self.cache.purge(1), 1)
+        self.assertNotIn("a", self.cache._data)
+        self.assertEqual(self.cache.purge(), 1)
+        self.assertEqual(self.cache.purge(), 0)
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.get("b"), 2)
+        self.assertEqual(self.cache.get("d"), 4)
+
+        # the expiry index does not outgrow the cache
+        for i in range(1000):
+            self.cache.put("k%d" % (i % 20), i, now + 60)
+        self.assertLessEqual(len(self.cache._expiries), 2 * len(self.cache) + 64)
+        self.cache.clear()
+        self.assertEqual(self.cache.purge(), 0)
+
+    def test_stats(self):
+        self.cache.put("a", 1)
+        self.cache.get("a")
+        self.cache.get("b")
+        stats = self.cache.stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['maxsize'], 3)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+
+if __name__ == '__main__':
+    test.main()
+
@@ -0,0 +1,165 @@
+import os, pdb
+import unittest as test
+from collections import OrderedDict
+
+from nistoar.auth import claims
+from nistoar.base.config import ConfigurationException
+
+ATTS = OrderedDict([
+    ("userId", "gcranston"),
+    ("userName", "Gurn"),
+    ("userLastName", "Cranston"),
+    ("userEmail", "gurn.cranston@nist.gov"),
+    ("http://schemas.xmlsoap.org/ws/2005/05/identity/claims/nistOU", "Funny Walks")
+])
+
+class TestClaimProfile(test.TestCase):
+
+    def test_apply(self):
+        prof = claims.ClaimProfile("short", ["userName", "userEmail", "goob"],
+                                   {"userEmail": "email"}, "rmm")
+        self.assertEqual(prof.apply(ATTS),
+                         {"userName": "Gurn", "email": "gurn.cranston@nist.gov", "aud": "rmm"})
+
+        prof = claims.ClaimProfile("all", rename={"userName": "given"})
+        out = prof.apply(ATTS)
+        self.assertEqual(len(out), len(ATTS))
+        self.assertEqual(out['given'], "Gurn")
+        self.assertNotIn("userName", out)
+        self.assertNotIn("aud", out)
+
+    def test_from_config(self):
+        prof = claims.ClaimProfile.from_config("pdr", {
+            "include": ["userName"], "audience": "pdr", "endpoints": ["https://pdr.nist.gov/"]
+        })
+        self.assertEqual(prof.name, "pdr")
+        self.assertEqual(prof.include, ("userName",))
+        self.assertEqual(prof.rename, {})
+        self.assertEqual(prof.audience, "pdr")
+        self.assertEqual(prof.endpoints, ("https://pdr.nist.gov/",))
+
+        with self.assertRaises(ConfigurationException):
+            claims.ClaimProfile.from_config("pdr", ["userName"])
+        with self.assertRaises(ConfigurationException):
+            claims.ClaimProfile.from_config("pdr", {"include": "userName"})
+        with self.assertRaises(ConfigurationException):
+            claims.ClaimProfile.from_config("pdr", {"rename": ["userName"]})
+        with self.assertRaises(ConfigurationException):
+            claims.ClaimProfile.from_config("pdr", {"audience": 3})
+
+class TestClaimProfiles(test.TestCase):
+
+    def setUp(self):
+        self.profs = claims.ClaimProfiles.from_config({
+            "claim_profiles": {
+                "default": { "include": ["userName", "userEmail"] },
+                "midas":   { "audience": "urn:midas", "endpoints": ["https://oar.nist.gov/"] },
+                "dap":     { "endpoints": ["https://oar.nist.gov/dap/"] }
+            }
+        })
+
+    def test_ctor(self):
+        self.assertEqual(len(self.profs), 3)
+        self.assertEqual(list(self.profs), ["default", "midas", "dap"])
+        self.assertIs(self.profs.default, self.profs['default'])
+
+        profs = claims.ClaimProfiles.from_config({
+            "claim_profiles": {"a": {}, "b": {}},
+            "default_claim_profile": "b"
+        })
+        self.assertEqual(profs.default.name, "b")
+        self.assertIsNone(claims.ClaimProfiles.from_config({}).default)
+
+        with self.assertRaises(ConfigurationException):
+            claims.ClaimProfiles.from_config({"claim_profiles": {"a": {}},
+                                              "default_claim_profile": "b"})
+        with self.assertRaises(ConfigurationException):
+            claims.ClaimProfiles.from_config({"claim_profiles": ["a"]})
+
+    def test_select(self):
+        self.assertEqual(self.profs.select("midas").name, "midas")
+        self.assertEqual(self.profs.select("urn:midas").name, "midas")
+        self.assertEqual(self.profs.select("dap").name, "dap")
+        self.assertEqual(self.profs.select(endpoint="https://oar.nist.gov/dap/edit").name, "dap")
+        self.assertEqual(self.profs.select(endpoint="https://oar.nist.gov/midas").name, "midas")
+        self.assertEqual(self.profs.select("goob", "https://example.com/").name, "default")
+        self.assertEqual(self.profs.select().name, "default")
+
+class TestClaimCodec(test.TestCase):
+
+    def test_names(self):
+        self.assertEqual(claims.shorten_name("userLastName"), "fn")
+        self.assertEqual(claims.expand_name("fn"), "userLastName")
+        uri = "http://schemas.xmlsoap.org/ws/2005/05/identity/claims/nistOU"
+        self.assertEqual(claims.shorten_name(uri), "~s:nistOU")
+        self.assertEqual(claims.expand_name("~s:nistOU"), uri)
+        self.assertEqual(claims.shorten_name("goober"), "goober")
+        self.assertEqual(claims.expand_name("goober"), "goober")
+
+        # names that collide with the encoding are escaped
+        for name in ["gn", "z", "cf", "~s:nistOU", "~:gn", "~"]:
+            self.assertEqual(claims.shorten_name(name), "~:"+name)
+            self.assertEqual(claims.expand_name(claims.shorten_name(name)), name)
+        self.assertEqual(claims.expand_name("~:gn", 1), "~:gn")
+
+    def test_encode(self):
+        codec = claims.ClaimCodec()
+        data = dict(ATTS, sub="gcranston", exp=12, jti="abc")
+        del data['userId']
+        out = codec.encode(data)
+        self.assertEqual(out['cf'], 2)
+        self.assertEqual(out['sub'], "gcranston")
+        self.assertEqual(out['exp'], 12)
+        self.assertEqual(out['fn'], "Cranston")
+        self.assertEqual(out['~s:nistOU'], "Funny Walks")
+        self.assertNotIn("userLastName", out)
+        self.assertNotIn("z", out)
+
+        self.assertEqual(claims.expand_claims(out), data)
+        self.assertEqual(codec.decode(out), data)
+
+    def test_collisions(self):
+        data = OrderedDict([("sub", "gcranston"), ("userName", "Gurn"), ("gn", "passed"),
+                            ("z", "zed"), ("cf", "see-eff"), ("~s:nistOU", "tilde"),
+                            ("http://schemas.xmlsoap.org/ws/2005/05/identity/claims/nistOU",
+                             "Funny Walks")])
+        out = claims.ClaimCodec().encode(data)
+        self.assertEqual(out['gn'], "Gurn")
+        self.assertEqual(out['~:gn'], "passed")
+        self.assertEqual(out['cf'], claims.COMPACT_VERSION)
+        self.assertEqual(claims.expand_claims(out), data)
+
+        out = claims.ClaimCodec(10).encode(data)
+        self.assertIn("z", out)
+        self.assertEqual(claims.expand_claims(out), data)
+
+    def test_deflate(self):
+        codec = claims.ClaimCodec.from_config({"deflate_threshold": 100})
+        self.assertEqual(codec.deflate_threshold, 100)
+        data = {"sub": "gcranston", "exp": 12, "userName": "Gurn",
+                "userGroup": ["group%d" % i for i in range(50)]}
+        out = codec.encode(data)
+        self.assertEqual(set(out.keys()), set("sub exp z cf".split()))
+        self.assertLess(len(out['z']), len(str(data['userGroup'])))
+        self.assertEqual(claims.expand_claims(out), data)
+
+        # small attribute sets are not compressed
+        out = codec.encode({"sub": "gcranston", "userName": "Gurn"})
+        self.assertEqual(out['gn'], "Gurn")
+
+        with self.assertRaises(ConfigurationException):
+            claims.ClaimCodec.from_config({"deflate_threshold": "big"})
+
+    def test_expand_claims(self):
+        data = {"sub": "gcranston", "userName": "Gurn"}
+        self.assertIs(claims.expand_claims(data), data)
+        self.assertEqual(claims.expand_claims({"sub": "gcranston", "gn": "Gurn", "cf": 1}),
+                         data)
+        with self.assertRaises(ValueError):
+            claims.expand_claims({"sub": "gcranston", "cf": 99})
+        with self.assertRaises(ValueError):
+            claims.expand_claims({"sub": "gcranston", "z": "!!notdata", "cf": 1})
+
+
+if __name__ == '__main__':
+    test.main()
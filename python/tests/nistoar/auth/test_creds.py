@@ -1,10 +1,22 @@
-import os, json, pdb, time, jwt
+import os, json, pdb, time, jwt, tempfile, threading
 import unittest as test
+from unittest import mock
 from collections import OrderedDict
 from io import StringIO
 
 from nistoar.auth import creds
+from nistoar.auth.revoke import RevocationList
+from nistoar.auth.wsgi.sessions import SQLiteSessionStore
 from nistoar.base.config import ConfigurationException
+from jwt.algorithms import has_crypto
+
+if has_crypto:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
+
+def to_pem(key):
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption()).decode('ascii')
 
 class Test_FallbackDict(test.TestCase):
 
@@ -106,12 +118,382 @@ class TestJWTGenerator(test.TestCase):
         self.assertEqual(data['phase'], "Bud")
         self.assertEqual(data['color'], "blue")
 
+    def test_generate_many(self):
+        due = time.time() + 600
+        items = [("me", {"name": "Bud", "token": "XX"}), ("you", {"name": "Gurn"})]
+        for encoder in ("pyjwt", "fast"):
+            self.cfg['encoder'] = encoder
+            self.gen = creds.JWTGenerator(self.cfg)
+            toks = self.gen.generate_many(items, 600)
+            self.assertEqual(len(toks), 2)
+
+            data = [jwt.decode(t, self.cfg['secret'], algorithms="HS256") for t in toks]
+            self.assertEqual([d['sub'] for d in data], ["me", "you"])
+            self.assertEqual([d['name'] for d in data], ["Bud", "Gurn"])
+            self.assertEqual(data[0]['exp'], data[1]['exp'])
+            self.assertGreater(data[0]['exp'], due-1)
+            self.assertLess(data[0]['exp'], due+5)
+            self.assertNotIn('token', data[0])
+
+        self.assertEqual(self.gen.generate_many([]), [])
+
+    def test_generate_many_batched(self):
+        # batches are signed with the prepared key rather than via jwt.encode()
+        self.gen = creds.JWTGenerator(self.cfg)
+        with mock.patch("jwt.encode") as encode:
+            toks = self.gen.generate_many([("me", {"name": "Bud"})])
+        encode.assert_not_called()
+        claims = jwt.decode(toks[0], self.cfg['secret'], algorithms="HS256")
+        self.assertEqual(toks[0], jwt.encode(claims, self.cfg['secret'], algorithm="HS256"))
+
+    def test_fast_encoder(self):
+        self.assertFalse(self.gen._fast)
+        with self.assertRaises(ConfigurationException):
+            creds.JWTGenerator({"secret": "XX", "encoder": "slow"})
+
+        self.cfg['encoder'] = "fast"
+        self.gen = creds.JWTGenerator(self.cfg)
+        self.assertTrue(self.gen._fast)
+
+        # output must be identical to pyjwt's
+        claims = {"name": "Bud", "color": "grün", "sub": "me", "exp": 1700000000,
+                  "groups": ["a", "b"]}
+        self.assertEqual(self.gen._fast_encode(claims),
+                         jwt.encode(claims, self.cfg['secret'], algorithm="HS256"))
+
+        due = time.time() + 600
+        tok = self.gen.generate("me", {"name": "Bud", "color": "green", "userId": "me"}, 600)
+        data = jwt.decode(tok, self.cfg['secret'], algorithms="HS256")
+        self.assertEqual(data['sub'], "me")
+        self.assertGreater(data['exp'], due-1)
+        self.assertLess(data['exp'], due+5)
+        self.assertEqual(data['name'], "Bud")
+        self.assertEqual(data['color'], "green")
+        self.assertNotIn('userId', data)
+        self.assertEqual(jwt.get_unverified_header(tok), {"alg": "HS256", "typ": "JWT"})
+
     def test_create_default_token_generator(self):
         self.assertIsNone(creds.default_token_generator)
         creds.create_default_token_generator(self.cfg)
         self.assertTrue(isinstance(creds.default_token_generator,
                                    creds.JWTGenerator))
 
+        self.cfg['cache'] = {"size": 10}
+        creds.create_default_token_generator(self.cfg)
+        self.assertTrue(isinstance(creds.default_token_generator,
+                                   creds.CachingTokenGenerator))
+        self.assertEqual(creds.default_token_generator.cache.maxsize, 10)
+
+    def test_decode(self):
+        tok = self.gen.generate("me", {"name": "Bud"})
+        data = self.gen.decode(tok)
+        self.assertEqual(data['sub'], "me")
+        self.assertEqual(data['name'], "Bud")
+
+        with self.assertRaises(jwt.InvalidTokenError):
+            creds.JWTGenerator({"secret": "shout!"}).decode(tok)
+        with self.assertRaises(jwt.ExpiredSignatureError):
+            self.gen.decode(self.gen.generate("me", {"name": "Bud"}, -10))
+
+        self.assertIsNone(self.gen.jwks())
+
+    def test_compact(self):
+        self.gen = creds.JWTGenerator(dict(self.cfg, compact={"deflate_threshold": 200}))
+        atts = {"userName": "Bud", "userLastName": "Smith",
+                "userGroup": ["group%d" % i for i in range(40)]}
+        tok = self.gen.generate("me", {"userName": "Bud", "userLastName": "Smith"})
+        data = jwt.decode(tok, self.cfg['secret'], algorithms="HS256")
+        self.assertEqual(data['cf'], 2)
+        self.assertEqual(data['gn'], "Bud")
+        self.assertEqual(data['sub'], "me")
+
+        data = self.gen.decode(tok)
+        self.assertEqual(data['userName'], "Bud")
+        self.assertEqual(data['userLastName'], "Smith")
+        self.assertNotIn('cf', data)
+
+        tok = self.gen.generate("me", atts)
+        self.assertLess(len(tok), len(creds.JWTGenerator(self.cfg).generate("me", atts)))
+        data = jwt.decode(tok, self.cfg['secret'], algorithms="HS256")
+        self.assertIn('z', data)
+        data = self.gen.decode(tok)
+        self.assertEqual(data['userGroup'], atts['userGroup'])
+
+        crd = creds.Credentials.from_claims(jwt.decode(tok, self.cfg['secret'],
+                                                       algorithms="HS256"))
+        self.assertEqual(crd.id, "me")
+        self.assertEqual(crd['userName'], "Bud")
+        self.assertEqual(crd['userGroup'], atts['userGroup'])
+        self.assertNotIn('exp', crd)
+        self.assertNotIn('jti', crd)
+
+        fast = creds.JWTGenerator(dict(self.cfg, compact=True, encoder="fast"))
+        self.assertEqual(self.gen.decode(fast.generate("me", atts))['userGroup'],
+                         atts['userGroup'])
+
+    def test_revoke(self):
+        tok = self.gen.generate("me", {"name": "Bud"})
+        data = self.gen.decode(tok)
+        self.assertTrue(data.get('jti'))
+        self.assertNotEqual(self.gen.decode(self.gen.generate("me", {}))['jti'], data['jti'])
+
+        # no revocation list: revoking has no effect
+        self.assertIsNone(self.gen.revocations)
+        self.gen.revoke(data)
+        self.assertFalse(self.gen.is_revoked(data))
+
+        self.gen.revocations = RevocationList(100)
+        self.assertFalse(self.gen.is_revoked(data))
+        self.gen.revoke(data)
+        self.assertTrue(self.gen.is_revoked(data))
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.gen.decode(tok)
+        self.assertEqual(self.gen.decode(self.gen.generate("me", {}))['sub'], "me")
+
+    def test_keyring(self):
+        oldgen = self.gen
+        oldtok = oldgen.generate("me", {"name": "Bud"})
+
+        self.cfg['keyring'] = [{"kid": "k2", "secret": "shout!"},
+                               {"kid": "k1", "secret": "hush!", "retired": int(time.time())}]
+        for encoder in ("pyjwt", "fast"):
+            self.cfg['encoder'] = encoder
+            self.gen = creds.JWTGenerator(self.cfg)
+            self.assertEqual(self.gen._secret, "shout!")
+
+            tok = self.gen.generate("me", {"name": "Bud"})
+            self.assertEqual(jwt.get_unverified_header(tok)['kid'], "k2")
+            self.assertEqual(jwt.decode(tok, "shout!", algorithms=["HS256"])['name'], "Bud")
+            self.assertEqual(self.gen.decode(tok)['name'], "Bud")
+
+            # tokens signed with the retired key are still accepted
+            self.assertEqual(self.gen.decode(oldtok)['name'], "Bud")
+            tok = jwt.encode({"sub": "me"}, "hush!", algorithm="HS256", headers={"kid": "k1"})
+            self.assertEqual(self.gen.decode(tok)['sub'], "me")
+
+            tok = jwt.encode({"sub": "me"}, "hush!", algorithm="HS256", headers={"kid": "k0"})
+            with self.assertRaises(jwt.InvalidTokenError):
+                self.gen.decode(tok)
+            with self.assertRaises(jwt.InvalidTokenError):
+                oldgen.decode(self.gen.generate("me", {"name": "Bud"}))
+
+        # after the grace period
+        self.cfg['keyring_grace_period'] = -1
+        self.gen = creds.JWTGenerator(self.cfg)
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.gen.decode(oldtok)
+
+    def test_keyring_reload(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            keyfile = os.path.join(tmpdir, "keyring.json")
+            with open(keyfile, 'w') as fd:
+                json.dump([{"kid": "k1", "secret": "hush!"}], fd)
+            self.cfg = {"keyring_file": keyfile, "keyring_check_interval": 0, "encoder": "fast"}
+            self.gen = creds.JWTGenerator(self.cfg)
+            tok1 = self.gen.generate("me", {"name": "Bud"})
+            self.assertEqual(jwt.get_unverified_header(tok1)['kid'], "k1")
+
+            with open(keyfile, 'w') as fd:
+                json.dump([{"kid": "k2", "secret": "shout!"}, {"kid": "k1", "secret": "hush!"}],
+                          fd)
+            os.utime(keyfile, (time.time()+5, time.time()+5))
+
+            tok2 = self.gen.generate("me", {"name": "Bud"})
+            self.assertEqual(jwt.get_unverified_header(tok2)['kid'], "k2")
+            self.assertEqual(jwt.decode(tok2, "shout!", algorithms=["HS256"])['name'], "Bud")
+            self.assertEqual(self.gen.decode(tok1)['name'], "Bud")
+
+@test.skipIf(not has_crypto, "cryptography package not installed")
+class TestAsymmetricJWTGenerator(test.TestCase):
+
+    def setUp(self):
+        creds.default_token_generator = None
+        self.cfg = {
+            "algorithm": "RS256",
+            "private_key": to_pem(rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+            "kid": "test1"
+        }
+        self.gen = creds.AsymmetricJWTGenerator(self.cfg)
+
+    def test_ctor(self):
+        self.assertEqual(self.gen.lifetime, 3600)
+        self.assertEqual(self.gen.algorithm, "RS256")
+        self.assertEqual(self.gen.kid, "test1")
+
+        with self.assertRaises(ConfigurationException):
+            creds.AsymmetricJWTGenerator({"algorithm": "RS256"})
+        with self.assertRaises(ConfigurationException):
+            creds.AsymmetricJWTGenerator({"algorithm": "HS256", "secret": "XX"})
+
+        # HS256 inputs do not apply
+        self.assertFalse(hasattr(self.gen, "keyring"))
+        with self.assertRaises(AttributeError):
+            self.gen._secret
+        for param, val in (("secret", "XX"), ("keyring", [{"secret": "XX"}]),
+                           ("keyring_file", "keys.json")):
+            with self.assertRaises(ConfigurationException):
+                creds.AsymmetricJWTGenerator(dict(self.cfg, **{param: val}))
+        with self.assertRaises(ConfigurationException):
+            creds.AsymmetricJWTGenerator(dict(self.cfg, encoder="slow"))
+
+    def test_fast_encoder(self):
+        self.assertFalse(self.gen._fast)
+        fast = creds.AsymmetricJWTGenerator(dict(self.cfg, encoder="fast"))
+        self.assertTrue(fast._fast)
+        claims = {"name": "Bud", "color": "grün", "sub": "me", "exp": 1700000000}
+        self.assertEqual(fast._encode(claims), self.gen._encode(claims))
+        tok = fast.generate("me", {"name": "Bud"})
+        self.assertEqual(self.gen.decode(tok)['name'], "Bud")
+
+    def test_generate(self):
+        due = time.time() + 600
+        tok = self.gen.generate("me", {"name": "Bud", "userId": "me"}, 600)
+        self.assertEqual(jwt.get_unverified_header(tok)['kid'], "test1")
+        self.assertEqual(jwt.get_unverified_header(tok)['alg'], "RS256")
+
+        data = self.gen.decode(tok)
+        self.assertEqual(data['sub'], "me")
+        self.assertEqual(data['name'], "Bud")
+        self.assertGreater(data['exp'], due-1)
+        self.assertLess(data['exp'], due+5)
+
+        # verify with the published key only
+        jwk = jwt.PyJWKSet.from_dict(self.gen.jwks())['test1']
+        data = jwt.decode(tok, jwk.key, algorithms=["RS256"])
+        self.assertEqual(data['sub'], "me")
+
+    def test_other_algorithms(self):
+        for alg, key in (("ES256", ec.generate_private_key(ec.SECP256R1())),
+                         ("EdDSA", ed25519.Ed25519PrivateKey.generate())):
+            gen = creds.AsymmetricJWTGenerator({"algorithm": alg, "private_key": to_pem(key)})
+            tok = gen.generate("me", {"name": "Bud"})
+            self.assertEqual(gen.decode(tok)['name'], "Bud")
+            self.assertEqual(jwt.get_unverified_header(tok)['kid'], gen.kid)
+            jwk = jwt.PyJWKSet.from_dict(gen.jwks())[gen.kid]
+            self.assertEqual(jwt.decode(tok, jwk.key, algorithms=[alg])['sub'], "me")
+
+    def test_generate_many(self):
+        toks = self.gen.generate_many([("me", {"name": "Bud"}), ("you", {"name": "Gurn"})])
+        self.assertEqual([self.gen.decode(t)['sub'] for t in toks], ["me", "you"])
+
+        # batched tokens are identical to those from jwt.encode()
+        claims = self.gen.decode(toks[0])
+        self.assertEqual(toks[0], jwt.encode(claims, self.gen._key, algorithm="RS256",
+                                             headers={"kid": "test1"}))
+        for alg, key in (("ES256", ec.generate_private_key(ec.SECP256R1())),
+                         ("EdDSA", ed25519.Ed25519PrivateKey.generate())):
+            gen = creds.AsymmetricJWTGenerator({"algorithm": alg, "private_key": to_pem(key)})
+            tok = gen.generate_many([("me", {"name": "Bud"})])[0]
+            self.assertEqual(gen.decode(tok)['name'], "Bud")
+            jwk = jwt.PyJWKSet.from_dict(gen.jwks())[gen.kid]
+            self.assertEqual(jwt.decode(tok, jwk.key, algorithms=[alg])['sub'], "me")
+
+    def test_refresh(self):
+        mgr = creds.RefreshTokenManager(self.gen)
+        tok = mgr.issue(creds.Credentials("me", {"name": "Bud"}, tokengen=self.gen))
+        self.assertEqual(jwt.get_unverified_header(tok)['kid'], "test1")
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.gen.decode(tok)
+        jwk = jwt.PyJWKSet.from_dict(self.gen.jwks())['test1']
+        with self.assertRaises(jwt.InvalidTokenError):
+            jwt.decode(tok, jwk.key, algorithms=["RS256"])
+        crd = mgr.exchange(tok)
+        self.assertEqual(crd['name'], "Bud")
+        self.assertEqual(self.gen.decode(crd['token'])['sub'], "me")
+        self.assertEqual(self.gen.derived_verification_keys("x", "other"), [])
+
+    def test_jwks(self):
+        jwks = self.gen.jwks()
+        self.assertEqual(len(jwks['keys']), 1)
+        self.assertEqual(jwks['keys'][0]['kid'], "test1")
+        self.assertEqual(jwks['keys'][0]['alg'], "RS256")
+        self.assertNotIn('d', jwks['keys'][0])
+
+    def test_create_default_token_generator(self):
+        gen = creds.create_default_token_generator(self.cfg)
+        self.assertTrue(isinstance(gen, creds.AsymmetricJWTGenerator))
+        self.assertIs(creds.default_token_generator, gen)
+
+        gen = creds.create_default_token_generator(dict(self.cfg, cache=True))
+        self.assertTrue(isinstance(gen, creds.CachingTokenGenerator))
+        self.assertEqual(gen.jwks()['keys'][0]['kid'], "test1")
+
+class TestCachingTokenGenerator(test.TestCase):
+
+    def setUp(self):
+        self.cfg = {
+            "secret": "hush!"
+        }
+        self.gen = creds.CachingTokenGenerator(creds.JWTGenerator(self.cfg))
+
+    def test_ctor(self):
+        self.assertEqual(self.gen.lifetime, 3600)
+        self.assertEqual(self.gen._minrem, 1800)
+        self.assertEqual(self.gen.cache.maxsize, 1024)
+
+        self.gen = creds.CachingTokenGenerator(creds.JWTGenerator(self.cfg),
+                                               {"size": 5, "min_remaining": 60})
+        self.assertEqual(self.gen._minrem, 60)
+        self.assertEqual(self.gen.cache.maxsize, 5)
+
+        with self.assertRaises(ConfigurationException):
+            creds.CachingTokenGenerator(creds.JWTGenerator(self.cfg), {"min_remaining": "1m"})
+
+    def test_generate(self):
+        tok = self.gen.generate("me", {"name": "Bud", "color": "green"})
+        data = jwt.decode(tok, self.cfg['secret'], algorithms="HS256")
+        self.assertEqual(data['sub'], "me")
+        self.assertEqual(data['name'], "Bud")
+        self.assertEqual(self.gen.cache.misses, 1)
+        self.assertEqual(self.gen.cache.hits, 0)
+
+        # same claims in a different order, plus an existing token
+        self.assertEqual(self.gen.generate("me", {"color": "green", "name": "Bud",
+                                                  "token": tok}),
+                         tok)
+        self.assertEqual(self.gen.cache.hits, 1)
+
+        self.assertNotEqual(self.gen.generate("you", {"name": "Bud", "color": "green"}), tok)
+        self.assertNotEqual(self.gen.generate("me", {"name": "Bud", "color": "blue"}), tok)
+        self.assertNotEqual(self.gen.generate("me", {"name": "Bud", "color": "green"}, 600), tok)
+        self.assertEqual(self.gen.cache.hits, 1)
+        self.assertEqual(self.gen.cache.misses, 4)
+
+        stats = self.gen.stats()
+        self.assertEqual(stats['size'], 4)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_min_remaining(self):
+        self.gen = creds.CachingTokenGenerator(creds.JWTGenerator(self.cfg),
+                                               {"min_remaining": 3600})
+        self.gen.generate("me", {"name": "Bud"})
+        self.gen.generate("me", {"name": "Bud"})
+        self.assertEqual(self.gen.cache.hits, 0)
+        self.assertEqual(self.gen.cache.misses, 2)
+
+    def test_credentials(self):
+        crd = creds.Credentials("me", {"userName": "Gurn"}, tokengen=self.gen)
+        crd.set_token()
+        tok = crd['token']
+        crd = creds.Credentials("me", {"userName": "Gurn"}, tokengen=self.gen)
+        crd.set_token()
+        self.assertEqual(crd['token'], tok)
+        self.assertEqual(self.gen.cache.hits, 1)
+
+    def test_revoked(self):
+        self.gen.revocations = RevocationList(100)
+        self.assertIsNotNone(self.gen.generator.revocations)
+
+        tok = self.gen.generate("me", {"name": "Bud"})
+        self.assertEqual(self.gen.generate("me", {"name": "Bud"}), tok)
+        self.gen.revoke(self.gen.decode(tok))
+
+        # a revoked token is not reused
+        newtok = self.gen.generate("me", {"name": "Bud"})
+        self.assertNotEqual(newtok, tok)
+        self.assertEqual(self.gen.decode(newtok)['sub'], "me")
+        self.assertEqual(self.gen.generate("me", {"name": "Bud"}), newtok)
+
 class TestCredentials(test.TestCase):
 
     def setUp(self):
@@ -211,6 +593,44 @@ class TestCredentials(test.TestCase):
         self.assertEqual(data['userLastName'], "Cranston")
         self.assertEqual(data['userOU'], "Ministry of Funny Walks")
 
+    def test_create_token_profile(self):
+        cfg = dict(self.cfg, claim_profiles={
+            "default": { "include": ["userName", "userLastName"] },
+            "ou":      { "include": ["userOU"], "rename": {"userOU": "ou"}, "audience": "ous" }
+        })
+        gen = creds.create_token_generator(cfg)
+        self.assertEqual(list(gen.claim_profiles), ["default", "ou"])
+        self.crd = creds.Credentials("me", self.atts, tokengen=gen)
+
+        data = gen.decode(self.crd.create_token())
+        self.assertEqual(data['sub'], "me")
+        self.assertEqual(data['userName'], "Gurn")
+        self.assertNotIn('userOU', data)
+        self.assertNotIn('userEmail', data)
+        self.assertNotIn('aud', data)
+
+        data = gen.decode(self.crd.create_token(profile="ou"))
+        self.assertEqual(data['ou'], "Ministry of Funny Walks")
+        self.assertEqual(data['aud'], "ous")
+        self.assertNotIn('userName', data)
+
+        data = gen.decode(self.crd.create_token(profile=gen.claim_profiles['default']))
+        self.assertEqual(data['userName'], "Gurn")
+
+        with self.assertRaises(ValueError):
+            self.crd.create_token(profile="goob")
+
+    def test_create_token_algorithm(self):
+        gen = creds.create_token_generator(dict(self.cfg, algorithm="HS256"))
+        self.assertEqual(jwt.get_unverified_header(gen.generate("me", {}))['alg'], "HS256")
+
+        # unsupported and misspelled algorithms are not quietly replaced with HS256
+        for alg in ("HS512", "RS265", "none"):
+            with self.assertRaises(ConfigurationException):
+                creds.create_token_generator(dict(self.cfg, algorithm=alg))
+        with self.assertRaises(ConfigurationException):
+            creds.JWTGenerator(dict(self.cfg, algorithm="HS512"))
+
     def test_set_token(self):
         self.crd = creds.Credentials("me", self.atts)
         self.assertIsNone(self.crd.get('token'))
@@ -272,10 +692,425 @@ class TestCredentials(test.TestCase):
         self.assertEqual(crd['userOU'], self.crd['userOU'])
         self.assertEqual(crd['token'], self.crd['token'])
 
+    def test_json_expires(self):
+        exp = time.time() + 60
+        self.crd = creds.Credentials("me", self.atts, exp)
+        self.crd.set_token()
+        data = json.loads(self.crd.to_json())
+        self.assertEqual(data['token'], self.crd['token'])
+        self.assertEqual(data['expires'], exp)
+
+        crd = creds.Credentials.from_json_dict(data)
+        self.assertEqual(json.loads(crd.to_json())['expires'], exp)
+
+    def test_json_cache(self):
+        self.crd = creds.Credentials("me", self.atts)
+        out = self.crd.to_json()
+        self.assertIs(self.crd.to_json(), out)
+        self.assertNotEqual(self.crd.to_json(None), out)
+        self.assertIs(self.crd.to_json(), out)
+
+        self.crd['goob'] = "gurn"
+        self.assertIsNot(self.crd.to_json(), out)
+        self.assertIn('goob', json.loads(self.crd.to_json())['userDetails'])
+
+        out = self.crd.to_json()
+        self.crd.email = "me@x.org"
+        self.assertEqual(json.loads(self.crd.to_json())['userDetails']['userEmail'], "me@x.org")
+
+        del self.crd['goob']
+        self.assertNotIn('goob', json.loads(self.crd.to_json())['userDetails'])
+        self.crd.update({"goob": "bob"})
+        self.assertEqual(json.loads(self.crd.to_json())['userDetails']['goob'], "bob")
+
+        self.crd = creds.CompactCredentials("me", self.atts)
+        out = self.crd.to_json()
+        self.assertIs(self.crd.to_json(), out)
+        self.crd['goob'] = "gurn"
+        self.assertIn('goob', json.loads(self.crd.to_json())['userDetails'])
+
+    def test_keys_order(self):
+        atts = OrderedDict(("attr%03d" % i, i) for i in range(300))
+        atts['token'] = "abc"
+        atts['userName'] = "Gurn"
+        self.crd = creds.Credentials("me", atts)
+        keys = list(self.crd.keys())
+        self.assertEqual(keys[:4], ['userId', 'userEmail', 'userName', 'userLastName'])
+        self.assertEqual(keys[4:-1], list(atts.keys())[:300])
+        self.assertEqual(keys[-1], 'token')
+
         
         
         
                          
+class TestCompactCredentials(test.TestCase):
+
+    def setUp(self):
+        self.cfg = {
+            "secret": "hush!"
+        }
+        creds.create_default_token_generator(self.cfg)
+
+        self.atts = {
+            "userId": "you",
+            "userName": "Gurn",
+            "userLastName": "Cranston",
+            "userOU": "Ministry of Funny Walks"
+        }
+
+    def test_slots(self):
+        crd = creds.CompactCredentials("me", self.atts)
+        self.assertFalse(hasattr(crd, '__dict__'))
+        with self.assertRaises(AttributeError):
+            crd.goob = "gurn"
+
+    def test_same_as_credentials(self):
+        for args in [(), ("me",), ("me", self.atts), ("me", self.atts, time.time()+60),
+                     ("me", {"token": "abc", "userEmail": "me@x.org", "since": 3})]:
+            full = creds.Credentials(*args)
+            comp = creds.CompactCredentials(*args)
+            self.assertEqual(comp.to_json(), full.to_json())
+            self.assertEqual(list(comp.keys()), list(full.keys()))
+            self.assertEqual(OrderedDict(comp), OrderedDict(full))
+            self.assertEqual(len(comp), len(full))
+            self.assertEqual(set(comp), set(full))
+            self.assertEqual(dict(comp.items()), dict(full.items()))
+            self.assertEqual(comp, full)
+            self.assertEqual(full, comp)
+            self.assertEqual(comp.id, full.id)
+            self.assertEqual(comp.is_authenticated(), full.is_authenticated())
+            self.assertEqual(comp.expiration, full.expiration)
+            self.assertEqual(comp.expired(), full.expired())
+            for key in "userEmail userName userOU goob".split():
+                self.assertEqual(comp.get(key), full.get(key))
+                self.assertEqual(comp.get(key, "x"), full.get(key, "x"))
+                self.assertEqual(key in comp, key in full)
+
+    def test_same_mapping(self):
+        full = creds.Credentials('bob', {'userOU': 'x'})
+        comp = creds.CompactCredentials('bob', {'userOU': 'x'})
+        self.assertEqual(len(comp), 1)
+        self.assertEqual(list(comp), ['userOU'])
+        self.assertEqual(list(comp.items()), [('userOU', 'x')])
+        self.assertEqual(comp, full)
+
+        for crd in (full, comp):
+            crd['userName'] = "user"
+            crd['userId'] = "robert"
+            crd['goob'] = "gurn"
+        self.assertEqual(len(comp), len(full))
+        self.assertEqual(set(comp), set(full))
+        self.assertEqual(dict(comp.items()), dict(full.items()))
+        self.assertEqual(comp, full)
+
+        for crd in (full, comp):
+            del crd['userName']
+            del crd['userId']
+            self.assertEqual(crd.id, "bob")
+            with self.assertRaises(KeyError):
+                del crd['userId']
+        self.assertEqual(len(comp), len(full))
+        self.assertEqual(set(comp), set(full))
+        self.assertEqual(comp, full)
+
+        comp['goob'] = "bob"
+        self.assertNotEqual(comp, full)
+
+    def test_mutate(self):
+        crd = creds.CompactCredentials("me", self.atts)
+        self.assertEqual(crd.given_name, "Gurn")
+        crd.given_name = "Bob"
+        crd.email = "bob@x.org"
+        self.assertEqual(crd['userName'], "Bob")
+        self.assertEqual(crd['userEmail'], "bob@x.org")
+        del crd['userName']
+        self.assertEqual(crd['userName'], "user")
+        with self.assertRaises(KeyError):
+            del crd['userName']
+        with self.assertRaises(KeyError):
+            del crd['userId']
+
+        crd['color'] = "red"
+        self.assertEqual(crd['color'], "red")
+        self.assertEqual(len(crd), 4)
+        del crd['color']
+        self.assertNotIn('color', crd)
+        with self.assertRaises(KeyError):
+            crd['color']
+
+    def test_token(self):
+        crd = creds.CompactCredentials("me", self.atts)
+        crd.set_token()
+        data = jwt.decode(crd['token'], self.cfg['secret'], algorithms="HS256")
+        self.assertEqual(data['sub'], "me")
+        self.assertEqual(data['userOU'], "Ministry of Funny Walks")
+
+        crd = creds.CompactCredentials.from_json_dict(json.loads(crd.to_json()))
+        self.assertIsInstance(crd, creds.CompactCredentials)
+        self.assertEqual(crd.id, "me")
+        self.assertIn('token', crd)
+
+class TestCredentialsSnapshot(test.TestCase):
+
+    def setUp(self):
+        self.cfg = {
+            "secret": "hush!"
+        }
+        creds.create_default_token_generator(self.cfg)
+        self.exp = time.time() + 60
+        self.crd = creds.Credentials("me", {"userName": "Gurn", "groups": ["a", "b"]},
+                                     self.exp)
+        self.crd['token'] = "abc"
+
+    def test_snapshot(self):
+        snap = self.crd.snapshot()
+        self.assertIsInstance(snap, creds.CredentialsSnapshot)
+        self.assertIs(snap.snapshot(), snap)
+        self.assertEqual(snap.id, "me")
+        self.assertEqual(snap['userName'], "Gurn")
+        self.assertEqual(snap['groups'], ("a", "b"))
+        self.assertEqual(snap.expiration_time, self.exp)
+        self.assertEqual(list(snap.keys()), list(self.crd.keys()))
+        self.assertEqual(snap.to_json(), self.crd.to_json())
+        self.assertEqual(snap.to_json(None), self.crd.to_json(None))
+        self.assertIs(snap.to_json(), snap.to_json())
+
+        self.assertEqual(snap.claims['userName'], "Gurn")
+        self.assertNotIn('token', snap.claims)
+        self.assertNotIn('userId', snap.claims)
+
+        # changes to the original do not affect the snapshot
+        self.crd['userName'] = "Bob"
+        self.crd['groups'].append("c")
+        self.assertEqual(snap['userName'], "Gurn")
+        self.assertEqual(snap['groups'], ("a", "b"))
+
+    def test_immutable(self):
+        snap = self.crd.snapshot()
+        with self.assertRaises(TypeError):
+            snap['userName'] = "Bob"
+        with self.assertRaises(AttributeError):
+            snap.given_name = "Bob"
+        with self.assertRaises(AttributeError):
+            snap._data = {}
+        with self.assertRaises(TypeError):
+            snap.claims['userName'] = "Bob"
+        with self.assertRaises(TypeError):
+            snap.set_token()
+
+    def test_to_json_with(self):
+        snap = self.crd.snapshot()
+        text = snap.to_json()
+        tokens = {"token": "def", "refreshToken": "ghi"}
+        full = self.crd.snapshot().thaw()
+        full.update(tokens)
+        self.assertEqual(snap.to_json_with(tokens), full.to_json())
+        self.assertEqual(snap.to_json_with(tokens, None), full.to_json(None))
+        self.assertEqual(snap.to_json(), text)
+        self.assertEqual(json.loads(snap.to_json_with({}))['token'], "abc")
+
+    def test_nested_immutable(self):
+        nested = {"a": 1, "b": [1, 2], "c": {"d": ["x"]}}
+        self.crd['m'] = nested
+        snap = self.crd.snapshot()
+        digest, text = snap.digest, snap.to_json()
+        with self.assertRaises(TypeError):
+            snap['m']['a'] = 2
+        with self.assertRaises(TypeError):
+            snap['m']['c']['d'] = ["y"]
+        with self.assertRaises(TypeError):
+            snap.claims['m']['a'] = 2
+        nested['a'] = 3
+        nested['c']['d'].append("y")
+        self.assertEqual(snap['m']['a'], 1)
+        self.assertEqual(snap['m']['c']['d'], ("x",))
+        self.assertEqual(snap.digest, digest)
+        self.assertEqual(snap.to_json(), text)
+
+        # nested values are still encoded as objects
+        self.assertEqual(json.loads(snap.to_json())['userDetails']['m'],
+                         {"a": 1, "b": [1, 2], "c": {"d": ["x"]}})
+        data = jwt.decode(snap.create_token(), self.cfg['secret'], algorithms="HS256")
+        self.assertEqual(data['m'], {"a": 1, "b": [1, 2], "c": {"d": ["x"]}})
+        thawed = snap.thaw()
+        thawed['m']['a'] = 2
+        self.assertEqual(thawed['m']['c'], {"d": ["x"]})
+        self.assertEqual(snap['m']['a'], 1)
+
+    def test_hash(self):
+        snap = self.crd.snapshot()
+        self.assertEqual(snap, self.crd.snapshot())
+        self.assertEqual(hash(snap), hash(self.crd.snapshot()))
+        self.assertEqual(len(snap.digest), 64)
+        self.assertEqual(len(set([snap, self.crd.snapshot()])), 1)
+
+        self.crd['userName'] = "Bob"
+        self.assertNotEqual(snap, self.crd.snapshot())
+        self.assertNotEqual(snap.digest, self.crd.snapshot().digest)
+        self.assertNotEqual(snap,
+                            creds.Credentials("me", {"userName": "Gurn", "groups": ["a", "b"],
+                                                     "token": "abc"}).snapshot())
+
+    def test_token(self):
+        snap = self.crd.snapshot()
+        data = jwt.decode(snap.create_token(), self.cfg['secret'], algorithms="HS256")
+        self.assertEqual(data['sub'], "me")
+        self.assertEqual(data['userName'], "Gurn")
+        self.assertEqual(data['groups'], ["a", "b"])
+
+        crd = snap.thaw()
+        self.assertIsInstance(crd, creds.Credentials)
+        self.assertEqual(crd.to_json(), snap.to_json())
+        crd['userName'] = "Bob"
+        self.assertEqual(snap['userName'], "Gurn")
+
+class TestRefreshTokenManager(test.TestCase):
+
+    def setUp(self):
+        self.cfg = { "secret": "hush!", "lifetime": 300 }
+        self.gen = creds.JWTGenerator(self.cfg)
+        self.mgr = creds.RefreshTokenManager(self.gen, {"lifetime": 3600})
+        self.crd = creds.Credentials("me", {"userName": "Gurn", "userLastName": "Cranston"},
+                                     tokengen=self.gen)
+
+    def test_ctor(self):
+        self.assertEqual(self.mgr.lifetime, 3600)
+        self.assertEqual(creds.RefreshTokenManager(self.gen).lifetime, 86400)
+        with self.assertRaises(ConfigurationException):
+            creds.RefreshTokenManager(self.gen, {"lifetime": "1d"})
+
+        cgen = creds.CachingTokenGenerator(self.gen)
+        self.assertIs(creds.RefreshTokenManager(cgen)._signer, self.gen)
+
+    def test_issue(self):
+        self.crd.set_token()
+        due = time.time() + 3600
+        tok = self.mgr.issue(self.crd)
+        data = jwt.decode(tok, options={"verify_signature": False})
+        self.assertEqual(data['typ'], "refresh")
+        self.assertEqual(data['aud'], creds.REFRESH_AUDIENCE)
+        self.assertEqual(data['sub'], "me")
+        self.assertEqual(set(data.keys()), set("sub exp jti typ aud".split()))
+        self.assertGreater(data['exp'], due-1)
+        self.assertEqual(len(self.mgr.store), 1)
+        rec = self.mgr.store.load("refresh:"+data['jti'])
+        self.assertEqual(rec['attrs']['userName'], "Gurn")
+        self.assertNotIn('token', rec['attrs'])
+
+        # a refresh token is not an access token
+        with self.assertRaises(jwt.InvalidSignatureError):
+            jwt.decode(tok, "hush!", algorithms=["HS256"], audience=creds.REFRESH_AUDIENCE)
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.gen.decode(tok)
+
+        with self.assertRaises(RuntimeError):
+            self.mgr.issue(creds.Credentials())
+
+    def test_exchange(self):
+        reftok = self.mgr.issue(self.crd)
+        due = time.time() + 300
+        crd = self.mgr.exchange(reftok)
+        self.assertEqual(crd.id, "me")
+        self.assertEqual(crd['userName'], "Gurn")
+        self.assertNotIn('typ', crd)
+        self.assertNotIn('exp', crd)
+
+        data = self.gen.decode(crd['token'])
+        self.assertEqual(data['sub'], "me")
+        self.assertNotIn('typ', data)
+        self.assertGreater(data['exp'], due-1)
+        self.assertLess(data['exp'], due+5)
+        self.assertNotEqual(crd['refreshToken'], reftok)
+        self.assertEqual(self.mgr._decode(crd['refreshToken'])['typ'], "refresh")
+
+        out = json.loads(crd.to_json())
+        self.assertIn('refreshToken', out)
+        self.assertNotIn('refreshToken', out['userDetails'])
+
+        # access tokens cannot be used to refresh
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.mgr.exchange(crd['token'])
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.mgr.exchange("goober")
+
+    def test_rotation(self):
+        reftok = self.mgr.issue(self.crd)
+        crd = self.mgr.exchange(reftok)
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.mgr.exchange(reftok)
+        self.assertEqual(self.mgr.exchange(crd['refreshToken']).id, "me")
+        self.assertEqual(len(self.mgr.store), 1)
+
+        self.gen.revocations = RevocationList(100)
+        reftok = self.mgr.issue(self.crd)
+        self.gen.revoke(jwt.decode(reftok, options={"verify_signature": False}))
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.mgr.exchange(reftok)
+
+    def test_rejected_as_access_token(self):
+        # even a token with a refresh typ signed with the access token key is rejected
+        tok = self.gen.generate("me", {"typ": "refresh"})
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.gen.decode(tok)
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.mgr.exchange(tok)
+
+    def test_keyring(self):
+        gen = creds.JWTGenerator({"keyring": [{"kid": "b", "secret": "new"},
+                                              {"kid": "a", "secret": "old"}]})
+        mgr = creds.RefreshTokenManager(gen)
+        crd = creds.Credentials("me", {"userName": "Gurn"}, tokengen=gen)
+        tok = mgr.issue(crd)
+        self.assertEqual(jwt.get_unverified_header(tok)['kid'], "b")
+        self.assertEqual(mgr.exchange(tok).id, "me")
+        self.assertNotEqual(gen.derive_key("x")[1], gen.derive_key("y")[1])
+        self.assertEqual(gen.derived_verification_keys("x", "b"), [gen.derive_key("x")[1]])
+        self.assertEqual(gen.derived_verification_keys("x", "c"), [])
+        self.assertEqual(len(gen.derived_verification_keys("x")), 2)
+
+    def test_shared_store(self):
+        store = {}
+        class Store:
+            def load(self, rid):  return store.get(rid)
+            def save(self, rid, data, exp):  store[rid] = dict(data)
+            def delete(self, rid):  store.pop(rid, None)
+            def take(self, rid):  return store.pop(rid, None)
+        mgr1 = creds.RefreshTokenManager(self.gen, {}, Store())
+        mgr2 = creds.RefreshTokenManager(self.gen, {}, Store())
+        crd = mgr2.exchange(mgr1.issue(self.crd))
+        self.assertEqual(crd['userName'], "Gurn")
+        self.assertEqual(len(store), 1)
+
+    def check_concurrent_exchange(self, mgrs):
+        # two simultaneous exchanges of the same refresh token: exactly one succeeds
+        tok = mgrs[0].issue(self.crd)
+        barrier = threading.Barrier(len(mgrs))
+        results = []
+        def exchange(mgr):
+            barrier.wait()
+            try:
+                results.append(mgr.exchange(tok))
+            except jwt.InvalidTokenError as ex:
+                results.append(ex)
+        threads = [threading.Thread(target=exchange, args=(m,)) for m in mgrs]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len([r for r in results if isinstance(r, creds.Credentials)]), 1)
+        self.assertEqual(len([r for r in results if isinstance(r, Exception)]), 1)
+
+    def test_concurrent_exchange(self):
+        self.check_concurrent_exchange([self.mgr, self.mgr])
+
+    def test_concurrent_exchange_shared_store(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dbfile = os.path.join(tmpdir, "refresh.db")
+            self.check_concurrent_exchange(
+                [creds.RefreshTokenManager(self.gen, {}, SQLiteSessionStore(dbfile)),
+                 creds.RefreshTokenManager(self.gen, {}, SQLiteSessionStore(dbfile))])
+
+
 if __name__ == '__main__':
     test.main()
         
@@ -0,0 +1,199 @@
+import os, json, pdb, tempfile, time
+import unittest as test
+from unittest import mock
+
+import jwt
+from jwt.algorithms import has_crypto
+
+from nistoar.auth import keys
+from nistoar.base.config import ConfigurationException
+
+if has_crypto:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
+
+def to_pem(key):
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption()).decode('ascii')
+
+@test.skipIf(not has_crypto, "cryptography package not installed")
+class TestKeys(test.TestCase):
+
+    def setUp(self):
+        self.rsapem = to_pem(rsa.generate_private_key(public_exponent=65537, key_size=2048))
+
+    def test_get_algorithm(self):
+        self.assertTrue(keys.get_algorithm("RS256"))
+        self.assertTrue(keys.get_algorithm("EdDSA"))
+        with self.assertRaises(ConfigurationException):
+            keys.get_algorithm("HS256")
+
+    def test_load_private_key(self):
+        key = keys.load_private_key("RS256", {"private_key": self.rsapem})
+        self.assertTrue(hasattr(key, 'public_key'))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            keyfile = os.path.join(tmpdir, "sign.pem")
+            with open(keyfile, 'w') as fd:
+                fd.write(self.rsapem)
+            key = keys.load_private_key("RS256", {"private_key_file": keyfile})
+            self.assertTrue(hasattr(key, 'public_key'))
+
+            with self.assertRaises(ConfigurationException):
+                keys.load_private_key("RS256", {"private_key_file": keyfile+"x"})
+
+        with self.assertRaises(ConfigurationException):
+            keys.load_private_key("RS256", {})
+        with self.assertRaises(ConfigurationException):
+            keys.load_private_key("ES256", {"private_key": self.rsapem})
+
+    def test_public_jwk(self):
+        key = keys.load_private_key("RS256", {"private_key": self.rsapem})
+        jwk = keys.public_jwk("RS256", key, "key1")
+        self.assertEqual(jwk['kty'], "RSA")
+        self.assertEqual(jwk['kid'], "key1")
+        self.assertEqual(jwk['alg'], "RS256")
+        self.assertEqual(jwk['use'], "sig")
+        self.assertIn('n', jwk)
+        self.assertNotIn('d', jwk)
+
+        jwk = keys.public_jwk("RS256", key)
+        self.assertEqual(jwk['kid'], keys.jwk_thumbprint(jwk))
+        self.assertEqual(jwk['kid'], keys.public_jwk("RS256", key.public_key())['kid'])
+
+        key = ec.generate_private_key(ec.SECP256R1())
+        jwk = keys.public_jwk("ES256", key)
+        self.assertEqual(jwk['kty'], "EC")
+        self.assertNotIn('d', jwk)
+
+        jwks = keys.make_jwks([jwk])
+        self.assertEqual(list(jwks.keys()), ["keys"])
+        self.assertEqual(jwks['keys'][0]['kid'], jwk['kid'])
+
+    def test_jwk_thumbprint(self):
+        # example from RFC 7638, section 3.1
+        jwk = {
+            "kty": "RSA", "e": "AQAB", "alg": "RS256", "kid": "2011-04-29",
+            "n": "0vx7agoebGcQSuuPiLJXZptN9nndrQmbXEps2aiAFbWhM78LhWx4cbbfAAtVT86zwu1RK7aPFFxuhDR1L6tSoc_BJECPebWKRXjBZCiFV4n3oknjhMstn64tZ_2W-5JsGY4Hc5n9yBXArwl93lqt7_RN5w6Cf0h4QyQ5v-65YGjQR0_FDW2QvzqY368QQMicAtaSqzs8KJZgnYb9c7d0zgdAZHzu6qMQvRL5hajrn1n91CbOpbISD08qNLyrdkt-bFTWhAI4vMQFh6WeZu0fM4lFd2NcRwr3XPksINHaQ-G_xBniIqbw0Ls1jF44-csFCur-kEgU8awapJzKnqDKgw"
+        }
+        self.assertEqual(keys.jwk_thumbprint(jwk), "NzbLsXh8uDCcd-6MNwXF4W_7noWXFZAfHkxZsRGC9Xs")
+
+class TestKeyring(test.TestCase):
+
+    def setUp(self):
+        self.keylist = [
+            {"kid": "k2", "secret": "new"},
+            {"kid": "k1", "secret": "old", "retired": int(time.time()) - 60}
+        ]
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.keyfile = os.path.join(self.tmpdir.name, "keyring.json")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_ctor(self):
+        ring = keys.Keyring(self.keylist)
+        self.assertEqual(len(ring), 2)
+        self.assertEqual(ring.current, ("k2", "new"))
+        self.assertEqual(ring.version, 1)
+        self.assertFalse(ring.refresh())
+
+        with self.assertRaises(ConfigurationException):
+            keys.Keyring([])
+        with self.assertRaises(ConfigurationException):
+            keys.Keyring([{"kid": "k1"}])
+        with self.assertRaises(ConfigurationException):
+            keys.Keyring([{"secret": "a"}, {"kid": "k1", "secret": "b"}])
+        with self.assertRaises(ConfigurationException):
+            keys.Keyring([{"kid": "k1", "secret": "a"}, {"kid": "k1", "secret": "b"}])
+        with self.assertRaises(ConfigurationException):
+            keys.Keyring([{"kid": "k1", "secret": "a", "retired": "yesterday"}])
+
+    def test_from_config(self):
+        ring = keys.Keyring.from_config({"secret": "hush"}, 600)
+        self.assertEqual(ring.current, (None, "hush"))
+        self.assertEqual(ring.grace_period, 600)
+
+        ring = keys.Keyring.from_config({"secret": "hush", "keyring": self.keylist,
+                                         "keyring_grace_period": 30})
+        self.assertEqual(ring.current, ("k2", "new"))
+        self.assertEqual(ring.grace_period, 30)
+
+        with self.assertRaises(ConfigurationException):
+            keys.Keyring.from_config({})
+
+    def test_lookup(self):
+        ring = keys.Keyring(self.keylist, grace_period=3600)
+        self.assertEqual(ring.lookup("k2"), "new")
+        self.assertEqual(ring.lookup("k1"), "old")
+        self.assertIsNone(ring.lookup("k0"))
+        self.assertEqual(ring.acceptable(), ["new", "old"])
+
+        ring.grace_period = 30
+        self.assertEqual(ring.lookup("k2"), "new")
+        self.assertIsNone(ring.lookup("k1"))
+        self.assertEqual(ring.acceptable(), ["new"])
+
+    def test_demoted(self):
+        # an older key without a retirement time is accepted only for the grace period
+        del self.keylist[1]['retired']
+        ring = keys.Keyring(self.keylist, grace_period=30)
+        self.assertEqual(ring.lookup("k1"), "old")
+        later = time.time() + 31
+        with mock.patch("time.time", lambda: later):
+            self.assertIsNone(ring.lookup("k1"))
+            self.assertEqual(ring.acceptable(), ["new"])
+            self.assertEqual(ring.lookup("k2"), "new")
+
+    def test_rotation(self):
+        with open(self.keyfile, 'w') as fd:
+            json.dump([{"kid": "k1", "secret": "old"}], fd)
+        ring = keys.Keyring(keyfile=self.keyfile, grace_period=30, check_interval=0)
+        self.assertEqual(ring.current, ("k1", "old"))
+
+        # rotate in a new key, keeping the old one in the file without a retired time
+        start = time.time()
+        with open(self.keyfile, 'w') as fd:
+            json.dump([{"kid": "k2", "secret": "new"}, {"kid": "k1", "secret": "old"}], fd)
+        os.utime(self.keyfile, (start+5, start+5))
+        self.assertTrue(ring.refresh())
+        self.assertEqual(ring.current, ("k2", "new"))
+        self.assertEqual(ring.lookup("k1"), "old")
+
+        # a later reload does not restart the grace period
+        with mock.patch("time.time", lambda: start+20):
+            os.utime(self.keyfile, (start+10, start+10))
+            self.assertTrue(ring.refresh())
+            self.assertEqual(ring.lookup("k1"), "old")
+        with mock.patch("time.time", lambda: start+31):
+            self.assertIsNone(ring.lookup("k1"))
+            self.assertEqual(ring.acceptable(), ["new"])
+
+    def test_keyfile(self):
+        with open(self.keyfile, 'w') as fd:
+            json.dump({"keys": self.keylist[1:]}, fd)
+        ring = keys.Keyring.from_config({"keyring_file": self.keyfile,
+                                         "keyring_check_interval": 0})
+        self.assertEqual(ring.current, ("k1", "old"))
+        self.assertFalse(ring.refresh())
+
+        with open(self.keyfile, 'w') as fd:
+            json.dump(self.keylist, fd)
+        os.utime(self.keyfile, (time.time()+5, time.time()+5))
+        self.assertTrue(ring.refresh())
+        self.assertEqual(ring.current, ("k2", "new"))
+        self.assertEqual(ring.version, 2)
+
+        # a bad update leaves the current keys in place
+        with open(self.keyfile, 'w') as fd:
+            fd.write("[{")
+        os.utime(self.keyfile, (time.time()+10, time.time()+10))
+        self.assertFalse(ring.refresh())
+        self.assertEqual(ring.current, ("k2", "new"))
+
+        with self.assertRaises(ConfigurationException):
+            keys.Keyring(keyfile=self.keyfile+"x")
+
+
+if __name__ == '__main__':
+    test.main()
@@ -0,0 +1,112 @@
+import os, json, pdb, tempfile, time
+import unittest as test
+from io import StringIO
+
+import jwt
+
+from nistoar.auth import mint
+
+CONFIG = { "jwt": { "secret": "hush!", "lifetime": 600 } }
+
+def make_records(count):
+    return ["%s\n" % json.dumps({"userDetails": {"userId": "user%d" % i, "userName": "Gurn",
+                                                 "userOU": "MML"}})
+            for i in range(count)]
+
+class TestMint(test.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cfgfile = os.path.join(self.tmpdir.name, "config.json")
+        with open(self.cfgfile, 'w') as fd:
+            json.dump(CONFIG, fd)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_load_jwt_config(self):
+        self.assertEqual(mint.load_jwt_config(self.cfgfile), CONFIG['jwt'])
+        with open(self.cfgfile, 'w') as fd:
+            json.dump(CONFIG['jwt'], fd)
+        self.assertEqual(mint.load_jwt_config(self.cfgfile), CONFIG['jwt'])
+
+    def check_output(self, lines, count):
+        self.assertEqual(len(lines), count)
+        for i, line in enumerate(lines):
+            rec = json.loads(line)
+            self.assertEqual(rec['userDetails']['userId'], "user%d" % i)
+            self.assertEqual(rec['userDetails']['userOU'], "MML")
+            claims = jwt.decode(rec['token'], "hush!", algorithms=["HS256"])
+            self.assertEqual(claims['sub'], "user%d" % i)
+            self.assertEqual(claims['userOU'], "MML")
+
+    def test_mint(self):
+        recs = make_records(7)
+        recs.insert(3, "\n")
+        recs.insert(5, "{goob\n")
+        recs.append(json.dumps({"userDetails": {"userName": "Nobody"}})+"\n")
+        out = StringIO()
+        err = StringIO()
+
+        self.assertEqual(mint.mint(recs, out, CONFIG['jwt'], batchsize=3, errstrm=err), (7, 2))
+        self.check_output(out.getvalue().splitlines(), 7)
+        errs = err.getvalue().splitlines()
+        self.assertEqual(len(errs), 2)
+        self.assertIn("line 6: bad credential record", errs[0])
+        self.assertIn("line 10: missing userId", errs[1])
+
+    def test_expires(self):
+        now = time.time()
+        recs = [{"userDetails": {"userId": "user0", "userOU": "MML"}, "expires": now + 1e8},
+                {"userDetails": {"userId": "user1", "userOU": "MML"}, "expires": now + 100},
+                {"userDetails": {"userId": "user2", "userOU": "MML"}},
+                {"userDetails": {"userId": "user3"}, "expires": now - 10},
+                {"userDetails": {"userId": "user4"}, "expires": "tomorrow"}]
+        out = StringIO()
+        err = StringIO()
+        self.assertEqual(mint.mint([json.dumps(r)+"\n" for r in recs], out, CONFIG['jwt'],
+                                   errstrm=err),
+                         (3, 2))
+        lines = out.getvalue().splitlines()
+        self.check_output(lines, 3)
+        claims = [jwt.decode(json.loads(l)['token'], "hush!", algorithms=["HS256"])
+                  for l in lines]
+
+        # the record's expiration can shorten, but not extend, the token's lifetime
+        self.assertLessEqual(claims[0]['exp'], time.time() + 600)
+        self.assertGreater(claims[0]['exp'], now + 590)
+        self.assertLessEqual(claims[1]['exp'], now + 100)
+        self.assertGreater(claims[1]['exp'], now + 90)
+        self.assertNotIn('expires', claims[0])
+        self.assertEqual(json.loads(lines[0])['expires'], recs[0]['expires'])
+
+        errs = err.getvalue().splitlines()
+        self.assertIn("line 4: credential record has expired", errs[0])
+        self.assertIn("line 5: expires is not an epoch time", errs[1])
+
+    def test_mint_parallel(self):
+        out = StringIO()
+        self.assertEqual(mint.mint(make_records(25), out, CONFIG['jwt'], processes=2,
+                                   batchsize=4),
+                         (25, 0))
+        self.check_output(out.getvalue().splitlines(), 25)
+
+    def test_main(self):
+        infile = os.path.join(self.tmpdir.name, "creds.jsonl")
+        outfile = os.path.join(self.tmpdir.name, "tokens.jsonl")
+        with open(infile, 'w') as fd:
+            fd.writelines(make_records(5))
+
+        self.assertEqual(mint.main(["-c", self.cfgfile, "-i", infile, "-o", outfile,
+                                    "-p", "1", "-l", "60"]), 0)
+        with open(outfile) as fd:
+            lines = fd.readlines()
+        self.check_output(lines, 5)
+
+        with open(self.cfgfile, 'w') as fd:
+            json.dump({"jwt": {}}, fd)
+        self.assertEqual(mint.main(["-c", self.cfgfile, "-i", infile, "-o", outfile]), 2)
+
+
+if __name__ == '__main__':
+    test.main()
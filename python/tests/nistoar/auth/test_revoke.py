@@ -0,0 +1,119 @@
+import os, pdb, time, tempfile
+import unittest as test
+
+from nistoar.auth import revoke
+from nistoar.auth.wsgi.sessions import SQLiteSessionStore
+
+class TestBloomFilter(test.TestCase):
+
+    def test_ctor(self):
+        filt = revoke.BloomFilter(1000, 0.01)
+        self.assertEqual(filt.capacity, 1000)
+        self.assertEqual(filt.count, 0)
+        self.assertGreater(filt.nbits, 1000)
+        self.assertGreater(filt.nhashes, 1)
+        self.assertEqual(filt.size, (filt.nbits + 7) // 8)
+
+        with self.assertRaises(ValueError):
+            revoke.BloomFilter(0)
+        with self.assertRaises(ValueError):
+            revoke.BloomFilter(10, 1.5)
+
+    def test_add(self):
+        filt = revoke.BloomFilter(1000, 0.01)
+        self.assertNotIn("goob", filt)
+        filt.add("goob")
+        self.assertIn("goob", filt)
+        self.assertEqual(filt.count, 1)
+
+        items = ["id%d" % i for i in range(1000)]
+        for item in items:
+            filt.add(item)
+        for item in items:
+            self.assertIn(item, filt)
+
+        # false positive rate should be near the target
+        fp = sum(1 for i in range(5000) if ("other%d" % i) in filt)
+        self.assertLess(fp, 150)
+
+class TestRevocationList(test.TestCase):
+
+    def setUp(self):
+        self.revs = revoke.RevocationList(10)
+
+    def test_revoke(self):
+        self.assertEqual(len(self.revs), 0)
+        self.assertFalse(self.revs.is_revoked("a"))
+
+        self.revs.revoke("a", time.time() + 60)
+        self.assertTrue(self.revs.is_revoked("a"))
+        self.assertIn("a", self.revs)
+        self.assertNotIn("b", self.revs)
+        self.assertEqual(len(self.revs), 1)
+
+        # already expired tokens need not be tracked
+        self.revs.revoke("b", time.time() - 1)
+        self.revs.revoke("c", None)
+        self.assertEqual(len(self.revs), 1)
+        self.assertFalse(self.revs.is_revoked("b"))
+
+        stats = self.revs.stats()
+        self.assertEqual(stats['revoked'], 1)
+        self.assertEqual(stats['checks'], 5)
+        self.assertGreaterEqual(stats['filtered'], 3)
+
+    def test_expire(self):
+        self.revs.revoke("a", time.time() + 0.1)
+        self.revs.revoke("b", time.time() + 60)
+        self.assertTrue(self.revs.is_revoked("a"))
+        time.sleep(0.15)
+        self.assertFalse(self.revs.is_revoked("a"))
+        self.assertEqual(self.revs.prune(), 1)
+        self.assertEqual(len(self.revs), 1)
+        self.assertTrue(self.revs.is_revoked("b"))
+
+    def test_grow(self):
+        exp = time.time() + 60
+        for i in range(50):
+            self.revs.revoke("id%d" % i, exp)
+        self.assertEqual(len(self.revs), 50)
+        self.assertGreaterEqual(self.revs._filter.capacity, 50)
+        for i in range(50):
+            self.assertTrue(self.revs.is_revoked("id%d" % i))
+
+    def test_rebuild(self):
+        for i in range(8):
+            self.revs.revoke("id%d" % i, time.time() + 0.05)
+        self.revs.revoke("keep", time.time() + 60)
+        time.sleep(0.1)
+        self.assertEqual(self.revs.prune(), 8)
+        self.assertEqual(self.revs._filter.count, 1)
+        self.assertTrue(self.revs.is_revoked("keep"))
+
+    def test_shared_store(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = SQLiteSessionStore(os.path.join(tmpdir, "revoked.db"))
+            revs1 = revoke.RevocationList(10, store=store)
+            revs2 = revoke.RevocationList(10, store=SQLiteSessionStore(store.dbfile))
+            self.assertFalse(revs1.is_revoked("a"))
+            self.assertFalse(revs2.is_revoked("a"))
+
+            # a revocation made via one list is seen by the other
+            revs1.revoke("a", time.time() + 60)
+            self.assertTrue(revs1.is_revoked("a"))
+            self.assertTrue(revs2.is_revoked("a"))
+            self.assertFalse(revs2.is_revoked("b"))
+            revs2.revoke("b", time.time() + 0.1)
+            self.assertTrue(revs1.is_revoked("b"))
+            self.assertEqual(len(store), 2)
+
+            # and expires with its token
+            time.sleep(0.15)
+            self.assertFalse(revs1.is_revoked("b"))
+            self.assertFalse(revs2.is_revoked("b"))
+            self.assertEqual(store.purge(), 1)
+            self.assertTrue(revs2.is_revoked("a"))
+
+
+if __name__ == '__main__':
+    test.main()
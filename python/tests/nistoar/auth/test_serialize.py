@@ -0,0 +1,67 @@
+import os, json, pdb
+import unittest as test
+from collections import OrderedDict
+
+from nistoar.auth import serialize
+
+DATA = OrderedDict([
+    ("userDetails", OrderedDict([("userId", "me"), ("userName", "Gürn"), ("groups", ["a", "b"])])),
+    ("token", "abc"),
+    ("expires", 1700000000.5)
+])
+
+class TestSerialize(test.TestCase):
+
+    def tearDown(self):
+        serialize.set_backend()
+
+    def test_default_backend(self):
+        self.assertEqual(serialize.backend, "orjson" if serialize.orjson else "json")
+
+    def test_set_backend(self):
+        serialize.set_backend("json")
+        self.assertEqual(serialize.backend, "json")
+        with self.assertRaises(ValueError):
+            serialize.set_backend("goober")
+
+    def check_backend(self):
+        out = serialize.dumps(DATA)
+        self.assertEqual(json.loads(out), DATA)
+        self.assertIn('\n  "token": "abc"', out)
+        self.assertEqual(list(json.loads(out, object_pairs_hook=OrderedDict).keys()),
+                         list(DATA.keys()))
+
+        out = serialize.dumps(DATA, None)
+        self.assertEqual(json.loads(out), DATA)
+        self.assertNotIn(' ', out.replace("Gürn", ""))
+
+        out = serialize.dumps({"a": [1]}, 4)
+        self.assertEqual(out, json.dumps({"a": [1]}, indent=4))
+        self.assertEqual(json.loads(serialize.dumps({3: "int key"})), {"3": "int key"})
+
+        self.assertEqual(serialize.loads(serialize.dumps(DATA, None)), DATA)
+        self.assertEqual(serialize.loads(serialize.dumps(DATA).encode('utf-8')), DATA)
+        with self.assertRaises(ValueError):
+            serialize.loads("{goob")
+
+    def test_json(self):
+        serialize.set_backend("json")
+        self.check_backend()
+        self.assertEqual(serialize.dumps(DATA), json.dumps(DATA, indent=2))
+
+    @test.skipIf(not serialize.orjson, "orjson package not installed")
+    def test_orjson(self):
+        serialize.set_backend("orjson")
+        self.check_backend()
+        ascii = OrderedDict(DATA)
+        ascii['userDetails'] = OrderedDict(ascii['userDetails'], userName="Gurn")
+        self.assertEqual(serialize.dumps(ascii), json.dumps(ascii, indent=2))
+
+        # non-ASCII characters are escaped, as by the stdlib
+        self.assertEqual(serialize.dumps(DATA), json.dumps(DATA, indent=2))
+        self.assertEqual(serialize.dumps(DATA, None), json.dumps(DATA, separators=(',', ':')))
+        self.assertIn('G\\u00fcrn', serialize.dumps(DATA))
+
+
+if __name__ == '__main__':
+    test.main()
@@ -0,0 +1,66 @@
+import os, pdb, time
+import unittest as test
+
+from nistoar.auth import sweeper, cache
+from nistoar.auth.wsgi.sessions import MemorySessionStore
+
+class Broken:
+    def purge(self, limit):
+        raise RuntimeError("oops")
+
+class TestSweeper(test.TestCase):
+
+    def setUp(self):
+        self.store = MemorySessionStore()
+        self.cache = cache.TTLCache(100)
+        self.sweeper = sweeper.Sweeper([self.store, None, self.cache], 0.05, 3, 0)
+
+    def tearDown(self):
+        self.sweeper.stop(2)
+
+    def fill(self, n):
+        now = time.time()
+        for i in range(n):
+            self.store.save("s%d" % i, {"a": i}, now - 1)
+            self.cache.put("c%d" % i, i, now - 1)
+        self.store.save("live", {"a": 0}, now + 60)
+        self.cache.put("live", 0, now + 60)
+
+    def test_ctor(self):
+        self.assertEqual(len(self.sweeper.targets), 2)
+        self.assertTrue(self.sweeper.daemon)
+        self.assertEqual(self.sweeper.stats()['sweeps'], 0)
+        with self.assertRaises(ValueError):
+            sweeper.Sweeper([], batch=0)
+        with self.assertRaises(ValueError):
+            sweeper.Sweeper([], interval=0)
+
+    def test_sweep(self):
+        self.fill(10)
+        self.assertEqual(self.sweeper.sweep(), 20)
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.sweeper.sweep(), 0)
+        stats = self.sweeper.stats()
+        self.assertEqual(stats['sweeps'], 2)
+        self.assertEqual(stats['purged'], 20)
+
+    def test_failing_target(self):
+        self.sweeper.targets.insert(0, Broken())
+        self.fill(2)
+        self.assertEqual(self.sweeper.sweep(), 4)
+
+    def test_thread(self):
+        self.fill(10)
+        self.sweeper.start()
+        deadline = time.time() + 5
+        while (len(self.store) > 1 or len(self.cache) > 1) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(len(self.cache), 1)
+        self.sweeper.stop(2)
+        self.assertFalse(self.sweeper.is_alive())
+
+
+if __name__ == '__main__':
+    test.main()
@@ -1,5 +1,6 @@
-import os, json, pdb, sys, tempfile, re
+import os, json, pdb, sys, tempfile, re, time, shutil, jwt
 import unittest as test
+from unittest import mock
 from pathlib import Path
 from io import StringIO
 from copy import deepcopy
@@ -7,7 +8,9 @@ from copy import deepcopy
 from nistoar.auth.wsgi import flask as flaskapp
 from nistoar.auth.wsgi import config
 from nistoar.auth import creds
+from nistoar.auth.idp import nist_okta, intern
 from nistoar.base.config import ConfigurationException
+from jwt.algorithms import has_crypto
 
 from flask import Response, Request, session
 from werkzeug.datastructures import MultiDict
@@ -348,6 +351,40 @@ class TestAppRoutes(test.TestCase):
                             data={"SAMLResponse": msg, "RelayState": "https://localhost/"})
             self.assertEqual(resp.status_code, 400)
 
+    def test_acs_new_session_id(self):
+        cfg = deepcopy(self.cfg)
+        cfg['session_store'] = { "type": "memory" }
+        cfg['session_sweep'] = False
+        self.app = flaskapp.create_app(cfg)
+        store = self.app.extensions['nistoar.auth']['session_store']
+
+        auth = mock.Mock()
+        auth.get_errors.return_value = []
+        auth.is_authenticated.return_value = True
+        auth.get_attributes.return_value = { nist_okta.ATTR_NAME.GIVEN: ["Gurn"],
+                                             nist_okta.ATTR_NAME.WINID: ["gcranston"] }
+        auth.get_nameid.return_value = "gcranston@nist.gov"
+        auth.get_session_index.return_value = "_abc123"
+        auth.get_session_expiration.return_value = None
+        with self.app.test_client(self.app) as cli:
+            with cli.session_transaction() as sess:
+                sess['AuthNRequestID'] = "_req"
+            presid = cli.get_cookie("session").value
+            self.assertEqual(len(store), 1)
+
+            with mock.patch.object(flaskapp, "create_saml_sp", return_value=auth):
+                resp = cli.post("/sso/saml/acs", data={"SAMLResponse": "x"})
+            self.assertIn(resp.status_code, (200, 302))
+            self.assertNotEqual(cli.get_cookie("session").value, presid)
+            self.assertEqual(len(store), 1)
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertEqual(resp.json['userDetails']['userName'], "Gurn")
+
+            # the pre-login session identifier no longer works
+            cli.set_cookie("session", presid)
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertEqual(resp.status_code, 401)
+
     def test_get_user_info(self):
         with self.app.test_client(self.app) as cli:
             resp = cli.get("/sso/auth/_logininfo")
@@ -358,6 +395,507 @@ class TestAppRoutes(test.TestCase):
             resp = cli.get("/sso/auth/_tokeninfo")
             self.assertEqual(resp.status_code, 401)  # not logged in
 
+    def test_introspect(self):
+        tok = creds.default_token_generator.generate("gurn", {"userName": "Gurn"})
+        with self.app.test_client(self.app) as cli:
+            resp = cli.post("/sso/auth/_introspect", data={"token": tok})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIs(resp.json['active'], True)
+            self.assertEqual(resp.json['sub'], "gurn")
+            self.assertEqual(resp.json['userName'], "Gurn")
+            self.assertIn('exp', resp.json)
+
+            resp = cli.post("/sso/auth/_introspect", json={"token": tok})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIs(resp.json['active'], True)
+            self.assertEqual(resp.json['sub'], "gurn")
+
+            resp = cli.post("/sso/auth/_introspect", headers={"Authorization": "Bearer "+tok})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIs(resp.json['active'], True)
+            self.assertEqual(resp.json['sub'], "gurn")
+
+            resp = cli.post("/sso/auth/_introspect", data={"token": tok[:-4]+"AAAA"})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json, {"active": False})
+
+            resp = cli.post("/sso/auth/_introspect", data={"token": "goober"})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json, {"active": False})
+
+            tok = creds.default_token_generator.generate("gurn", {"userName": "Gurn"}, -10)
+            resp = cli.post("/sso/auth/_introspect", data={"token": tok})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json, {"active": False})
+
+            resp = cli.post("/sso/auth/_introspect")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_revocation(self):
+        cfg = deepcopy(self.cfg)
+        cfg['disabled_saml_login'] = { "engaged": True, "testuser": { "id": "goober" } }
+        cfg['revocation'] = { "capacity": 100 }
+        self.app = flaskapp.create_app(cfg)
+
+        with self.app.test_client(self.app) as cli:
+            resp = cli.get("/sso/auth/_tokeninfo")
+            self.assertEqual(resp.status_code, 200)
+            tok = resp.json['token']
+            self.assertEqual(len(session['issuedTokens']), 1)
+
+            resp = cli.post("/sso/auth/_introspect", data={"token": tok})
+            self.assertIs(resp.json['active'], True)
+
+            resp = cli.get("/sso/saml/logout", follow_redirects=False)
+            self.assertEqual(resp.status_code, 302)
+            self.assertNotIn('issuedTokens', session)
+
+            # the revoked token is reported as inactive, even though it was cached
+            resp = cli.post("/sso/auth/_introspect", data={"token": tok})
+            self.assertEqual(resp.json, {"active": False})
+        self.assertIsNone(creds.default_token_generator.revocations.store)
+
+        # revocations are shared between processes via an sqlite session store
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cfg['session_store'] = { "type": "sqlite", "path": os.path.join(tmpdir, "s.db") }
+            cfg['session_sweep'] = False
+            self.app = flaskapp.create_app(cfg)
+            store = self.app.extensions['nistoar.auth']['session_store']
+            revs = creds.default_token_generator.revocations
+            self.assertIs(revs.store, store)
+            with self.app.test_client(self.app) as cli:
+                tok = cli.get("/sso/auth/_tokeninfo").json['token']
+                cli.get("/sso/saml/logout", follow_redirects=False)
+            jti = jwt.decode(tok, options={"verify_signature": False})['jti']
+            self.assertIsNotNone(store.load(revs.RECORD_PREFIX+jti))
+
+        cfg['session_store'] = { "type": "memory" }
+        self.app = flaskapp.create_app(cfg)
+        self.assertIsNone(creds.default_token_generator.revocations.store)
+
+    def test_token_profiles(self):
+        cfg = deepcopy(self.cfg)
+        cfg['disabled_saml_login'] = { "engaged": True, "testuser": { "id": "goober" } }
+        cfg['jwt'] = dict(cfg['jwt'], claim_profiles={
+            "default": { "include": ["userName", "userLastName", "userEmail"] },
+            "mini":    { "include": ["userEmail"], "audience": "urn:mini",
+                         "endpoints": ["https://localhost/mini/"] }
+        })
+        self.app = flaskapp.create_app(cfg)
+
+        with self.app.test_client(self.app) as cli:
+            resp = cli.get("/sso/auth/_tokeninfo")
+            self.assertEqual(resp.status_code, 200)
+            data = creds.default_token_generator.decode(resp.json['token'])
+            self.assertEqual(data['userName'], "Test")
+            self.assertNotIn('winId', data)
+            self.assertNotIn('aud', data)
+
+            resp = cli.get("/sso/auth/_tokeninfo?audience=mini")
+            data = creds.default_token_generator.decode(resp.json['token'])
+            self.assertEqual(data['aud'], "urn:mini")
+            self.assertNotIn('userName', data)
+            self.assertIn('userEmail', data)
+
+            resp = cli.get("/sso/auth/_tokeninfo",
+                           headers={"Referer": "https://localhost/mini/home"})
+            data = creds.default_token_generator.decode(resp.json['token'])
+            self.assertEqual(data['aud'], "urn:mini")
+
+    def test_refresh(self):
+        with self.app.test_client(self.app) as cli:
+            resp = cli.post("/sso/auth/_refresh", data={"refresh_token": "goober"})
+            self.assertEqual(resp.status_code, 404)   # not enabled
+
+        cfg = deepcopy(self.cfg)
+        cfg['disabled_saml_login'] = { "engaged": True, "testuser": { "id": "goober" } }
+        cfg['jwt'] = dict(cfg['jwt'], lifetime=300, refresh={"lifetime": 3600})
+        cfg['revocation'] = { "capacity": 1000 }
+        self.app = flaskapp.create_app(cfg)
+
+        with self.app.test_client(self.app) as cli:
+            resp = cli.get("/sso/auth/_tokeninfo")
+            self.assertEqual(resp.status_code, 200)
+            reftok = resp.json['refreshToken']
+            self.assertIn('token', resp.json)
+            self.assertEqual(len(session['issuedTokens']), 2)
+
+        with self.app.test_client(self.app) as cli:
+            resp = cli.post("/sso/auth/_refresh", data={"refresh_token": reftok})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['userDetails']['userId'], "goober")
+            data = creds.default_token_generator.decode(resp.json['token'])
+            self.assertEqual(data['sub'], "goober")
+            newref = resp.json['refreshToken']
+            self.assertNotEqual(newref, reftok)
+
+            # the old refresh token can no longer be used
+            resp = cli.post("/sso/auth/_refresh", json={"refresh_token": reftok})
+            self.assertEqual(resp.status_code, 401)
+
+            resp = cli.post("/sso/auth/_refresh", json={"refresh_token": newref})
+            self.assertEqual(resp.status_code, 200)
+
+            resp = cli.post("/sso/auth/_refresh")
+            self.assertEqual(resp.status_code, 400)
+
+            # refresh tokens are not accepted as access tokens
+            resp = cli.post("/sso/auth/_introspect", data={"token": newref})
+            self.assertEqual(resp.status_code, 200)
+            self.assertFalse(resp.json['active'])
+
+    def test_json_format(self):
+        cfg = deepcopy(self.cfg)
+        cfg['disabled_saml_login'] = { "engaged": True, "testuser": { "id": "goober" } }
+        self.app = flaskapp.create_app(cfg)
+        with self.app.test_client(self.app) as cli:
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertIn(b'\n  "userDetails"', resp.data)
+
+        cfg['json_format'] = "compact"
+        self.app = flaskapp.create_app(cfg)
+        with self.app.test_client(self.app) as cli:
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.data.startswith(b'{"userDetails":{"userId":"goober"'))
+            resp = cli.get("/sso/auth/_tokeninfo")
+            self.assertNotIn(b'\n', resp.data)
+            self.assertIn('token', resp.json)
+
+        cfg['json_format'] = "negotiate"
+        self.app = flaskapp.create_app(cfg)
+        with self.app.test_client(self.app) as cli:
+            resp = cli.get("/sso/auth/_logininfo", headers={"Accept": "application/json"})
+            self.assertNotIn(b'\n', resp.data)
+            resp = cli.get("/sso/auth/_logininfo",
+                           headers={"Accept": "text/html,application/xml;q=0.9,*/*;q=0.8"})
+            self.assertIn(b'\n  "userDetails"', resp.data)
+
+        cfg['json_format'] = "ugly"
+        with self.assertRaises(ConfigurationException):
+            flaskapp.create_app(cfg)
+
+    def login_session(self, cli, expires=600):
+        attrs = {
+            nist_okta.ATTR_NAME.GIVEN:  ["Gurn"],
+            nist_okta.ATTR_NAME.FAMILY: ["Cranston"],
+            nist_okta.ATTR_NAME.EMAIL:  ["gurn.cranston@nist.gov"],
+            nist_okta.ATTR_NAME.WINID:  ["gcranston"]
+        }
+        with cli.session_transaction() as sess:
+            sess['samlAuthenticated'] = True
+            sess['samlUserAttrs'] = attrs
+            sess['samlNameId'] = "gcranston@nist.gov"
+            sess['samlSessionIndex'] = "_abc123"
+            sess['samlSessionExpiration'] = int(time.time()) + expires
+
+    def test_credentials_cache(self):
+        # caching is off by default
+        self.assertIsNone(self.app.extensions['nistoar.auth']['credentials_cache'])
+
+        cfg = deepcopy(self.cfg)
+        cfg['expose_stats'] = True
+        cfg['credentials_cache_size'] = 1024
+        self.app = flaskapp.create_app(cfg)
+        cache = self.app.extensions['nistoar.auth']['credentials_cache']
+        self.assertEqual(cache.maxsize, 1024)
+
+        with self.app.test_client(self.app) as cli:
+            self.login_session(cli)
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['userDetails']['userId'], "gcranston")
+            self.assertEqual(resp.json['userDetails']['userName'], "Gurn")
+            self.assertGreater(resp.json['expires'], time.time())
+            self.assertEqual(cache.misses, 1)
+            self.assertEqual(cache.hits, 0)
+
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertEqual(resp.json['userDetails']['userName'], "Gurn")
+            self.assertEqual(cache.hits, 1)
+
+            with mock.patch.object(creds.CredentialsSnapshot, "thaw") as thaw:
+                resp = cli.get("/sso/auth/_tokeninfo")
+            thaw.assert_not_called()
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(cache.hits, 2)
+            data = creds.default_token_generator.decode(resp.json['token'])
+            self.assertEqual(data['sub'], "gcranston")
+
+            # the cached credentials were not altered by setting the token
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertNotIn('token', resp.json)
+
+            resp = cli.get("/sso/auth/_stats")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['credentials_cache']['hits'], 3)
+            self.assertEqual(resp.json['credentials_cache']['size'], 1)
+            self.assertIn('hit_rate', resp.json['credentials_cache'])
+            self.assertIn('bytes_saved', resp.json['interned_attributes'])
+
+        with self.app.test_client(self.app) as cli:
+            self.login_session(cli, -10)
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertEqual(resp.status_code, 401)
+
+        cfg['credentials_cache_size'] = 0
+        del cfg['expose_stats']
+        self.app = flaskapp.create_app(cfg)
+        self.assertIsNone(self.app.extensions['nistoar.auth']['credentials_cache'])
+        with self.app.test_client(self.app) as cli:
+            self.login_session(cli)
+            with mock.patch.object(intern.table, "intern_attributes") as interner:
+                resp = cli.get("/sso/auth/_logininfo")
+                resp = cli.get("/sso/auth/_logininfo")
+            self.assertEqual(resp.json['userDetails']['userName'], "Gurn")
+            interner.assert_not_called()
+            resp = cli.get("/sso/auth/_stats")
+            self.assertEqual(resp.status_code, 404)
+
+    def test_attribute_map(self):
+        cfg = deepcopy(self.cfg)
+        cfg['attribute_map'] = {
+            "id": nist_okta.ATTR_NAME.EMAIL,
+            "attributes": { "userName": nist_okta.ATTR_NAME.GIVEN },
+            "consume": [ nist_okta.ATTR_NAME.WINID ]
+        }
+        self.app = flaskapp.create_app(cfg)
+        with self.app.test_client(self.app) as cli:
+            self.login_session(cli)
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertEqual(resp.status_code, 200)
+            details = resp.json['userDetails']
+            self.assertEqual(details['userId'], "gurn.cranston@nist.gov")
+            self.assertEqual(details['userName'], "Gurn")
+            self.assertEqual(details['userLastName'], "unknown")
+            self.assertIn(nist_okta.ATTR_NAME.FAMILY, details)
+            self.assertNotIn('winId', details)
+
+        cfg['attribute_map'] = { "id": nist_okta.ATTR_NAME.EMAIL }
+        with self.assertRaises(ConfigurationException):
+            flaskapp.create_app(cfg)
+
+    def test_attribute_maps(self):
+        cfg = deepcopy(self.cfg)
+        tmpdir = tempfile.mkdtemp(prefix="_test_flask.")
+        try:
+            cfg['attribute_maps'] = { "dir": str(basedir / "idp" / "attributemaps"),
+                                      "cache_file": os.path.join(tmpdir, "index.json"),
+                                      "prefer": [ "adfs_v20" ] }
+            cfg['attribute_map'] = {
+                "id": "windowsAccountName",
+                "attributes": { "userName": "givenName", "userLastName": "surname" },
+                "consume": [ "emailAddress" ]
+            }
+            self.app = flaskapp.create_app(cfg)
+            self.assertTrue(os.path.isfile(os.path.join(tmpdir, "index.json")))
+            index = self.app.extensions['nistoar.auth']['attribute_index']
+            self.assertEqual(index.friendly_name(nist_okta.ATTR_NAME.GIVEN), "givenName")
+
+            with self.app.test_client(self.app) as cli:
+                self.login_session(cli)
+                resp = cli.get("/sso/auth/_logininfo")
+                self.assertEqual(resp.status_code, 200)
+                details = resp.json['userDetails']
+                self.assertEqual(details['userName'], "Gurn")
+                self.assertEqual(details['userLastName'], "Cranston")
+                self.assertNotIn(nist_okta.ATTR_NAME.EMAIL, details)
+
+            cfg['attribute_maps'] = { "cache_file": None }
+            with self.assertRaises(ConfigurationException):
+                flaskapp.create_app(cfg)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def test_session_store(self):
+        cfg = deepcopy(self.cfg)
+        cfg['session_store'] = { "type": "memory" }
+        self.app = flaskapp.create_app(cfg)
+        store = self.app.extensions['nistoar.auth']['session_store']
+        self.assertIsNotNone(store)
+
+        with self.app.test_client(self.app) as cli:
+            self.login_session(cli)
+            self.assertEqual(len(store), 1)
+            self.assertNotIn("Gurn", cli.get_cookie("session").value)
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['userDetails']['userName'], "Gurn")
+
+            with cli.session_transaction() as sess:
+                sess.clear()
+            self.assertEqual(len(store), 0)
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertEqual(resp.status_code, 401)
+
+    def test_sliding_session(self):
+        self.assertFalse(getattr(self.app.session_interface, "sliding", False))
+        cfg = deepcopy(self.cfg)
+        cfg['sliding_session'] = True
+        cfg['expose_stats'] = True
+        for store in (None, { "type": "memory" }):
+            if store:
+                cfg['session_store'] = store
+            self.app = flaskapp.create_app(cfg)
+            iface = self.app.session_interface
+            self.assertEqual(iface.refresh_fraction, 0.5)
+
+            with self.app.test_client(self.app) as cli:
+                self.login_session(cli)
+                self.assertIsNotNone(cli.get_cookie("session").expires)
+                for i in range(3):
+                    resp = cli.get("/sso/auth/_logininfo")
+                    self.assertEqual(resp.json['userDetails']['userName'], "Gurn")
+                    self.assertNotIn("Set-Cookie", resp.headers)
+                resp = cli.get("/sso/auth/_stats")
+                self.assertEqual(resp.json['sessions']['writes_avoided'], 3)
+                self.assertEqual(resp.json['sessions']['refreshes'], 0)
+            if self.app.extensions['nistoar.auth']['sweeper']:
+                self.app.extensions['nistoar.auth']['sweeper'].stop(2)
+
+        cfg['sliding_session'] = { "refresh_fraction": 0.25 }
+        self.app = flaskapp.create_app(cfg)
+        self.assertEqual(self.app.session_interface.refresh_fraction, 0.25)
+        self.app.extensions['nistoar.auth']['sweeper'].stop(2)
+
+        cfg['sliding_session'] = { "refresh_fraction": 2 }
+        with self.assertRaises(ConfigurationException):
+            flaskapp.create_app(cfg)
+        del cfg['session_store']
+        cfg['sliding_session'] = True
+        cfg['session_cookie'] = { "compact": False }
+        with self.assertRaises(ConfigurationException):
+            flaskapp.create_app(cfg)
+
+    def test_session_sweep(self):
+        cfg = deepcopy(self.cfg)
+        cfg['session_store'] = { "type": "memory" }
+        cfg['session_sweep'] = { "interval": 0.05 }
+        cfg['credentials_cache_size'] = 100
+        cfg['expose_stats'] = True
+        self.app = flaskapp.create_app(cfg)
+        ext = self.app.extensions['nistoar.auth']
+        store = ext['session_store']
+        sweeper = ext['sweeper']
+        try:
+            self.assertTrue(sweeper.is_alive())
+            self.assertIn(store, sweeper.targets)
+            self.assertIn(ext['credentials_cache'], sweeper.targets)
+
+            # a session expires with its SAML session and is swept away
+            with self.app.test_client(self.app) as cli:
+                self.login_session(cli, 1)
+                self.assertEqual(len(store), 1)
+            deadline = time.time() + 5
+            while len(store) > 0 and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(len(store), 0)
+
+            with self.app.test_client(self.app) as cli:
+                resp = cli.get("/sso/auth/_stats")
+                self.assertGreater(resp.json['sweeper']['purged'], 0)
+        finally:
+            sweeper.stop(2)
+
+        cfg['session_sweep'] = False
+        self.app = flaskapp.create_app(cfg)
+        self.assertIsNone(self.app.extensions['nistoar.auth']['sweeper'])
+
+        del cfg['session_store']
+        cfg['session_sweep'] = {}
+        self.app = flaskapp.create_app(cfg)
+        self.assertIsNone(self.app.extensions['nistoar.auth']['sweeper'])
+
+        cfg['session_store'] = { "type": "memory" }
+        cfg['session_sweep'] = { "batch": 0 }
+        with self.assertRaises(ConfigurationException):
+            flaskapp.create_app(cfg)
+
+    def test_session_cookie(self):
+        from nistoar.auth.wsgi import sessions
+        self.assertNotIsInstance(self.app.session_interface,
+                                 sessions.CompactCookieSessionInterface)
+
+        # turning on the compact cookie does not end existing sessions
+        cfg = deepcopy(self.cfg)
+        cfg['session_cookie'] = { "compact": True }
+        with self.app.test_client(self.app) as cli:
+            self.login_session(cli)
+            self.app = flaskapp.create_app(cfg)
+            self.assertIsInstance(self.app.session_interface,
+                                  sessions.CompactCookieSessionInterface)
+            self.assertTrue(self.app.session_interface.compress)
+            cli.application = self.app
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertEqual(resp.json['userDetails']['userName'], "Gurn")
+            self.assertIn("Set-Cookie", resp.headers)
+
+        cfg['session_cookie'] = { "compact": True, "compress": False }
+        self.app = flaskapp.create_app(cfg)
+        self.assertFalse(self.app.session_interface.compress)
+        with self.app.test_client(self.app) as cli:
+            self.login_session(cli)
+            self.assertFalse(cli.get_cookie("session").value.startswith('.'))
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertEqual(resp.json['userDetails']['userName'], "Gurn")
+
+        cfg['session_cookie'] = { "compact": False }
+        cfg['sliding_session'] = True
+        with self.assertRaises(ConfigurationException):
+            flaskapp.create_app(cfg)
+        cfg['session_cookie'] = {}
+        self.app = flaskapp.create_app(cfg)
+        self.assertIsInstance(self.app.session_interface,
+                              sessions.CompactCookieSessionInterface)
+
+    def test_idp_profile(self):
+        cfg = deepcopy(self.cfg)
+        cfg['idp_profile'] = "nist_ms"
+        self.app = flaskapp.create_app(cfg)
+        with self.app.test_client(self.app) as cli:
+            self.login_session(cli)
+            resp = cli.get("/sso/auth/_logininfo")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['userDetails']['userOU'], "not-set")
+
+        cfg['idp_profile'] = "goob"
+        with self.assertRaises(ConfigurationException):
+            flaskapp.create_app(cfg)
+
+    def test_jwks(self):
+        with self.app.test_client(self.app) as cli:
+            resp = cli.get("/sso/auth/.well-known/jwks.json")
+            self.assertEqual(resp.status_code, 404)  # HS256 tokens
+
+    @test.skipIf(not has_crypto, "cryptography package not installed")
+    def test_jwks_asymmetric(self):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            keyfile = os.path.join(tmpdir, "sign.pem")
+            with open(keyfile, 'wb') as fd:
+                fd.write(ec.generate_private_key(ec.SECP256R1()).private_bytes(
+                    serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                    serialization.NoEncryption()))
+            cfg = deepcopy(self.cfg)
+            cfg['jwt'] = {"algorithm": "ES256", "private_key_file": keyfile, "kid": "k1"}
+            self.app = flaskapp.create_app(cfg)
+
+        with self.app.test_client(self.app) as cli:
+            resp = cli.get("/sso/auth/.well-known/jwks.json")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.content_type, "application/json")
+            self.assertEqual(resp.json['keys'][0]['kid'], "k1")
+            self.assertEqual(resp.json['keys'][0]['kty'], "EC")
+            self.assertIn("max-age=3600", resp.headers['Cache-Control'])
+            etag = resp.headers['ETag']
+            self.assertTrue(etag)
+
+            resp = cli.get("/sso/auth/.well-known/jwks.json",
+                           headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+
     def test_metadata(self):
         with self.app.test_client(self.app) as cli:
             resp = cli.get("/sso/metadata/")
@@ -0,0 +1,415 @@
+import unittest as test
+import os, time, tempfile, shutil, threading
+from pathlib import Path
+from datetime import timedelta
+from unittest import mock
+
+from flask import Flask, session
+from flask.sessions import SecureCookieSessionInterface
+
+from nistoar.auth.wsgi import sessions
+from nistoar.base.config import ConfigurationException
+
+class StoreTests:
+    # tests common to all SessionStore implementations
+
+    def test_save_load(self):
+        self.assertIsNone(self.store.load("goob"))
+        data = {"samlUserAttrs": {"urn:ou": ["ODI", "MML"]}, "samlAuthenticated": True}
+        self.store.save("goob", data, time.time() + 60)
+        self.assertEqual(self.store.load("goob"), data)
+        self.assertEqual(len(self.store), 1)
+
+        data['samlNameId'] = "gurn"
+        self.store.save("goob", data, time.time() + 60)
+        self.assertEqual(self.store.load("goob")['samlNameId'], "gurn")
+        self.assertEqual(len(self.store), 1)
+
+        self.store.delete("goob")
+        self.assertIsNone(self.store.load("goob"))
+        self.store.delete("goob")
+
+    def test_expiration(self):
+        self.store.save("goob", {"a": 1}, time.time() - 1)
+        self.store.save("gurn", {"a": 2}, time.time() + 60)
+        self.assertIsNone(self.store.load("goob"))
+        self.assertEqual(self.store.load("gurn"), {"a": 2})
+
+        self.store.touch("gurn", time.time() - 1)
+        self.assertIsNone(self.store.load("gurn"))
+
+        self.store.purge()
+        self.store.save("hank", {"a": 3}, time.time() + 60)
+        self.store.touch("hank", time.time() - 1)
+        self.store.save("bob", {"a": 4}, time.time() + 60)
+        self.assertEqual(self.store.purge(), 1)
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(self.store.load("bob"), {"a": 4})
+
+    def test_take(self):
+        self.store.save("goob", {"a": 1}, time.time() + 60)
+        self.store.save("gurn", {"a": 2}, time.time() - 1)
+        self.assertEqual(self.store.take("goob"), {"a": 1})
+        self.assertIsNone(self.store.take("goob"))
+        self.assertIsNone(self.store.load("goob"))
+        self.assertIsNone(self.store.take("gurn"))
+
+    def test_take_concurrent(self):
+        # of many threads taking the same session, exactly one gets it
+        self.store.save("goob", {"a": 1}, time.time() + 60)
+        barrier = threading.Barrier(8)
+        got = []
+        def take():
+            barrier.wait()
+            got.append(self.store.take("goob"))
+        threads = [threading.Thread(target=take) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([g for g in got if g is not None], [{"a": 1}])
+
+    def test_purge_limit(self):
+        now = time.time()
+        for i in range(10):
+            self.store.save("s%d" % i, {"a": i}, now - 10 + i)
+        self.store.save("live", {"a": 0}, now + 60)
+        self.assertEqual(self.store.purge(3), 3)
+        self.assertEqual(len(self.store), 8)
+        self.assertEqual(self.store.purge(3), 3)
+        self.assertEqual(self.store.purge(), 4)
+        self.assertEqual(self.store.purge(3), 0)
+        self.assertEqual(len(self.store), 1)
+
+class SlidingTests:
+    # tests of the sliding expiration mode common to the session interfaces
+
+    def test_sliding(self):
+        with self.assertRaises(ValueError):
+            self.make_interface(1.5)
+        self.assertFalse(self.app.session_interface.sliding)
+        self.app.session_interface = iface = self.make_interface(0.5)
+        self.app.permanent_session_lifetime = timedelta(seconds=100)
+        self.assertTrue(iface.sliding)
+        now = time.time()
+
+        with self.app.test_client() as cli:
+            # a modified session is always written, with an expiration
+            resp = cli.get("/set/goob")
+            self.assertIn("Expires=", resp.headers["Set-Cookie"])
+            self.assertEqual(iface.stats()['refreshes'], 0)
+
+            # an unmodified one is not rewritten until half its lifetime has passed
+            resp = cli.get("/get")
+            self.assertNotIn("Set-Cookie", resp.headers)
+            self.assertEqual(iface.writes_avoided, 1)
+            with mock.patch.object(time, "time", return_value=now+30):
+                resp = cli.get("/get")
+            self.assertNotIn("Set-Cookie", resp.headers)
+            self.assertEqual(iface.writes_avoided, 2)
+            with mock.patch.object(time, "time", return_value=now+60):
+                resp = cli.get("/get")
+                self.assertIn("Set-Cookie", resp.headers)
+                self.assertEqual(iface.refreshes, 1)
+                self.assertTrue(resp.text.startswith("goob"))
+                resp = cli.get("/get")
+                self.assertNotIn("Set-Cookie", resp.headers)
+
+            # the session does not outlive its SAML session, which is never extended
+            with cli.session_transaction() as sess:
+                sess['samlSessionExpiration'] = int(now) + 10
+            self.assertEqual(cli.get_cookie("session").expires.timestamp(), int(now) + 10)
+            with mock.patch.object(time, "time", return_value=now+80):
+                resp = cli.get("/get")
+            self.assertNotIn("Set-Cookie", resp.headers)
+            self.assertEqual(iface.stats()['refreshes'], 1)
+
+class TestMemorySessionStore(StoreTests, test.TestCase):
+
+    def setUp(self):
+        self.store = sessions.MemorySessionStore()
+
+    def test_bound(self):
+        self.store = sessions.MemorySessionStore(3)
+        now = time.time()
+        self.store.save("a", {"a": 1}, now + 600)
+        self.store.save("b", {"a": 2}, now + 60)
+        self.store.save("c", {"a": 3}, now + 600)
+        self.store.save("d", {"a": 4}, now + 300)
+        self.assertEqual(len(self.store), 3)
+        self.assertIsNone(self.store.load("b"))
+        self.assertEqual(self.store.evictions, 1)
+        self.store.save("e", {"a": 5}, now + 900)
+        self.assertIsNone(self.store.load("d"))
+        self.assertEqual(self.store.load("a"), {"a": 1})
+
+        with self.assertRaises(ValueError):
+            sessions.MemorySessionStore(0)
+
+    def test_index(self):
+        now = time.time()
+        self.store.save("goob", {"a": 1}, now - 1)
+        self.store.touch("goob", now + 60)
+        self.store.touch("goob", now + 60)
+        self.store.save("gurn", {"a": 2}, now - 1)
+        self.store.delete("gurn")
+        self.assertEqual(len(self.store._expiries), 3)
+        self.assertEqual(self.store.purge(), 0)
+        self.assertEqual(self.store.load("goob"), {"a": 1})
+        self.assertEqual(len(self.store._expiries), 1)
+
+        # stale index entries do not accumulate
+        for i in range(1000):
+            self.store.touch("goob", now + 60 + i)
+        self.assertLessEqual(len(self.store._expiries), 66)
+        self.assertEqual(self.store.purge(), 0)
+        self.assertEqual(len(self.store), 1)
+
+class TestSQLiteSessionStore(StoreTests, test.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="_test_sessions.")
+        self.store = sessions.SQLiteSessionStore(os.path.join(self.tmpdir, "sessions.db"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_shared(self):
+        other = sessions.SQLiteSessionStore(self.store.dbfile)
+        self.store.save("goob", {"a": (1, 2)}, time.time() + 60)
+        self.assertEqual(other.load("goob"), {"a": (1, 2)})
+        mode = self.store._conn().execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
+    def test_schema_connection_not_kept(self):
+        self.assertIsNone(getattr(self.store._local, 'conn', None))
+
+    @test.skipUnless(hasattr(os, 'fork'), "requires os.fork()")
+    def test_fork(self):
+        parent = self.store._conn()
+        self.store.save("goob", {"a": 1}, time.time() + 60)
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # the child must open its own connection
+            ok = False
+            try:
+                ok = self.store._conn() is not parent and self.store.load("goob") == {"a": 1}
+                self.store.save("gurn", {"a": 2}, time.time() + 60)
+            finally:
+                os.write(wfd, b"1" if ok else b"0")
+                os._exit(0)
+        os.close(wfd)
+        result = os.read(rfd, 1)
+        os.close(rfd)
+        os.waitpid(pid, 0)
+        self.assertEqual(result, b"1")
+        self.assertIs(self.store._conn(), parent)
+        self.assertEqual(self.store.load("gurn"), {"a": 2})
+
+class TestCreateSessionStore(test.TestCase):
+
+    def test_create(self):
+        self.assertIsInstance(sessions.create_session_store({}), sessions.MemorySessionStore)
+        tmpdir = tempfile.mkdtemp(prefix="_test_sessions.")
+        try:
+            store = sessions.create_session_store({"type": "sqlite", "path": "s.db"}, tmpdir)
+            self.assertIsInstance(store, sessions.SQLiteSessionStore)
+            self.assertTrue(os.path.isfile(os.path.join(tmpdir, "s.db")))
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        self.assertEqual(sessions.create_session_store({"max_sessions": 5}).max_sessions, 5)
+        for cfg in ([], {"type": "goob"}, {"type": "sqlite"}, {"max_sessions": 0},
+                    {"type": "sqlite", "path": "/goob/gurn/s.db"}):
+            with self.assertRaises(ConfigurationException):
+                sessions.create_session_store(cfg)
+
+class TestServerSideSessionInterface(SlidingTests, test.TestCase):
+
+    def make_interface(self, refresh_fraction=None):
+        return sessions.ServerSideSessionInterface(self.store, refresh_fraction)
+
+    def setUp(self):
+        self.store = sessions.MemorySessionStore()
+        self.app = Flask(__name__)
+        self.app.secret_key = "hush!"
+        self.app.session_interface = sessions.ServerSideSessionInterface(self.store)
+
+        @self.app.route("/set/<val>")
+        def setval(val):
+            session['val'] = val
+            return "ok"
+
+        @self.app.route("/get")
+        def getval():
+            return session.get('val', "(unset)")
+
+        @self.app.route("/clear")
+        def clear():
+            session.clear()
+            return "ok"
+
+    def test_session(self):
+        with self.app.test_client() as cli:
+            resp = cli.get("/get")
+            self.assertEqual(resp.text, "(unset)")
+            self.assertNotIn("Set-Cookie", resp.headers)
+            self.assertEqual(len(self.store), 0)
+
+            resp = cli.get("/set/goob")
+            cookie = resp.headers["Set-Cookie"]
+            self.assertLess(len(cookie.split(';')[0]), 100)
+            self.assertNotIn("goob", cookie)
+            self.assertEqual(len(self.store), 1)
+            self.assertEqual(cli.get("/get").text, "goob")
+
+            sid = cli.get_cookie("session").value.rsplit('.', 1)[0]
+            self.assertEqual(self.store.load(sid), {"val": "goob"})
+
+            resp = cli.get("/clear")
+            self.assertIn("session=;", resp.headers["Set-Cookie"])
+            self.assertEqual(len(self.store), 0)
+            self.assertEqual(cli.get("/get").text, "(unset)")
+
+    def test_forged_cookie(self):
+        self.store.save("goob", {"val": "hacked"}, time.time() + 60)
+        with self.app.test_client() as cli:
+            cli.set_cookie("session", "goob.xxxx")
+            self.assertEqual(cli.get("/get").text, "(unset)")
+            signer = self.app.session_interface.get_signer(self.app)
+            cli.set_cookie("session", signer.sign("goob").decode())
+            self.assertEqual(cli.get("/get").text, "hacked")
+
+    def test_session_transaction(self):
+        with self.app.test_client() as cli:
+            with cli.session_transaction() as sess:
+                sess['val'] = "gurn"
+            self.assertEqual(cli.get("/get").text, "gurn")
+
+    def test_store_expiration(self):
+        iface = self.app.session_interface
+        lifetime = time.time() + self.app.permanent_session_lifetime.total_seconds()
+        sess = sessions.ServerSideSession({"val": "goob", "samlAuthenticated": True}, "goob")
+        self.assertAlmostEqual(iface.store_expiration(self.app, sess), lifetime, delta=5)
+
+        # the store does not keep a session beyond its SAML session...
+        sess['samlSessionExpiration'] = int(time.time()) + 600
+        self.assertEqual(iface.store_expiration(self.app, sess), sess['samlSessionExpiration'])
+
+        # ...unless the SAML session has already expired
+        sess['samlSessionExpiration'] = int(time.time()) - 600
+        self.assertAlmostEqual(iface.store_expiration(self.app, sess), lifetime, delta=5)
+
+        # unauthenticated sessions are short-lived
+        del sess['samlAuthenticated']
+        self.assertAlmostEqual(iface.store_expiration(self.app, sess), time.time() + 900,
+                               delta=5)
+        with self.assertRaises(ValueError):
+            sessions.ServerSideSessionInterface(self.store, anonymous_lifetime=0)
+
+    def test_regenerate(self):
+        @self.app.route("/login")
+        def login():
+            session.regenerate()
+            session['samlAuthenticated'] = True
+            return "ok"
+
+        # a session identifier planted before login is not valid afterward
+        self.store.save("planted", {"val": "goob"}, time.time() + 60)
+        signer = self.app.session_interface.get_signer(self.app)
+        planted = signer.sign("planted").decode()
+        with self.app.test_client() as cli:
+            cli.set_cookie("session", planted)
+            self.assertEqual(cli.get("/get").text, "goob")
+            cli.get("/login")
+            self.assertNotEqual(cli.get_cookie("session").value, planted)
+            self.assertEqual(cli.get("/get").text, "goob")
+            self.assertIsNone(self.store.load("planted"))
+            self.assertEqual(len(self.store), 1)
+
+            cli.set_cookie("session", planted)
+            self.assertEqual(cli.get("/get").text, "(unset)")
+
+class TestCompactCookieSessionInterface(SlidingTests, test.TestCase):
+
+    def make_interface(self, refresh_fraction=None):
+        return sessions.CompactCookieSessionInterface(True, refresh_fraction)
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.secret_key = "hush!"
+        self.iface = sessions.CompactCookieSessionInterface()
+        self.app.session_interface = self.iface
+
+        @self.app.route("/set/<val>")
+        def setval(val):
+            session['val'] = val
+            session['groups'] = ("grp-"+val,) * 20
+            return "ok"
+
+        @self.app.route("/get")
+        def getval():
+            return "%s:%s" % (session.get('val', "(unset)"), len(session.get('groups', [])))
+
+    def test_signer(self):
+        ser = self.iface.get_signing_serializer(self.app)
+        self.assertIs(self.iface.get_signing_serializer(self.app), ser)
+        self.app.secret_key = "hush hush!"
+        self.assertIsNot(self.iface.get_signing_serializer(self.app), ser)
+        self.app.secret_key = None
+        self.assertIsNone(self.iface.get_signing_serializer(self.app))
+
+    def test_session(self):
+        with self.app.test_client() as cli:
+            self.assertEqual(cli.get("/get").text, "(unset):0")
+            cli.get("/set/goob")
+            self.assertEqual(cli.get("/get").text, "goob:20")
+            compressed = cli.get_cookie("session").value
+            self.assertTrue(compressed.startswith('.'))
+
+            data = self.iface.get_signing_serializer(self.app).loads(compressed)
+            self.assertEqual(data['groups'], ["grp-goob"] * 20)
+
+            # a cookie from a different interface is not accepted
+            cli.set_cookie("session", compressed[1:])
+            self.assertEqual(cli.get("/get").text, "(unset):0")
+
+        self.iface = sessions.CompactCookieSessionInterface(False)
+        self.app.session_interface = self.iface
+        with self.app.test_client() as cli:
+            cli.get("/set/goob")
+            self.assertEqual(cli.get("/get").text, "goob:20")
+            self.assertFalse(cli.get_cookie("session").value.startswith('.'))
+            self.assertGreater(len(cli.get_cookie("session").value), len(compressed))
+
+    def test_standard_cookie(self):
+        # a session issued by Flask's default interface survives the switch
+        self.app.session_interface = SecureCookieSessionInterface()
+        with self.app.test_client() as cli:
+            cli.get("/set/goob")
+            standard = cli.get_cookie("session").value
+
+            self.app.session_interface = self.iface
+            resp = cli.get("/get")
+            self.assertEqual(resp.text, "goob:20")
+            self.assertIn("Set-Cookie", resp.headers)
+            compact = cli.get_cookie("session").value
+            self.assertNotEqual(compact, standard)
+            data = self.iface.get_signing_serializer(self.app).loads(compact)
+            self.assertEqual(data['val'], "goob")
+
+            resp = cli.get("/get")
+            self.assertEqual(resp.text, "goob:20")
+            self.assertNotIn("Set-Cookie", resp.headers)
+
+            # but not one signed with another key
+            self.app.secret_key = "hush hush!"
+            self.app.session_interface = SecureCookieSessionInterface()
+            cli.get("/set/gurn")
+            self.app.secret_key = "hush!"
+            self.app.session_interface = self.iface
+            self.assertEqual(cli.get("/get").text, "(unset):0")
+                         
+if __name__ == '__main__':
+    test.main()
@@ -0,0 +1,25 @@
+#! /usr/bin/env python3
+#
+# mint-tokens.py:  create authentication tokens in bulk
+#
+# Usage: mint-tokens.py -c CONFIG [-i INPUT] [-o OUTPUT] [-p PROCESSES] [-b BATCHSIZE]
+#
+# This reads credential records as JSON lines and writes them back out with tokens added.
+# Type "mint-tokens.py -h" for more details.
+#
+import os, sys
+
+try:
+    import nistoar
+except ImportError:
+    oarpath = os.environ.get('OAR_PYTHONPATH')
+    if not oarpath and 'OAR_HOME' in os.environ:
+        oarpath = os.path.join(os.environ['OAR_HOME'], "lib", "python")
+    if oarpath:
+        sys.path.insert(0, oarpath)
+    import nistoar
+
+from nistoar.auth import mint
+
+if __name__ == '__main__':
+    sys.exit(mint.main(sys.argv[1:]))